@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmarks for the roster scraper, with the local stand-ins for the roster site and the Calendar API that
+they and the test suite share. Run the scripts as modules from the repository root, e.g.
+`python -m benchmarks.run_benchmarks`.
+"""
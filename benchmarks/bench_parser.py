@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Calendar parser benchmark.
+
+Times `mic_roster_parser.parse_calendar()` against the original `process_response_cal()` implementation over the
+saved month pages in `benchmarks/pages/`, after checking the parser against each page's expected shifts. The
+original function is kept below verbatim (minus the interactive `input()` prompt and the module-level
+`event_dict`) as the baseline. It is also the reference for how cells are dated on pages without day numbers:
+the date advances only on cells with text, which `parse_calendar()` still does for such pages. The corpus pages
+show day numbers, so there `parse_calendar()` dates cells by them instead, and the two differ after an empty cell.
+
+Usage:
+    $ python -m benchmarks.bench_parser [--repeat 20]
+"""
+import argparse
+import datetime
+import glob
+import json
+import os
+import time
+
+from bs4 import BeautifulSoup
+
+import mic_roster_parser
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+def convert_month_to_num(month_string: str):
+    month = {'january': '01', 'february': '02', 'march': '03', 'april': '04',
+             'may': '05', 'june': '06', 'july': '07', 'august': '08',
+             'september': '09', 'october': '10', 'november': '11', 'december': '12'}
+    return month.get(month_string.lower(), 'Invalid')
+
+
+def legacy_process_response_cal(response, event_dict):
+    soup = BeautifulSoup(response, 'html.parser')
+    month_heading = soup.find('span', id='ctl00_ContentPlaceHolder1_calendar_lblCurrentMonth')
+    if month_heading:
+        month = month_heading.get_text(strip=True)
+    else:
+        month = None
+
+    cell_data = {}
+    date = 1
+    for cell in range(1, 40):
+        cell_id = f"ctl00_ContentPlaceHolder1_calendar_DateCell{cell}"
+        cell_content = soup.find('td', id=cell_id)
+        if cell_content:
+            div_content = cell_content.find('div')
+            cell_text = div_content.get_text(strip=True) if div_content else ""
+            cell_text = cell_text.replace(")", ") ") if ")" in cell_text else cell_text
+            cell_data[date] = cell_text
+            if cell_text:
+                if date < 10:
+                    d = f"0{date}"
+                else:
+                    d = date
+                if cell_text.split(" ")[0] != "OFF" and cell_text.split(" ")[0] != "PH" and cell_text.split(" ")[
+                    0] != "OT" and cell_text.split(" ")[0] != "NA" and cell_text.split(" ")[0] != "SICK" and \
+                        cell_text.split(" ")[0] != "Not":
+                    date_text = month.split(" ")
+                    shift_text = cell_text.split(" ")
+                    time_text = cell_text.split(" ")[0].split("-")
+                    try:
+                        event = {
+                            'summary': f'{shift_text[2]}',
+                            'location': '25 Garden Street Eveleigh NSW 2015',
+                            'description': f'Date shift last updated: {datetime.datetime.now().strftime("%d/%m/%Y %H:%M")}',
+                            'start': {
+                                'dateTime': f'{date_text[1]}-{convert_month_to_num(date_text[0])}-{d}T'
+                                            f'{time_text[0][:2]}:{time_text[0][2:]}:00',
+                                'timeZone': 'Australia/Sydney',
+                            },
+                            'end': {
+                                'dateTime': f'{date_text[1]}-{convert_month_to_num(date_text[0])}-{d}T'
+                                            f'{time_text[1][:2]}:{time_text[1][2:]}:00',
+                                'timeZone': 'Australia/Sydney',
+                            },
+                            'reminders': {
+                                'useDefault': False,
+                                'overrides': [
+                                    {'method': 'email', 'minutes': 24 * 60},
+                                    {'method': 'email', 'minutes': 12 * 60},
+                                    {'method': 'popup', 'minutes': 12 * 60},
+                                    {'method': 'popup', 'minutes': 60},
+                                    {'method': 'popup', 'minutes': 10},
+                                ]
+                            }
+                        }
+                        event_dict[
+                            (f'{date_text[1]}-{convert_month_to_num(date_text[0])}-{d}T'
+                             f'{time_text[0][:2]}:{time_text[0][2:]}:00')] = event
+                    except Exception:
+                        print(f"Error with {shift_text}")
+                date += 1
+    return event_dict
+
+
+def load_pages(pages_dir: str = PAGES_DIR) -> list:
+    """Reads every saved month page, in file name order."""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+        with open(path, encoding='utf-8') as f:
+            pages.append(f.read())
+    return pages
+
+
+def time_parser(parse, pages: list, repeat: int) -> float:
+    """Returns the best per-page parse time in seconds over `repeat` passes of all pages."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for page in pages:
+            parse(page)
+        best = min(best, (time.perf_counter() - started) / len(pages))
+    return best
+
+
+def check_expected(pages_dir: str = PAGES_DIR):
+    """
+    Asserts that `parse_calendar()` returns exactly the shifts listed in each page's expected JSON file.
+
+    Returns:
+    - The number of pages checked.
+    """
+    paths = sorted(glob.glob(os.path.join(pages_dir, '*.html')))
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            month = mic_roster_parser.parse_calendar(f.read())
+        with open(path[:-len('.html')] + '.json') as f:
+            expected = json.load(f)
+        found = [{'start': s.start.isoformat(), 'end': s.end.isoformat(), 'code': s.code} for s in month.shifts]
+        assert (month.year, month.month) == (expected['year'], expected['month']), path
+        assert found == expected['shifts'], f"{path}: parsed shifts differ from the expected list"
+    return len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help='timing passes over the page set')
+    args = parser.parse_args()
+
+    pages = load_pages()
+    check_expected()
+    legacy = time_parser(lambda page: legacy_process_response_cal(page, {}), pages, args.repeat)
+    current = time_parser(mic_roster_parser.parse_calendar, pages, args.repeat)
+    print(f"pages: {len(pages)}, backend: {mic_roster_parser.PARSER}")
+    print(f"process_response_cal (original): {legacy * 1000:8.2f} ms/page")
+    print(f"parse_calendar:                  {current * 1000:8.2f} ms/page")
+    print(f"speedup:                         {legacy / current:8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
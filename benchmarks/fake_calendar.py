@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory stand-in for the Google Calendar discovery service.
+
+Implements the parts of `service.events()` the scraper uses (`list` with paging, `insert`, `patch`, `delete`) and
+`service.new_batch_http_request()`, returning request objects with `.execute()` like the real client. Every call
+is counted, so benchmarks can report API usage, and the first `rate_limited` writes can be made to fail with a
+403 `rateLimitExceeded` error to exercise retry paths. Other failures, such as 429 or 503, can be queued with
+`errors`, and `lost` failures are raised after the write has been stored, as when a response is lost. An insert
+whose body has an `id` keeps it, and one whose `id` is taken fails with 409.
+"""
+import copy
+import itertools
+import threading
+
+
+class FakeHttpError(Exception):
+    """Mimics `googleapiclient.errors.HttpError`: carries `resp.status` and the JSON error `content`."""
+
+    class _Response(dict):
+        def __init__(self, status):
+            super().__init__(status=str(status))
+            self.status = status
+            self.reason = ''
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(f"HTTP {status} {reason}")
+        self.resp = self._Response(status)
+        self.content = ('{"error": {"errors": [{"reason": "%s"}]}}' % reason).encode()
+
+
+class _Request:
+    def __init__(self, service, operation: str, run):
+        self._service = service
+        self._operation = operation
+        self._run = run
+
+    def execute(self):
+        return self._service._execute(self._operation, self._run)
+
+
+class _Batch:
+    def __init__(self, service, callback):
+        self._service = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback or self._callback))
+
+    def execute(self):
+        self._service._count('batch')
+        for request_id, request, callback in self._requests:
+            try:
+                response, error = request.execute(), None
+            except Exception as e:
+                response, error = None, e
+            callback(request_id, response, error)
+
+
+class _Events:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, calendarId='primary', timeMin=None, timeMax=None, pageToken=None, maxResults=250, **_):
+        def run(store):
+            items = sorted((e for e in store.values() if _in_window(e, timeMin, timeMax)),
+                           key=lambda e: e['start'].get('dateTime', ''))
+            start = int(pageToken or 0)
+            result = {'items': copy.deepcopy(items[start:start + maxResults])}
+            if start + maxResults < len(items):
+                result['nextPageToken'] = str(start + maxResults)
+            return result
+        return _Request(self._service, 'list', run)
+
+    def insert(self, calendarId='primary', body=None):
+        def run(store):
+            event = copy.deepcopy(body)
+            if event.setdefault('id', f"event{next(self._service._ids)}") in store:
+                raise FakeHttpError(409, 'duplicate')
+            store[event['id']] = event
+            return copy.deepcopy(event)
+        return _Request(self._service, 'insert', run)
+
+    def patch(self, calendarId='primary', eventId=None, body=None):
+        def run(store):
+            if eventId not in store:
+                raise FakeHttpError(404, 'notFound')
+            store[eventId].update(copy.deepcopy(body))
+            return copy.deepcopy(store[eventId])
+        return _Request(self._service, 'patch', run)
+
+    def delete(self, calendarId='primary', eventId=None):
+        def run(store):
+            if store.pop(eventId, None) is None:
+                raise FakeHttpError(410, 'deleted')
+            return ''
+        return _Request(self._service, 'delete', run)
+
+
+def _in_window(event: dict, time_min: str, time_max: str) -> bool:
+    # Event times are stored as naive local strings; comparing the first 19 characters is enough for benchmarks.
+    start = event['start'].get('dateTime', '')[:19]
+    end = event['end'].get('dateTime', '')[:19]
+    return (time_max is None or start < time_max[:19]) and (time_min is None or end > time_min[:19])
+
+
+class FakeCalendarService:
+    """
+    An in-memory Calendar service.
+
+    Attributes:
+    - events_by_id (dict): The stored events, keyed by event ID.
+    - calls (dict): How many times each operation (`list`, `insert`, `patch`, `delete`, `batch`) was executed.
+    """
+
+    def __init__(self, rate_limited: int = 0, errors=(), lost=()):
+        """
+        Parameters:
+        - rate_limited (int): The number of writes that fail with 403 `rateLimitExceeded` before writes succeed.
+        - errors (Iterable[tuple]): `(status, reason)` pairs, e.g. `(503, 'backendError')`, raised in turn by the
+          first writes, before any `rate_limited` ones.
+        - lost (Iterable[tuple]): `(status, reason)` pairs raised in turn by the first writes that succeed, after
+          they have been stored.
+        """
+        self.events_by_id = {}
+        self.calls = {}
+        self.rate_limited = rate_limited
+        self.errors = list(errors)
+        self.lost = list(lost)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _count(self, operation: str):
+        with self._lock:
+            self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def _execute(self, operation: str, run):
+        self._count(operation)
+        with self._lock:
+            if operation != 'list' and self.errors:
+                raise FakeHttpError(*self.errors.pop(0))
+            if operation != 'list' and self.rate_limited > 0:
+                self.rate_limited -= 1
+                raise FakeHttpError(403, 'rateLimitExceeded')
+            response = run(self.events_by_id)
+            if operation != 'list' and self.lost:
+                raise FakeHttpError(*self.lost.pop(0))
+            return response
+
+    def events(self):
+        return _Events(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    @property
+    def writes(self) -> int:
+        """The number of insert, patch and delete calls executed."""
+        return sum(self.calls.get(operation, 0) for operation in ('insert', 'patch', 'delete'))
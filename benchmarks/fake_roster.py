@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for the Mic Roster self-service site.
+
+Serves a login form and roster month pages on 127.0.0.1 and answers the same ASP.NET postbacks as the live site:
+the login button, and the previous/next month LinkButtons. Months in the fixture corpus are served from
+`benchmarks/pages/`, or first from `pages_dir` when one is given; any other month is rendered with
+`make_pages.month_cells()`. Like ASP.NET, the month being
+navigated from is recovered from the posted hidden fields, so several sessions can walk the calendar at once.
+Logins are tracked with a session cookie, and `expire_sessions()` logs every session out.
+
+With `update_panel` the calendar is wrapped in an UpdatePanel registered with a ScriptManager, and month postbacks
+sent with `__ASYNCPOST` are answered in the MicrosoftAjax delta format with just the panel and the new hidden
+fields. Responses are gzip-compressed for clients that accept it, unless `compress` is False.
+
+Example:
+```
+with FakeRosterServer(today=(2024, 5)) as server:
+    roster = RosterSession(server.url)
+    roster.login(server.username, server.password)
+```
+"""
+import gzip
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+from benchmarks import make_pages
+
+PANEL_ID = 'ctl00_ContentPlaceHolder1_upCalendar'
+PANEL_OPEN = f'<div id="{PANEL_ID}">\n'
+PANEL_SCRIPT = (
+    '\n<script type="text/javascript">\n//<![CDATA[\n'
+    "Sys.WebForms.PageRequestManager._initialize('ctl00$ScriptManager1', 'aspnetForm', "
+    "['tctl00$ContentPlaceHolder1$upCalendar','ctl00_ContentPlaceHolder1_upCalendar'], [], [], 90, 'ctl00');\n"
+    '//]]>\n</script>'
+)
+
+LOGIN_PAGE = '''<!DOCTYPE html>
+<html><head><title>MicRoster Self Service</title></head><body>
+<form method="post" action="./Default.aspx" id="aspnetForm">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="login" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="login" />
+<input name="ctl00$ContentPlaceHolder1$txtPersonnelId" type="text" id="ctl00_ContentPlaceHolder1_txtPersonnelId" />
+<input name="ctl00$ContentPlaceHolder1$txtPassword" type="password" id="ctl00_ContentPlaceHolder1_txtPassword" />
+<input type="submit" name="ctl00$ContentPlaceHolder1$btnLogin" value="Login" id="ctl00_ContentPlaceHolder1_btnLogin" />
+</form></body></html>
+'''
+
+
+class FakeRosterServer:
+    """
+    A threaded HTTP server replaying roster pages.
+
+    Attributes:
+    - url (str): The Default.aspx URL to give to `RosterSession`.
+    - requests (int): The number of HTTP requests served.
+    - bytes_sent (int): The number of response body bytes served, after compression.
+    - partial_posts (int): The number of month postbacks answered with a delta.
+    """
+
+    def __init__(self, today: tuple = (2024, 5), username: str = 'user', password: str = 'secret',
+                 latency: float = 0.0, update_panel: bool = True, compress: bool = True, pages_dir: str = None):
+        """
+        Parameters:
+        - today (tuple): The `(year, month)` the calendar opens on after login.
+        - username (str), password (str): The only credentials accepted.
+        - latency (float): Seconds to wait before answering each request, to model a remote site.
+        - update_panel (bool): Put the calendar in an UpdatePanel and answer partial postbacks.
+        - compress (bool): gzip responses for clients sending `Accept-Encoding: gzip`.
+        - pages_dir (str): A directory of `YYYY-MM.html` pages served in preference to the corpus.
+        """
+        self.today = today
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.update_panel = update_panel
+        self.compress = compress
+        self.pages_dirs = [directory for directory in (pages_dir, make_pages.PAGES_DIR) if directory]
+        self.partial_posts = 0
+        self.requests = 0
+        self.bytes_sent = 0
+        self._sessions = set()
+        self._pages = {}
+        self._months_by_validation = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = None
+        self.url = f'http://127.0.0.1:{self._server.server_address[1]}/Default.aspx'
+
+    def page(self, year: int, month: int) -> str:
+        """Returns the page for a month, from `pages_dir` or the fixture corpus when they have one."""
+        key = (year, month)
+        with self._lock:
+            if key not in self._pages:
+                paths = [os.path.join(directory, f'{year}-{month:02d}.html') for directory in self.pages_dirs]
+                path = next((path for path in paths if os.path.exists(path)), None)
+                if path is not None:
+                    with open(path, encoding='utf-8') as f:
+                        html = f.read()
+                else:
+                    html = make_pages.render_month(year, month, make_pages.month_cells(year, month),
+                                                   seed=year * 100 + month)
+                validation = html.split('name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="')[1].split('"')[0]
+                if self.update_panel:
+                    html = html.replace('<div id="content">', PANEL_OPEN + '<div id="content">', 1)
+                    html = html.replace('</div>\n</form>', '</div>\n</div>' + PANEL_SCRIPT + '\n</form>', 1)
+                self._pages[key] = html
+                self._months_by_validation[validation] = key
+            return self._pages[key]
+
+    def delta(self, year: int, month: int) -> str:
+        """Returns the partial postback response for a month: the calendar panel and the new hidden fields."""
+        html = self.page(year, month)
+        panel = html.split(PANEL_OPEN, 1)[1].split('</div>' + PANEL_SCRIPT, 1)[0]
+        updates = [('updatePanel', PANEL_ID, panel)]
+        for name in ('__VIEWSTATE', '__VIEWSTATEGENERATOR', '__EVENTVALIDATION'):
+            marker = f'name="{name}" id="{name}" value="'
+            if marker in html:
+                updates.append(('hiddenField', name, html.split(marker, 1)[1].split('"', 1)[0]))
+        return ''.join(f'{len(content)}|{kind}|{key}|{content}|' for kind, key, content in updates)
+
+    def expire_sessions(self):
+        """Logs every session out, as the live site does after a period of inactivity."""
+        with self._lock:
+            self._sessions.clear()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _session(self):
+                for part in self.headers.get('Cookie', '').split(';'):
+                    name, _, value = part.strip().partition('=')
+                    if name == 'ASP.NET_SessionId':
+                        return value
+                return None
+
+            def _send(self, html: str, cookie: str = None, content_type: str = 'text/html'):
+                if server.latency:
+                    time.sleep(server.latency)
+                body = html.encode()
+                self.send_response(200)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                if server.compress and 'gzip' in self.headers.get('Accept-Encoding', ''):
+                    body = gzip.compress(body, compresslevel=6)
+                    self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                if cookie:
+                    self.send_header('Set-Cookie', f'ASP.NET_SessionId={cookie}; path=/; HttpOnly')
+                self.end_headers()
+                self.wfile.write(body)
+                with server._lock:
+                    server.requests += 1
+                    server.bytes_sent += len(body)
+
+            def do_GET(self):
+                if self._session() in server._sessions:
+                    return self._send(server.page(*server.today))
+                self._send(LOGIN_PAGE)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode(), keep_blank_values=True).items()}
+                if 'ctl00$ContentPlaceHolder1$btnLogin' in form:
+                    if (form.get('ctl00$ContentPlaceHolder1$txtPersonnelId') != server.username or
+                            form.get('ctl00$ContentPlaceHolder1$txtPassword') != server.password):
+                        return self._send(LOGIN_PAGE)
+                    session = uuid.uuid4().hex
+                    with server._lock:
+                        server._sessions.add(session)
+                    return self._send(server.page(*server.today), cookie=session)
+                partial = server.update_panel and form.get('__ASYNCPOST') == 'true' and \
+                    self.headers.get('X-MicrosoftAjax') == 'Delta=true'
+                if self._session() not in server._sessions:
+                    if partial:
+                        return self._send('13|pageRedirect||/Default.aspx|', content_type='text/plain')
+                    return self._send(LOGIN_PAGE)
+                year, month = server._months_by_validation.get(form.get('__EVENTVALIDATION'), server.today)
+                target = form.get('__EVENTTARGET', '')
+                step = 1 if target.endswith('lnkNextMonth') else -1 if target.endswith('lnkPreviousMonth') else 0
+                index = year * 12 + month - 1 + step
+                if partial:
+                    with server._lock:
+                        server.partial_posts += 1
+                    return self._send(server.delta(index // 12, index % 12 + 1), content_type='text/plain')
+                self._send(server.page(index // 12, index % 12 + 1))
+
+        return Handler
+
+    def start(self):
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stops the server."""
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *_):
+        self.stop()
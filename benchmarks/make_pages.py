@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+Roster page fixture generator.
+
+Writes month pages in the Default.aspx layout the scraper reads (month heading, navigation LinkButtons, hidden
+ASP.NET state fields and `DateCell` table cells) to `benchmarks/pages/`, together with a JSON file per page listing
+the shifts the page contains. The expected shifts come from the generator's own model of each cell, not from the
+parser, so they can be used to check it.
+
+The corpus covers ordinary day shifts, every non-working marker (OFF, PH, OT, SICK, NA, Not Rostered), empty
+cells, overnight shifts (including one running into the next year) and months spanning four, five and six calendar
+rows. Page weight is kept close to the live site by padding the surrounding layout and `__VIEWSTATE`, so parse
+timings reflect real pages rather than the calendar table alone. Output is deterministic; re-running the script
+reproduces the committed files.
+
+Usage:
+    $ python -m benchmarks.make_pages
+"""
+import base64
+import calendar
+import datetime
+import json
+import os
+import random
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+PREFIX = 'ctl00_ContentPlaceHolder1_calendar_'
+CODES = ('SURFACE', 'PT-B/F', 'MEETING', 'DEPOT')
+MARKERS = ('OFF', 'PH', 'OT', 'SICK', 'NA', 'Not Rostered')
+
+
+def default_cell(rng: random.Random, markers=('OFF', 'OFF', 'OFF', 'PH', 'SICK'), overnight: float = 0.0):
+    """
+    Picks a plausible cell: mostly day shifts, with days off and the occasional other marker.
+
+    Returns:
+    - A marker string, or a `(start, end, code)` tuple of `HHMM` strings for a shift.
+    """
+    roll = rng.random()
+    if roll < 0.3:
+        return rng.choice(markers)
+    if roll < 0.3 + overnight:
+        return '2200', '0630', 'NIGHTS'
+    hour = rng.choice((5, 6, 7, 8, 13, 14))
+    return f'{hour:02d}00', f'{hour + 8:02d}30', rng.choice(CODES)
+
+
+def cell_html(cell) -> str:
+    """Renders the inner HTML of a day's `div` for a marker, an empty cell (None) or a shift tuple."""
+    if cell is None:
+        return ''
+    if isinstance(cell, str):
+        return cell
+    start, end, code = cell
+    minutes = (int(end[:2]) * 60 + int(end[2:]) - int(start[:2]) * 60 - int(start[2:])) % (24 * 60)
+    return f'{start}-{end} ({minutes // 60}:{minutes % 60:02d})<br/>{code}'
+
+
+def expected_shifts(year: int, month: int, cells: list) -> list:
+    """Lists the shifts a page should parse to, as `{'start', 'end', 'code'}` dictionaries with ISO datetimes."""
+    shifts = []
+    for day, cell in enumerate(cells, start=1):
+        if cell is None or isinstance(cell, str):
+            continue
+        start_hhmm, end_hhmm, code = cell
+        date = datetime.datetime(year, month, day)
+        start = date + datetime.timedelta(hours=int(start_hhmm[:2]), minutes=int(start_hhmm[2:]))
+        end = date + datetime.timedelta(hours=int(end_hhmm[:2]), minutes=int(end_hhmm[2:]))
+        if end <= start:
+            end += datetime.timedelta(days=1)
+        shifts.append({'start': start.isoformat(), 'end': end.isoformat(), 'code': code})
+    return shifts
+
+
+def render_month(year: int, month: int, cells: list, seed: int = 0) -> str:
+    """
+    Renders a roster month page.
+
+    Parameters:
+    - year (int), month (int): The month shown by the calendar.
+    - cells (list): One entry per day of the month, see `cell_html()`.
+    - seed (int): Seed for the padding content.
+
+    Returns:
+    - The page HTML as a string.
+    """
+    rng = random.Random(seed)
+    viewstate = base64.b64encode(bytes(rng.getrandbits(8) for _ in range(24000))).decode()
+    leading = (calendar.monthrange(year, month)[0] + 1) % 7
+    tds = ['<td class="calendarOtherMonth">&nbsp;</td>'] * leading
+    for day, cell in enumerate(cells, start=1):
+        tds.append(f'<td id="{PREFIX}DateCell{day}" class="calendarDay"><span class="dayNumber">{day}</span>'
+                   f'<div class="shift">{cell_html(cell)}</div></td>')
+    tds += ['<td class="calendarOtherMonth">&nbsp;</td>'] * (-len(tds) % 7)
+    rows = '\n'.join('<tr>' + ''.join(tds[i:i + 7]) + '</tr>' for i in range(0, len(tds), 7))
+    heading = datetime.date(year, month, 1).strftime('%B %Y')
+    menu = '\n'.join(f'<li><a href="Page{i}.aspx" class="menuItem">Self service item {i}</a>'
+                     f'<p class="help">Help text for item {i}, kept here to match the layout of the live site.</p></li>'
+                     for i in range(150))
+    return f'''<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><title>MicRoster Self Service</title><link href="Styles/Site.css" rel="stylesheet" type="text/css" /></head>
+<body>
+<form method="post" action="./Default.aspx" id="aspnetForm">
+<div class="aspNetHidden">
+<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />
+<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />
+<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{viewstate}" />
+</div>
+<div class="aspNetHidden">
+<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="CA0B0334" />
+<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{viewstate[:400]}" />
+</div>
+<div id="header"><ul class="menu">
+{menu}
+</ul></div>
+<div id="content">
+<table id="{PREFIX}tblCalendar" class="calendar">
+<tr class="calendarTitle"><td colspan="7">
+<a id="{PREFIX}lnkPreviousMonth" href="javascript:__doPostBack('ctl00$ContentPlaceHolder1$calendar$lnkPreviousMonth','')">&lt;</a>
+<span id="{PREFIX}lblCurrentMonth">{heading}</span>
+<a id="{PREFIX}lnkNextMonth" href="javascript:__doPostBack('ctl00$ContentPlaceHolder1$calendar$lnkNextMonth','')">&gt;</a>
+</td></tr>
+<tr class="calendarDayNames"><th>Sun</th><th>Mon</th><th>Tue</th><th>Wed</th><th>Thu</th><th>Fri</th><th>Sat</th></tr>
+{rows}
+</table>
+</div>
+</form>
+</body>
+</html>
+'''
+
+
+def month_cells(year: int, month: int, **kwargs) -> list:
+    """Generates the deterministic default cells for a month; keyword arguments go to `default_cell()`."""
+    rng = random.Random(year * 100 + month)
+    return [default_cell(rng, **kwargs) for _ in range(calendar.monthrange(year, month)[1])]
+
+
+def corpus() -> list:
+    """
+    Returns the fixture corpus as `(name, year, month, cells)` tuples.
+
+    - 2024-02: leap February over five calendar rows.
+    - 2024-03: every non-working marker, plus empty cells.
+    - 2024-04, 2024-05: ordinary months.
+    - 2024-06: a month spanning six calendar rows.
+    - 2024-12: overnight shifts, including one from New Year's Eve into January.
+    - 2026-02: a February that fits exactly four rows.
+    """
+    markers = month_cells(2024, 3, markers=MARKERS)
+    for day in (5, 17, 26):
+        markers[day - 1] = None
+    overnight = month_cells(2024, 12, overnight=0.3)
+    overnight[30] = ('2200', '0600', 'NIGHTS')
+    return [
+        ('2024-02', 2024, 2, month_cells(2024, 2)),
+        ('2024-03', 2024, 3, markers),
+        ('2024-04', 2024, 4, month_cells(2024, 4)),
+        ('2024-05', 2024, 5, month_cells(2024, 5)),
+        ('2024-06', 2024, 6, month_cells(2024, 6)),
+        ('2024-12', 2024, 12, overnight),
+        ('2026-02', 2026, 2, month_cells(2026, 2)),
+    ]
+
+
+def main():
+    os.makedirs(PAGES_DIR, exist_ok=True)
+    for name, year, month, cells in corpus():
+        path = os.path.join(PAGES_DIR, f'{name}.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(render_month(year, month, cells, seed=year * 100 + month))
+        with open(os.path.join(PAGES_DIR, f'{name}.json'), 'w') as f:
+            json.dump({'year': year, 'month': month, 'shifts': expected_shifts(year, month, cells)}, f, indent=1)
+        print(f"Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
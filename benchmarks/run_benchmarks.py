@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark and regression suite.
+
+Runs entirely on this machine: the roster site is replaced by `fake_roster.FakeRosterServer` serving the pages in
+`benchmarks/pages/`, and Google Calendar by `fake_calendar.FakeCalendarService`. Each run
+
+1. checks `parse_calendar()` against the expected shifts of every fixture page (the run stops if one differs),
+2. measures parse throughput in pages/s for `parse_calendar()` and the original `process_response_cal()`,
+3. times an end-to-end `run_sync()` from login to calendar writes, cold (empty calendar and page cache) and warm
+   (nothing changed since the cold run),
+4. records peak Python memory (tracemalloc) for the parse pass and the cold sync,
+5. breaks the cold sync down into the stages recorded by `mic_roster_metrics` (login, navigate, parse, ...), and
+6. times a cold import of the main modules in a fresh interpreter, noting whether Selenium or the Google client
+   libraries were loaded.
+
+Results are printed and can be saved as JSON with `--output`; `--compare` prints the change against an earlier
+results file.
+
+Usage:
+    $ python -m benchmarks.run_benchmarks --output results.json
+    $ python -m benchmarks.run_benchmarks --compare results.json
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import mic_roster_parser
+from benchmarks.bench_parser import check_expected, legacy_process_response_cal, load_pages
+from benchmarks.fake_calendar import FakeCalendarService
+from benchmarks.fake_roster import FakeRosterServer
+from mic_roster_cache import PageCache
+from mic_roster_metrics import METRICS, profile
+from mic_roster_selenium import run_sync
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+IMPORTED_MODULES = ('mic_roster_parser', 'mic_roster_http', 'mic_roster_selenium', 'mic_roster_daemon')
+HEAVY_PACKAGES = ('selenium', 'webdriver_manager', 'googleapiclient', 'google_auth_oauthlib')
+_IMPORT_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import {module}
+print(json.dumps({{'seconds': time.perf_counter() - started,
+                  'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+# Lower is better for every metric except throughput.
+HIGHER_IS_BETTER = ('parse.pages_per_second', 'parse.legacy_pages_per_second')
+
+
+def throughput(parse, pages: list, repeat: int) -> float:
+    """Returns the best pages/s over `repeat` passes of all pages."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for page in pages:
+            parse(page)
+        best = min(best, time.perf_counter() - started)
+    return len(pages) / best
+
+
+def peak_memory(run) -> int:
+    """Calls `run()` under tracemalloc and returns the peak traced memory in bytes."""
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_parse(repeat: int) -> dict:
+    pages = load_pages()
+    return {
+        'pages': len(pages),
+        'backend': mic_roster_parser.PARSER,
+        'pages_per_second': throughput(mic_roster_parser.parse_calendar, pages, repeat),
+        'legacy_pages_per_second': throughput(lambda page: legacy_process_response_cal(page, {}), pages, repeat),
+        'peak_bytes': peak_memory(lambda: [mic_roster_parser.parse_calendar(page) for page in pages]),
+    }
+
+
+def bench_imports(repeat: int = 3) -> dict:
+    """
+    Times importing each of `IMPORTED_MODULES` in a fresh interpreter, keeping the best of `repeat` runs.
+
+    Returns:
+    - A dictionary mapping each module to its import `seconds` and the `heavy` packages it pulled in.
+    """
+    results = {}
+    for module in IMPORTED_MODULES:
+        code = _IMPORT_PROBE.format(module=module, heavy=HEAVY_PACKAGES)
+        runs = [json.loads(subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, check=True,
+                                          capture_output=True, text=True).stdout) for _ in range(repeat)]
+        results[module] = min(runs, key=lambda run: run['seconds'])
+    return results
+
+
+def stage_seconds(snapshot: dict) -> dict:
+    """Maps each stage in a metrics snapshot, suffixed with its labels, to its total seconds."""
+    stages = {}
+    for entry in snapshot['spans']:
+        name = '.'.join([entry['stage']] + [value for _, value in sorted(entry['labels'].items())])
+        stages[name] = entry['seconds']
+    return stages
+
+
+def bench_sync(months: int, latency: float, verbose: bool, profile_path: str = None) -> dict:
+    """
+    Times `run_sync()` against the fake roster site and calendar, first cold and then warm.
+
+    Parameters:
+    - months (int): The number of months synced, starting with the current one.
+    - latency (float): Seconds the fake roster site waits before each response.
+    - verbose (bool): Show the sync's own progress output.
+    - profile_path (str): Dump cProfile stats of the cold sync to this file.
+    """
+    today = datetime.date.today()
+    offsets = range(0, months)
+    service = FakeCalendarService()
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    with FakeRosterServer(today=(today.year, today.month), latency=latency) as server, \
+            tempfile.TemporaryDirectory() as cache_dir, output:
+        cache = PageCache(cache_dir)
+
+        def sync():
+            return run_sync(service, server.username, server.password, offsets, cache, server.url)
+
+        METRICS.reset()
+        started = time.perf_counter()
+        tracemalloc.start()
+        try:
+            with profile(profile_path):
+                cold = sync()
+            cold_peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        cold_seconds = time.perf_counter() - started
+        stages = stage_seconds(METRICS.snapshot())
+        cold_requests = server.requests
+        cold_bytes = server.bytes_sent
+
+        started = time.perf_counter()
+        warm = sync()
+        warm_seconds = time.perf_counter() - started
+
+    return {
+        'months': months,
+        'latency': latency,
+        'cold_seconds': cold_seconds,
+        'warm_seconds': warm_seconds,
+        'cold_peak_bytes': cold_peak,
+        'cold_stages': stages,
+        'cold_totals': cold,
+        'warm_totals': warm,
+        'roster_requests': cold_requests,
+        'roster_bytes': cold_bytes,
+        'calendar_calls': dict(service.calls),
+        'events': len(service.events_by_id),
+    }
+
+
+def flatten(results: dict, prefix: str = '') -> dict:
+    """Flattens nested result dictionaries to `section.metric` keys, keeping numbers only."""
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(current: dict, previous: dict):
+    """Prints each shared metric with its relative change, marking regressions."""
+    now, before = flatten(current), flatten(previous)
+    for key in sorted(now.keys() & before.keys()):
+        if not before[key]:
+            continue
+        change = (now[key] - before[key]) / before[key]
+        worse = change < 0 if key in HIGHER_IS_BETTER else change > 0
+        flag = '  <-- worse' if worse and abs(change) > 0.1 else ''
+        print(f"{key:<40} {before[key]:>14.4g} -> {now[key]:>14.4g}  {change:+7.1%}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline parse and sync benchmarks.")
+    parser.add_argument('--repeat', type=int, default=10, help="timing passes over the page set (default 10)")
+    parser.add_argument('--months', type=int, default=3, help="months synced end to end (default 3)")
+    parser.add_argument('--latency', type=float, default=0.0, help="fake roster site response delay in seconds")
+    parser.add_argument('--output', help="save the results to this JSON file")
+    parser.add_argument('--compare', help="compare against an earlier results file")
+    parser.add_argument('--verbose', action='store_true', help="show the sync's progress output")
+    parser.add_argument('--profile', help="dump cProfile stats of the cold sync to this file")
+    args = parser.parse_args()
+
+    checked = check_expected()
+    print(f"Regression check: {checked} pages match their expected shifts")
+
+    results = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'parse': bench_parse(args.repeat),
+        'sync': bench_sync(args.months, args.latency, args.verbose, args.profile),
+        'imports': bench_imports(),
+    }
+    parse, sync = results['parse'], results['sync']
+    print(f"Parse ({parse['backend']}): {parse['pages_per_second']:.1f} pages/s, "
+          f"original {parse['legacy_pages_per_second']:.1f} pages/s, peak {parse['peak_bytes'] / 1e6:.1f} MB")
+    print(f"Sync {sync['months']} months: cold {sync['cold_seconds']:.2f}s, warm {sync['warm_seconds']:.2f}s, "
+          f"peak {sync['cold_peak_bytes'] / 1e6:.1f} MB, {sync['roster_bytes'] / 1e3:.0f} kB from the roster, "
+          f"{sync['events']} events, calls {sync['calendar_calls']}")
+    print("Cold sync stages: " + ', '.join(f"{name} {seconds:.3f}s" for name, seconds in sync['cold_stages'].items()))
+    print("Imports: " + ', '.join(f"{module} {result['seconds']:.3f}s" + (f" (loads {', '.join(result['heavy'])})"
+                                                                          if result['heavy'] else '')
+                                  for module, result in results['imports'].items()))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
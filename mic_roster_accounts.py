@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Multi-Account Runner.
+
+Syncs the rosters of many staff in one process. Accounts are read from a JSON file; each one names the roster
+login and the Google Calendar to write to. Calendar credentials are cached per account name by `mic_roster_auth`,
+in `.cache/tokens/<name>.json`; the optional `token_path` is only read to migrate an existing `token.pickle`:
+
+    [
+        {"name": "jsmith", "username": "123456", "password": "...", "calendar_id": "primary",
+         "token_path": "tokens/jsmith.pickle"}
+    ]
+
+Accounts are processed in a bounded thread pool. Every account gets its own roster sessions, Calendar service and
+page cache, and the run reports per-account timing and results.
+
+Usage:
+    $ python mic_roster_accounts.py accounts.json --workers 4
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple
+
+from mic_roster_auth import CREDENTIAL_CACHE
+from mic_roster_browser_pool import BrowserPool
+from mic_roster_cache import CACHE_DIR, PageCache
+from mic_roster_changes import ChangeStream, build_change_stream
+from mic_roster_deadletters import DeadLetterQueue
+from mic_roster_http import LOGIN_URL
+from mic_roster_metrics import METRICS
+from mic_roster_selenium import CREDENTIALS_PATH, authenticate_google_calendar, run_sync
+from mic_roster_store import ShiftStore
+
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+
+class Account(NamedTuple):
+    """
+    One member of staff to sync. Without a `token_path`, the account starts with no Google token of its own and
+    authorises its own Google account on first use; it never borrows another account's token.
+    """
+    name: str
+    username: str
+    password: str
+    calendar_id: str = 'primary'
+    token_path: str = None
+
+    def credential_source(self) -> str:
+        """Returns the file the account's Google credentials come from: its legacy token, else its cached one."""
+        return os.path.abspath(self.token_path) if self.token_path else CREDENTIAL_CACHE.token_path(self.name)
+
+
+class AccountResult(NamedTuple):
+    """The outcome of syncing one account."""
+    name: str
+    ok: bool
+    seconds: float
+    totals: dict = None
+    error: str = None
+
+
+def load_accounts(path: str) -> list:
+    """
+    Reads the accounts file.
+
+    Parameters:
+    - path (str): A JSON file holding a list of account objects with `name`, `username` and `password`, and
+      optionally `calendar_id` and `token_path`.
+
+    Returns:
+    - A list of `Account`.
+
+    Raises:
+    - ValueError: If an account is missing a required field, two accounts share a name, or two accounts would
+      write to the same calendar with the same credentials, where each sync would delete the other's shifts.
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    accounts = []
+    for entry in entries:
+        missing = [field for field in ('name', 'username', 'password') if not entry.get(field)]
+        if missing:
+            raise ValueError(f"Account {entry.get('name', '?')} is missing {', '.join(missing)}")
+        accounts.append(Account(**{field: entry[field] for field in Account._fields if field in entry}))
+    names = [account.name for account in accounts]
+    if len(set(names)) != len(names):
+        raise ValueError("Account names must be unique")
+    tokens, targets = {}, {}
+    for account in accounts:
+        token = CREDENTIAL_CACHE.token_path(account.name)
+        if token in tokens:
+            raise ValueError(f"Accounts {tokens[token]} and {account.name} would share the token file {token}")
+        tokens[token] = account.name
+        target = (account.credential_source(), account.calendar_id)
+        if target in targets:
+            raise ValueError(f"Accounts {targets[target]} and {account.name} would both sync calendar "
+                             f"{account.calendar_id} with the credentials in {target[0]}")
+        targets[target] = account.name
+    return accounts
+
+
+def sync_account(account: Account, offsets: Iterable[int] = range(0, 3), url: str = LOGIN_URL,
+                 credentials_path: str = CREDENTIALS_PATH, cache_dir: str = CACHE_DIR,
+                 store: ShiftStore = None, dead_letters: DeadLetterQueue = None,
+                 browser_pool: BrowserPool = None, changes: ChangeStream = None) -> AccountResult:
+    """
+    Syncs one account and reports how it went. Errors are captured in the result rather than raised.
+
+    Parameters:
+    - account (Account): The account to sync.
+    - offsets (Iterable[int]): Month offsets to sync. Default is the current month and the two after it.
+    - url (str): The URL of the roster login page.
+    - credentials_path (str): The OAuth client secrets file, shared by all accounts.
+    - cache_dir (str): Parent directory of the per-account page caches.
+    - store (ShiftStore): The shift store, shared by all accounts; shifts are kept under the account's name.
+    - dead_letters (DeadLetterQueue): The queue of failed writes, shared by all accounts.
+    - browser_pool (BrowserPool): Warm Chrome drivers for the fallback path, shared by all accounts.
+    - changes (ChangeStream): Optional stream of roster changes, shared by all accounts. Requires `store`.
+
+    Returns:
+    - An `AccountResult`.
+    """
+    started = time.perf_counter()
+    try:
+        service = authenticate_google_calendar(SCOPES, account.token_path, credentials_path, account.name)
+        cache = PageCache(os.path.join(cache_dir, account.name))
+        totals = run_sync(service, account.username, account.password, offsets, cache, url, account.calendar_id,
+                          store=store, account=account.name, dead_letters=dead_letters,
+                          browser_pool=browser_pool, changes=changes)
+        return AccountResult(account.name, totals['failed'] == 0, time.perf_counter() - started, totals)
+    except Exception as e:
+        return AccountResult(account.name, False, time.perf_counter() - started, error=f"{type(e).__name__}: {e}")
+
+
+def run_accounts(accounts: Iterable[Account], workers: int = 4, offsets: Iterable[int] = range(0, 3),
+                 url: str = LOGIN_URL, credentials_path: str = CREDENTIALS_PATH, cache_dir: str = CACHE_DIR,
+                 store: ShiftStore = None, dead_letters: DeadLetterQueue = None,
+                 changes: ChangeStream = None) -> list:
+    """
+    Syncs many accounts in a bounded thread pool.
+
+    Parameters:
+    - accounts (Iterable[Account]): The accounts to sync.
+    - workers (int): The maximum number of accounts synced at the same time.
+    - offsets, url, credentials_path, cache_dir: Passed to `sync_account()` for every account.
+    - store (ShiftStore): The shift store shared by the accounts. A `ShiftStore` in the default location is used
+      when omitted.
+    - dead_letters (DeadLetterQueue): The queue of failed writes shared by the accounts. A `DeadLetterQueue` in the
+      default location is used when omitted.
+    - changes (ChangeStream): Optional stream told which shifts of each account changed since the last run.
+
+    Returns:
+    - A list of `AccountResult`, in the same order as `accounts`.
+    """
+    offsets = list(offsets)
+    store = store or ShiftStore()
+    dead_letters = dead_letters or DeadLetterQueue()
+    # Accounts that need the Chrome fallback take turns on a few warm drivers instead of each starting Chrome.
+    with BrowserPool(size=min(2, max(1, workers))) as browser_pool, \
+            ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [pool.submit(sync_account, account, offsets, url, credentials_path, cache_dir, store,
+                               dead_letters, browser_pool, changes)
+                   for account in accounts]
+        return [future.result() for future in futures]
+
+
+def report_results(results: list, seconds: float, report_path: str = None) -> bool:
+    """
+    Prints one line per account and a summary, and optionally saves the results as JSON.
+
+    Returns:
+    - True if every account synced without errors.
+    """
+    for result in results:
+        status = 'ok' if result.ok else f"FAILED {result.error or ''}".strip()
+        print(f"{result.name:<20} {result.seconds:8.2f}s  {status}  {result.totals or ''}")
+    print(f"{sum(r.ok for r in results)}/{len(results)} accounts synced in {seconds:.2f}s")
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump([result._asdict() for result in results], f, indent=2)
+    return all(result.ok for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the Mic Roster of several accounts to Google Calendar.")
+    parser.add_argument('accounts', help="JSON file listing the accounts to sync")
+    parser.add_argument('--workers', type=int, default=4, help="accounts synced at the same time (default 4)")
+    parser.add_argument('--past', type=int, default=0, help="number of past months to sync")
+    parser.add_argument('--future', type=int, default=2, help="number of months after the current one to sync")
+    parser.add_argument('--report', help="write the per-account results to this JSON file")
+    parser.add_argument('--metrics', help="export stage timings to this file (.prom for Prometheus, else JSON lines)")
+    parser.add_argument('--changes', help="append roster changes since the last run to this JSON lines file")
+    parser.add_argument('--webhook', help="POST roster changes since the last run to this URL")
+    parser.add_argument('--print-changes', action='store_true', help="print roster changes since the last run")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    changes = build_change_stream(args.changes, args.webhook, args.print_changes)
+    results = run_accounts(load_accounts(args.accounts), args.workers, range(-args.past, args.future + 1),
+                           changes=changes or None)
+    if args.metrics:
+        METRICS.export(args.metrics)
+    if not report_results(results, time.perf_counter() - started, args.report):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
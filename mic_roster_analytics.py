@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Analytics.
+
+Vectorised statistics over long roster histories. Shifts are loaded once into NumPy columns: start and end as
+int64 epoch seconds, the local start time as int64 seconds for day and fortnight bucketing, and the account and
+shift code as categorical integer codes. Every aggregation then runs as array operations, with no Python loop over
+shifts:
+
+- hours worked per fortnight,
+- overtime frequency, as the share of fortnights above the ordinary hours,
+- rest gaps between consecutive shifts and how often they fall below a minimum break,
+- how often each shift code appears.
+
+Durations are taken from the true start and end instants, so overnight shifts (end time earlier than start time on
+the page) count the hours past midnight, and shifts spanning a daylight saving change count the hours actually
+worked. Requires NumPy; `ShiftColumns.to_frame()` also needs pandas.
+
+Usage:
+    $ python mic_roster_analytics.py [--account jsmith]
+
+Example:
+```
+columns = ShiftColumns.from_store(ShiftStore())
+for (account, fortnight), hours in columns.hours_per_fortnight().items():
+    print(account, fortnight, hours)
+```
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import datetime
+from typing import Iterable
+
+import pytz
+
+try:
+    import numpy as np
+except ImportError as e:
+    # Only this module needs NumPy, so it stays an optional dependency of the scraper.
+    raise ImportError("mic_roster_analytics needs the optional numpy package: pip install numpy") from e
+
+from mic_roster_store import ShiftStore
+from mic_roster_sync import TIMEZONE
+
+EPOCH = datetime.datetime(1970, 1, 1)
+DAY = 24 * 3600
+FORTNIGHT = 14 * DAY
+# Default fortnight boundaries fall on Mondays, counted from Monday 1 January 2024.
+FORTNIGHT_ANCHOR = datetime.date(2024, 1, 1)
+
+
+def _categorical(values: list) -> tuple:
+    index = {}
+    codes = np.fromiter((index.setdefault(value, len(index)) for value in values), np.int32, len(values))
+    # Renumber so the categories are sorted, whatever order they were first seen in.
+    categories = sorted(index)
+    order = np.empty(len(categories), np.int32)
+    order[[index[category] for category in categories]] = np.arange(len(categories), dtype=np.int32)
+    return order[codes], tuple(categories)
+
+
+def _epoch_seconds(values: list) -> np.ndarray:
+    """Converts naive datetimes or ISO strings to int64 seconds since 1970-01-01, as if they were UTC."""
+    if len(values) and isinstance(values[0], datetime.datetime):
+        # Building datetime64 arrays from datetime objects is several times slower than this arithmetic.
+        return np.fromiter(((value.toordinal() - EPOCH.toordinal()) * DAY + value.hour * 3600 + value.minute * 60
+                            + value.second for value in values), np.int64, len(values))
+    return np.array(values, dtype='datetime64[s]').astype(np.int64)
+
+
+def _utc_offsets(local: np.ndarray, timezone: str) -> np.ndarray:
+    """Returns the UTC offset in seconds of each local wall-clock time, looked up once per distinct hour."""
+    tz = pytz.timezone(timezone)
+    hours, inverse = np.unique(local // 3600, return_inverse=True)
+    offsets = np.array([tz.utcoffset(EPOCH + datetime.timedelta(hours=int(hour)), is_dst=False)
+                        .total_seconds() for hour in hours], dtype=np.int64)
+    return offsets[inverse]
+
+
+class ShiftColumns:
+    """
+    A column-oriented table of shifts.
+
+    Attributes:
+    - start, end (numpy.ndarray): int64 epoch seconds of the true start and end instants.
+    - local_start (numpy.ndarray): int64 seconds of the local wall-clock start, as if it were UTC; used for
+      bucketing by local day and fortnight.
+    - account, code (numpy.ndarray): int32 indexes into `accounts` and `codes`.
+    - accounts, codes (tuple): The category labels.
+    """
+
+    def __init__(self, accounts: list, starts: list, ends: list, codes: list, timezone: str = TIMEZONE):
+        """
+        Parameters:
+        - accounts (list): The account of each shift.
+        - starts, ends (list): Local naive start and end times, as `datetime` objects or ISO strings.
+        - codes (list): The shift code of each shift.
+        - timezone (str): The time zone of the local times.
+        """
+        local_start = _epoch_seconds(starts)
+        local_end = _epoch_seconds(ends)
+        self.local_start = local_start
+        self.start = local_start - _utc_offsets(local_start, timezone)
+        self.end = local_end - _utc_offsets(local_end, timezone)
+        self.account, self.accounts = _categorical(accounts)
+        self.code, self.codes = _categorical(codes)
+
+    @classmethod
+    def from_shifts(cls, shifts: Iterable, account: str = '', timezone: str = TIMEZONE) -> 'ShiftColumns':
+        """Loads parsed `Shift` tuples of a single account."""
+        shifts = list(shifts)
+        return cls([account] * len(shifts), [s.start for s in shifts], [s.end for s in shifts],
+                   [s.code for s in shifts], timezone)
+
+    @classmethod
+    def from_store(cls, store, account: str = None, timezone: str = TIMEZONE) -> 'ShiftColumns':
+        """Loads every shift in a `mic_roster_store.ShiftStore`, or those of one account."""
+        rows = store.shift_rows(account)
+        columns = list(zip(*rows)) or [(), (), (), ()]
+        return cls(*columns, timezone=timezone)
+
+    def __len__(self):
+        return len(self.start)
+
+    def hours(self) -> np.ndarray:
+        """Returns the length of every shift in hours, as float64."""
+        return (self.end - self.start) / 3600.0
+
+    def _group(self, keys: np.ndarray) -> tuple:
+        """Groups rows by (account, key); returns the unique pairs and each row's group index."""
+        keys = keys.astype(np.int64)
+        low = int(keys.min()) if len(keys) else 0
+        span = (int(keys.max()) - low + 1) if len(keys) else 1
+        unique, inverse = np.unique(self.account.astype(np.int64) * span + (keys - low), return_inverse=True)
+        return np.stack([unique // span, unique % span + low], axis=1), inverse.ravel()
+
+    def hours_per_fortnight(self, anchor: datetime.date = FORTNIGHT_ANCHOR) -> dict:
+        """
+        Sums the hours worked in each fortnight, assigning each shift to the fortnight it starts in.
+
+        Parameters:
+        - anchor (datetime.date): The first day of any fortnight; fortnights run in 14-day steps either side of it.
+
+        Returns:
+        - A dictionary mapping `(account, first day of the fortnight)` to hours, in account and date order.
+        """
+        if not len(self):
+            return {}
+        origin = int(np.datetime64(anchor, 's').astype(np.int64))
+        fortnight = (self.local_start - origin) // FORTNIGHT
+        unique, inverse = self._group(fortnight)
+        totals = np.bincount(inverse, weights=self.hours(), minlength=len(unique))
+        return {(self.accounts[a], anchor + datetime.timedelta(days=14 * int(f))): round(float(total), 2)
+                for (a, f), total in zip(unique, totals)}
+
+    def overtime_frequency(self, ordinary_hours: float = 76.0, anchor: datetime.date = FORTNIGHT_ANCHOR) -> dict:
+        """
+        Reports how often each account works more than its ordinary hours in a fortnight.
+
+        Parameters:
+        - ordinary_hours (float): Ordinary hours per fortnight. Default is 76, a 38-hour week.
+        - anchor (datetime.date): See `hours_per_fortnight()`.
+
+        Returns:
+        - A dictionary mapping each account to `{'fortnights', 'overtime', 'frequency'}`: the fortnights worked,
+          those above `ordinary_hours`, and their share.
+        """
+        per_fortnight = self.hours_per_fortnight(anchor)
+        if not per_fortnight:
+            return {}
+        accounts = np.array([self.accounts.index(account) for account, _ in per_fortnight], dtype=np.int64)
+        over = np.array(list(per_fortnight.values())) > ordinary_hours
+        worked = np.bincount(accounts, minlength=len(self.accounts))
+        overtime = np.bincount(accounts, weights=over, minlength=len(self.accounts))
+        return {account: {'fortnights': int(worked[i]), 'overtime': int(overtime[i]),
+                          'frequency': round(float(overtime[i] / worked[i]), 4)}
+                for i, account in enumerate(self.accounts) if worked[i]}
+
+    def rest_gaps(self) -> tuple:
+        """
+        Computes the break between each shift and the next one of the same account.
+
+        Returns:
+        - A tuple `(account, gap_hours)` of arrays: the account index and the hours from the end of a shift to the
+          start of the next. Overlapping shifts give negative gaps.
+        """
+        order = np.lexsort((self.start, self.account))
+        account, start, end = self.account[order], self.start[order], self.end[order]
+        same = account[1:] == account[:-1]
+        return account[1:][same], (start[1:] - end[:-1])[same] / 3600.0
+
+    def short_rests(self, minimum_hours: float = 10.0) -> dict:
+        """
+        Counts breaks shorter than a minimum rest period.
+
+        Parameters:
+        - minimum_hours (float): The minimum break between shifts. Default is 10 hours.
+
+        Returns:
+        - A dictionary mapping each account to `{'breaks', 'short', 'shortest_hours'}`.
+        """
+        account, gaps = self.rest_gaps()
+        if not len(gaps):
+            return {}
+        breaks = np.bincount(account, minlength=len(self.accounts))
+        short = np.bincount(account, weights=gaps < minimum_hours, minlength=len(self.accounts))
+        shortest = np.full(len(self.accounts), np.inf)
+        np.minimum.at(shortest, account, gaps)
+        return {name: {'breaks': int(breaks[i]), 'short': int(short[i]), 'shortest_hours': round(float(shortest[i]), 2)}
+                for i, name in enumerate(self.accounts) if breaks[i]}
+
+    def code_counts(self, by_account: bool = False) -> dict:
+        """
+        Counts how often each shift code appears.
+
+        Parameters:
+        - by_account (bool): Count per account instead of across all accounts.
+
+        Returns:
+        - A dictionary mapping each code, or each `(account, code)` pair, to its count, most frequent first.
+        """
+        if by_account:
+            unique, inverse = self._group(self.code)
+            counts = np.bincount(inverse, minlength=len(unique))
+            result = {(self.accounts[a], self.codes[c]): int(n) for (a, c), n in zip(unique, counts)}
+        else:
+            counts = np.bincount(self.code, minlength=len(self.codes))
+            result = {code: int(n) for code, n in zip(self.codes, counts) if n}
+        return dict(sorted(result.items(), key=lambda item: -item[1]))
+
+    def to_frame(self):
+        """
+        Returns the columns as a pandas DataFrame with categorical `account` and `code` columns and timezone-aware
+        `start` and `end` columns.
+
+        Raises:
+        - ImportError: If pandas is not installed.
+        """
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise ImportError("ShiftColumns.to_frame() needs the optional pandas package: pip install pandas") from e
+        return pd.DataFrame({
+            'account': pd.Categorical.from_codes(self.account, self.accounts),
+            'start': pd.to_datetime(self.start, unit='s', utc=True),
+            'end': pd.to_datetime(self.end, unit='s', utc=True),
+            'code': pd.Categorical.from_codes(self.code, self.codes),
+            'hours': self.hours(),
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise the shifts in the local shift store.")
+    parser.add_argument('--account', help="only this account (default: every account)")
+    parser.add_argument('--ordinary-hours', type=float, default=76.0, help="ordinary hours per fortnight")
+    parser.add_argument('--minimum-rest', type=float, default=10.0, help="minimum break between shifts in hours")
+    args = parser.parse_args()
+
+    columns = ShiftColumns.from_store(ShiftStore(), args.account)
+    print(f"{len(columns)} shifts for {len(columns.accounts)} accounts")
+    print("Hours per fortnight:")
+    for (account, fortnight), hours in columns.hours_per_fortnight().items():
+        print(f"  {account:<20} {fortnight}  {hours:6.2f}")
+    print("Overtime fortnights:")
+    for account, stats in columns.overtime_frequency(args.ordinary_hours).items():
+        print(f"  {account:<20} {stats['overtime']}/{stats['fortnights']} ({stats['frequency']:.0%})")
+    print(f"Breaks under {args.minimum_rest:g} hours:")
+    for account, stats in columns.short_rests(args.minimum_rest).items():
+        print(f"  {account:<20} {stats['short']}/{stats['breaks']} (shortest {stats['shortest_hours']:g}h)")
+    print("Shift codes:")
+    for code, count in columns.code_counts().items():
+        print(f"  {code:<20} {count}")
+
+
+if __name__ == '__main__':
+    main()
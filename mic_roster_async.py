@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Async Engine.
+
+An asyncio implementation of the scrape-and-sync flow for processes serving many accounts. Nothing blocks the event
+loop:
+
+- `AsyncRosterSession` replays the ASP.NET login and month postbacks over an httpx `AsyncClient`, building the forms
+  with the same helpers as `mic_roster_http.RosterSession`. Page parsing runs in a worker thread.
+- `AsyncCalendar` calls the Google Calendar REST API directly, sharing one pooled, keep-alive `AsyncClient` between
+  all accounts. Concurrent requests per account are bounded by a semaphore, every request takes a token from the
+  shared `mic_roster_batch.LIMITER`, rate-limited calls are retried with exponential backoff and jitter, and token
+  refreshes run in a worker thread. Writes that still fail go to the dead-letter queue.
+- `sync_account_async()` overlaps the two: while month N is being written to the calendar, month N+1 is already
+  being fetched and parsed. A semaphore bounds how many parsed months may wait to be written.
+
+Requires the optional `httpx` package.
+
+Usage:
+    $ python mic_roster_async.py accounts.json --concurrency 8
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import time
+from types import SimpleNamespace
+from typing import Iterable
+from urllib.parse import quote
+
+from bs4 import BeautifulSoup
+
+from mic_roster_accounts import SCOPES, AccountResult, load_accounts, report_results
+from mic_roster_auth import CREDENTIAL_CACHE, DEFAULT_ACCOUNT
+from mic_roster_batch import LIMITER, TokenBucket, error_status, is_retryable
+from mic_roster_cache import CACHE_DIR, PageCache
+from mic_roster_deadletters import DeadLetterQueue
+from mic_roster_http import LOGIN_URL, LoginError, SessionExpired, form_action, login_fields, navigation_fields, \
+    shows_calendar
+from mic_roster_metrics import count, span
+from mic_roster_pipeline import walk_steps
+from mic_roster_selenium import CREDENTIALS_PATH, load_google_credentials, parse_page
+from mic_roster_sync import build_event, month_window, patch_body, plan_sync, roster_events_in_window
+
+CALENDAR_API = 'https://www.googleapis.com/calendar/v3'
+
+
+def _import_httpx():
+    try:
+        import httpx
+    except ImportError as e:
+        raise ImportError("The async engine needs the optional httpx package: pip install httpx") from e
+    return httpx
+
+
+class AsyncHttpError(Exception):
+    """
+    A Calendar API call that failed with an HTTP error status.
+
+    Carries `resp.status` and the response `content` like `googleapiclient.errors.HttpError`, so
+    `mic_roster_batch.is_retryable()` and `error_status()` work on it unchanged.
+    """
+
+    def __init__(self, status: int, content: bytes, method: str, url: str):
+        super().__init__(f"{method} {url} returned HTTP {status}")
+        self.resp = SimpleNamespace(status=status)
+        self.content = content
+
+
+class AsyncRosterSession:
+    """
+    A logged-in roster session driven by asyncio, with the same methods as `mic_roster_http.RosterSession`.
+
+    Every session owns its `AsyncClient`, because the ASP.NET session cookie must not be shared between accounts.
+    """
+
+    def __init__(self, url: str = LOGIN_URL, timeout: float = 30, client=None):
+        """
+        Parameters:
+        - url (str): The Default.aspx URL of the roster site.
+        - timeout (float): Timeout in seconds for each HTTP request.
+        - client (httpx.AsyncClient): An optional pre-configured client, closed by `aclose()`.
+        """
+        self.url = url
+        self.client = client or _import_httpx().AsyncClient(timeout=timeout, follow_redirects=True)
+        self.page_url = url
+        self.page_html = None
+        self.logged_in = False
+        self._soup = None
+
+    async def _keep(self, response) -> str:
+        count('roster_requests', engine='async')
+        count('roster_bytes', len(response.content), engine='async')
+        response.raise_for_status()
+        self.page_url = str(response.url)
+        self.page_html = response.text
+        # Parsing a full page takes long enough to stall other accounts, so it runs in a worker thread.
+        self._soup = await asyncio.to_thread(BeautifulSoup, self.page_html, 'html.parser')
+        return self.page_html
+
+    async def _post(self, fields: dict) -> str:
+        return await self._keep(await self.client.post(form_action(self._soup, self.page_url), data=fields))
+
+    def _check_session(self, html: str) -> str:
+        if not shows_calendar(self._soup):
+            self.logged_in = False
+            raise SessionExpired(f"Roster session for {self.url} has expired")
+        return html
+
+    async def login(self, username: str, password: str) -> str:
+        """
+        Logs in and returns the page HTML showing the current month.
+
+        Raises:
+        - LoginError: If the calendar is not present after the login postback.
+        - httpx.HTTPError: If the site cannot be reached or returns an error status.
+        """
+        with span('login', engine='async'):
+            html = await self._keep(await self.client.get(self.url))
+            if shows_calendar(self._soup):
+                self.logged_in = True
+                return html
+            self.logged_in = False
+            html = await self._post(login_fields(self._soup, username, password))
+            if not shows_calendar(self._soup):
+                raise LoginError(f"Login to {self.url} did not reach the roster calendar")
+            self.logged_in = True
+            return html
+
+    async def open(self, username: str, password: str) -> str:
+        """Returns the current month page, reusing the login while it is valid; see `pipeline.open_calendar()`."""
+        if self.logged_in:
+            try:
+                return self._check_session(await self._keep(await self.client.get(self.url)))
+            except SessionExpired:
+                print("Roster session expired, logging in again")
+        return await self.login(username, password)
+
+    async def fetch_next_page_html(self, button_name: str) -> str:
+        """
+        Triggers a calendar navigation postback and returns the HTML of the resulting page.
+
+        Raises:
+        - RuntimeError: If called before `login()`.
+        - SessionExpired: If the postback lands on the login page.
+        - httpx.HTTPError: If the postback fails.
+        """
+        if self._soup is None:
+            raise RuntimeError("login() must be called before navigating the calendar")
+        with span('navigate', engine='async'):
+            return self._check_session(await self._post(navigation_fields(self._soup, button_name)))
+
+    async def aclose(self):
+        """Closes the underlying HTTP client."""
+        await self.client.aclose()
+
+
+class AsyncCalendar:
+    """
+    Google Calendar REST calls for one account's calendar over a shared connection pool.
+
+    Example:
+    ```
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=20)) as client:
+        calendar = AsyncCalendar(credentials, client)
+        events = await calendar.list_roster_events(time_min, time_max)
+    ```
+    """
+
+    def __init__(self, credentials, client, calendar_id: str = 'primary', concurrency: int = 10,
+                 max_retries: int = 5, backoff: float = 1.0, limiter: TokenBucket = LIMITER,
+                 account: str = DEFAULT_ACCOUNT, credentials_path: str = CREDENTIALS_PATH):
+        """
+        Parameters:
+        - credentials (google.oauth2.credentials.Credentials): The account's OAuth credentials.
+        - client (httpx.AsyncClient): The pooled client, usually shared by every account.
+        - calendar_id (str): ID of the calendar to sync. Default is 'primary'.
+        - concurrency (int): The most requests this calendar has in flight at once.
+        - max_retries (int): How many times a rate-limited or transiently failing request is retried.
+        - backoff (float): Base delay in seconds; doubled on every retry and given random jitter.
+        - limiter (TokenBucket): The rate limiter shared with every other calendar. None disables rate limiting.
+        - account (str): The account the credentials belong to. Tokens are refreshed through the shared
+          `mic_roster_auth.CREDENTIAL_CACHE`, under its locks, and the refreshed token is saved for other processes.
+        - credentials_path (str): The OAuth client secrets file, used only if the account has no usable token.
+        """
+        self.credentials = credentials
+        self.client = client
+        self.calendar_id = calendar_id
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.limiter = limiter
+        self.account = account
+        self.credentials_path = credentials_path
+        self._slots = asyncio.Semaphore(max(1, concurrency))
+        self._refresh = asyncio.Lock()
+
+    async def _token(self) -> str:
+        if CREDENTIAL_CACHE.is_fresh(self.credentials):
+            return self.credentials.token
+        # One refresh per calendar at a time; the cache's own locks coordinate with other threads and processes.
+        async with self._refresh:
+            if not CREDENTIAL_CACHE.is_fresh(self.credentials):
+                self.credentials = await asyncio.to_thread(CREDENTIAL_CACHE.get, self.account, SCOPES,
+                                                           self.credentials_path)
+        return self.credentials.token
+
+    async def _request(self, method: str, path: str = '', params: dict = None, body: dict = None):
+        url = f"{CALENDAR_API}/calendars/{quote(self.calendar_id, safe='')}/events{path}"
+        for attempt in range(self.max_retries + 1):
+            headers = {'Authorization': f'Bearer {await self._token()}'}
+            if self.limiter is not None:
+                await asyncio.sleep(self.limiter.reserve())
+            async with self._slots:
+                count('calendar_api_calls', operation=method.lower())
+                with span('calendar_request', method=method):
+                    response = await self.client.request(method, url, params=params, json=body, headers=headers)
+            if response.status_code < 400:
+                if self.limiter is not None:
+                    self.limiter.reward()
+                return response.json() if response.content else None
+            error = AsyncHttpError(response.status_code, response.content, method, url)
+            if attempt == self.max_retries or not is_retryable(error):
+                raise error
+            count('calendar_retries', operation=method.lower())
+            if self.limiter is not None:
+                self.limiter.throttle()
+            delay = self.backoff * 2 ** attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+    async def list_roster_events(self, time_min: datetime.datetime, time_max: datetime.datetime) -> list:
+        """Lists the roster events starting in a window, following result pages; see `sync.list_roster_events()`."""
+        events, page_token = [], None
+        while True:
+            params = {'timeMin': time_min.isoformat(), 'timeMax': time_max.isoformat(), 'singleEvents': 'true',
+                      'maxResults': 2500}
+            if page_token:
+                params['pageToken'] = page_token
+            result = await self._request('GET', params=params)
+            events.extend(roster_events_in_window(result.get('items', []), time_min))
+            page_token = result.get('nextPageToken')
+            if not page_token:
+                return events
+
+    async def insert(self, body: dict) -> dict:
+        """
+        Creates an event and returns it. An insert whose event `id` is taken already, because an earlier attempt
+        was stored before its response was lost, counts as created.
+        """
+        try:
+            return await self._request('POST', body=body)
+        except AsyncHttpError as e:
+            if 'id' not in body or error_status(e) != 409:
+                raise
+            return body
+
+    async def patch(self, event_id: str, body: dict) -> dict:
+        """Patches an event and returns it."""
+        return await self._request('PATCH', f"/{quote(event_id, safe='')}", body=body)
+
+    async def delete(self, event_id: str):
+        """Deletes an event. An event that is already gone counts as deleted."""
+        try:
+            await self._request('DELETE', f"/{quote(event_id, safe='')}")
+        except AsyncHttpError as e:
+            if error_status(e) not in (404, 410):
+                raise
+
+    async def _write(self, operation: str, event_id: str = None, body: dict = None):
+        if operation == 'insert':
+            return await self.insert(body)
+        if operation == 'patch':
+            return await self.patch(event_id, body)
+        return await self.delete(event_id)
+
+    async def apply(self, plan, dead_letters: DeadLetterQueue = None, account: str = '') -> dict:
+        """
+        Issues the writes of a `SyncPlan` concurrently.
+
+        Parameters:
+        - plan (mic_roster_sync.SyncPlan): The writes to make.
+        - dead_letters (DeadLetterQueue): Optional queue for writes that still fail after every retry.
+        - account (str): The account the writes belong to in `dead_letters`.
+
+        Returns:
+        - A dictionary with the number of `inserted`, `patched`, `deleted` and `failed` writes.
+        """
+        writes = ([('insert', None, build_event(shift)) for shift in plan.inserts]
+                  + [('patch', event_id, patch_body(shift)) for event_id, shift in plan.patches]
+                  + [('delete', event_id, None) for event_id in plan.deletes])
+        counts = {'inserted': 0, 'patched': 0, 'deleted': 0, 'failed': 0}
+        outcomes = {'insert': 'inserted', 'patch': 'patched', 'delete': 'deleted'}
+        results = await asyncio.gather(*(self._write(*write) for write in writes), return_exceptions=True)
+        for (operation, event_id, body), result in zip(writes, results):
+            if isinstance(result, Exception):
+                print(f"Calendar {operation} failed: {result}")
+                counts['failed'] += 1
+                if dead_letters is not None:
+                    dead_letters.record(operation, result, body, event_id, account, self.calendar_id)
+            else:
+                counts[outcomes[operation]] += 1
+        return counts
+
+    async def replay(self, dead_letters: DeadLetterQueue, account: str = '') -> dict:
+        """Sends the queued failed writes of an account again; see `DeadLetterQueue.replay()`."""
+        letters = dead_letters.take(account, self.calendar_id)
+        counts = {'replayed': 0, 'failed': 0}
+        results = await asyncio.gather(*(self._write(letter.operation, letter.event_id, letter.body)
+                                         for letter in letters), return_exceptions=True)
+        for letter, result in zip(letters, results):
+            if isinstance(result, Exception):
+                counts['failed'] += 1
+                dead_letters.retry_later(letter, result)
+            else:
+                counts['replayed'] += 1
+        if letters:
+            print(f"Replayed {counts['replayed']} of {len(letters)} failed calendar writes")
+        return counts
+
+
+async def sync_month(calendar: AsyncCalendar, month, dead_letters: DeadLetterQueue = None, account: str = '') -> dict:
+    """
+    Brings the calendar's roster events for one parsed month in line with its shifts.
+
+    Parameters:
+    - calendar (AsyncCalendar): The calendar to write to.
+    - month (mic_roster_parser.RosterMonth): The parsed month.
+    - dead_letters (DeadLetterQueue): Optional queue for writes that still fail after every retry.
+    - account (str): The account the writes belong to in `dead_letters`.
+
+    Returns:
+    - The write counts from `AsyncCalendar.apply()`.
+    """
+    time_min, time_max = month_window([0], today=datetime.date(month.year, month.month, 1))
+    plan = plan_sync(month.shifts, await calendar.list_roster_events(time_min, time_max))
+    print(f"Sync plan {month.year}-{month.month:02d}: {len(plan.inserts)} inserts, {len(plan.patches)} patches, "
+          f"{len(plan.deletes)} deletes")
+    return await calendar.apply(plan, dead_letters, account)
+
+
+async def sync_account_async(username: str, password: str, calendar: AsyncCalendar,
+                             offsets: Iterable[int] = range(0, 3), url: str = LOGIN_URL, cache: PageCache = None,
+                             parse=parse_page, max_pending: int = 2, roster: AsyncRosterSession = None,
+                             dead_letters: DeadLetterQueue = None, account: str = '') -> dict:
+    """
+    Scrapes a range of months and syncs those that changed, writing each month while the next is fetched.
+
+    Parameters:
+    - username (str): The personnel ID used to log in.
+    - password (str): The account password.
+    - calendar (AsyncCalendar): The calendar to write to.
+    - offsets (Iterable[int]): Month offsets to sync. Default is the current month and the two after it.
+    - url (str): The URL of the roster login page.
+    - cache (PageCache): The page cache; unchanged months are skipped. A `PageCache` in the default location is
+      used when omitted.
+    - parse (callable): The page parser, run in a worker thread. Default is `parse_page()`, which skips and reports
+      malformed cells.
+    - max_pending (int): The most parsed months waiting for, or in the middle of, their calendar writes. The walk
+      pauses when the limit is reached.
+    - roster (AsyncRosterSession): A long-lived session to reuse. A new one is created and closed when omitted.
+    - dead_letters (DeadLetterQueue): Optional queue of failed writes. The account's queued writes are replayed
+      before the roster is fetched, and writes that fail in this run are added to it.
+    - account (str): The account the writes belong to in `dead_letters`.
+
+    Returns:
+    - A dictionary with the number of months `fetched` and `changed` and the summed write counts, like
+      `mic_roster_selenium.run_sync()`.
+    """
+    if dead_letters is not None:
+        await calendar.replay(dead_letters, account)
+    cache = cache or PageCache()
+    offsets = cache.uncached_offsets(offsets)
+    owned = roster is None
+    roster = roster or AsyncRosterSession(url)
+    pending = asyncio.Semaphore(max(1, max_pending))
+    totals = {'fetched': len(offsets), 'changed': 0, 'inserted': 0, 'patched': 0, 'deleted': 0, 'failed': 0}
+    writes = []
+
+    async def write(html, month):
+        try:
+            with span('calendar_sync', engine='async'):
+                counts = await sync_month(calendar, month, dead_letters, account)
+            print(f"Synced {month.year}-{month.month:02d}: {counts}")
+            for name, value in counts.items():
+                totals[name] += value
+            if not counts['failed']:
+                cache.put(html)
+        finally:
+            pending.release()
+
+    async def handle(html):
+        if cache.is_unchanged(html):
+            return
+        totals['changed'] += 1
+        month = await asyncio.to_thread(parse, html)
+        await pending.acquire()
+        writes.append(asyncio.create_task(write(html, month)))
+
+    try:
+        html = await roster.open(username, password)
+        if 0 in offsets:
+            await handle(html)
+        for button, _, wanted in walk_steps(offsets):
+            html = await roster.fetch_next_page_html(button)
+            if wanted:
+                await handle(html)
+        await asyncio.gather(*writes)
+    finally:
+        for task in writes:
+            task.cancel()
+        if owned:
+            await roster.aclose()
+    return totals
+
+
+async def run_accounts_async(accounts: Iterable, offsets: Iterable[int] = range(0, 3), url: str = LOGIN_URL,
+                             credentials_path: str = CREDENTIALS_PATH, cache_dir: str = CACHE_DIR,
+                             concurrency: int = 8, connections: int = 20) -> list:
+    """
+    Syncs many accounts on one event loop.
+
+    Parameters:
+    - accounts (Iterable[mic_roster_accounts.Account]): The accounts to sync.
+    - offsets (Iterable[int]): Month offsets to sync.
+    - url (str): The URL of the roster login page.
+    - credentials_path (str): The OAuth client secrets file, shared by all accounts.
+    - cache_dir (str): Parent directory of the per-account page caches.
+    - concurrency (int): The most accounts synced at the same time.
+    - connections (int): Size of the Calendar API connection pool shared by every account.
+
+    Returns:
+    - A list of `mic_roster_accounts.AccountResult`, in the same order as `accounts`.
+    """
+    httpx = _import_httpx()
+    offsets = list(offsets)
+    slots = asyncio.Semaphore(max(1, concurrency))
+    dead_letters = DeadLetterQueue()
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+
+    async with httpx.AsyncClient(limits=limits, timeout=30) as api:
+        async def run(account):
+            async with slots:
+                started = time.perf_counter()
+                try:
+                    credentials = await asyncio.to_thread(load_google_credentials, SCOPES, account.token_path,
+                                                          credentials_path, account.name)
+                    calendar = AsyncCalendar(credentials, api, account.calendar_id, account=account.name,
+                                             credentials_path=credentials_path)
+                    totals = await sync_account_async(account.username, account.password, calendar, offsets, url,
+                                                      PageCache(os.path.join(cache_dir, account.name)),
+                                                      dead_letters=dead_letters, account=account.name)
+                    return AccountResult(account.name, totals['failed'] == 0, time.perf_counter() - started, totals)
+                except Exception as e:
+                    return AccountResult(account.name, False, time.perf_counter() - started,
+                                         error=f"{type(e).__name__}: {e}")
+
+        return await asyncio.gather(*(run(account) for account in accounts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync the Mic Roster of several accounts with the async engine.")
+    parser.add_argument('accounts', help="JSON file listing the accounts to sync")
+    parser.add_argument('--concurrency', type=int, default=8, help="accounts synced at the same time (default 8)")
+    parser.add_argument('--connections', type=int, default=20, help="Calendar API connection pool size")
+    parser.add_argument('--past', type=int, default=0, help="number of past months to sync")
+    parser.add_argument('--future', type=int, default=2, help="number of months after the current one to sync")
+    parser.add_argument('--report', help="write the per-account results to this JSON file")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = asyncio.run(run_accounts_async(load_accounts(args.accounts), range(-args.past, args.future + 1),
+                                             concurrency=args.concurrency, connections=args.connections))
+    if not report_results(results, time.perf_counter() - started, args.report):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Credential Cache.
+
+Keeps the Google OAuth credentials of every account in memory and on disk, so concurrent syncs neither race on a
+token file nor refresh the same token over and over:
+
+- Credentials are keyed by account name and stored as JSON (`Credentials.to_json()`), one file per account in
+  `.cache/tokens`, written atomically with owner-only permissions. An old `token.pickle` is read once and migrated.
+- Within a process every caller gets the same credentials object. While its access token is valid for longer than
+  `refresh_margin`, no lock is taken and no file is read. A refresh replaces the object with a new one built from
+  the token file, so callers that keep credentials, or a service built on them, should get them again before use.
+- A token about to expire is refreshed ahead of time under a per-account lock and an `fcntl` lock on the token
+  file. A caller that waited for the lock first re-reads the file, so when another thread or process has just
+  refreshed the token, that refresh is reused instead of repeated.
+
+Example:
+```
+creds = CREDENTIAL_CACHE.get('jsmith', SCOPES, credentials_path='credentials.json')
+```
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import contextlib
+import datetime
+import json
+import os
+import re
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; the cache then only coordinates threads of one process.
+    fcntl = None
+
+from mic_roster_metrics import count, span
+
+TOKEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'tokens')
+DEFAULT_ACCOUNT = 'default'
+_UNSAFE_RE = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+@contextlib.contextmanager
+def file_lock(path: str):
+    """Holds an exclusive `fcntl` lock on `path` (created if needed) for the duration of a `with` block."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _utcnow() -> datetime.datetime:
+    # google-auth keeps `expiry` as a naive UTC datetime.
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class CredentialCache:
+    """A process-wide, file-backed cache of Google OAuth credentials keyed by account."""
+
+    def __init__(self, directory: str = TOKEN_DIR, refresh_margin: float = 300):
+        """
+        Parameters:
+        - directory (str): Where the per-account token files are kept.
+        - refresh_margin (float): Seconds before expiry at which a token is refreshed.
+        """
+        self.directory = directory
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self._credentials = {}
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def token_path(self, account: str = DEFAULT_ACCOUNT) -> str:
+        """Returns the JSON token file of an account."""
+        return os.path.join(self.directory, f"{_UNSAFE_RE.sub('_', account) or DEFAULT_ACCOUNT}.json")
+
+    def _lock(self, account: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(account, threading.Lock())
+
+    def is_fresh(self, creds) -> bool:
+        """Reports whether credentials can be used for at least `refresh_margin` without a refresh."""
+        if creds is None or not creds.valid:
+            return False
+        return creds.expiry is None or creds.expiry - self.refresh_margin > _utcnow()
+
+    @staticmethod
+    def _read(path: str, scopes: list):
+        from google.oauth2.credentials import Credentials
+
+        try:
+            with open(path) as f:
+                return Credentials.from_authorized_user_info(json.load(f), scopes)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            print(f"Ignoring unreadable token file {path}: {e}")
+            return None
+
+    @staticmethod
+    def _read_legacy(path: str):
+        if not path or not os.path.exists(path):
+            return None
+        import pickle
+
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    @staticmethod
+    def _write(path: str, creds):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = f'{path}.tmp'
+        descriptor = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, 'w') as f:
+            f.write(creds.to_json())
+        os.replace(temporary, path)
+
+    def get(self, account: str = DEFAULT_ACCOUNT, scopes: list = None, credentials_path: str = None,
+            legacy_path: str = None):
+        """
+        Returns valid credentials for an account, refreshing them or running the OAuth flow only when needed.
+
+        Parameters:
+        - account (str): The account the credentials belong to.
+        - scopes (list): The OAuth scopes to request.
+        - credentials_path (str): The OAuth client secrets file, used only if there is no usable token.
+        - legacy_path (str): A `token.pickle` to migrate from when the account has no JSON token file yet.
+
+        Returns:
+        - A valid `google.oauth2.credentials.Credentials` object. Repeated calls for one account return the same
+          object until its token is refreshed, and then a new one with the new access and refresh tokens.
+
+        Raises:
+        - google.auth.exceptions.RefreshError: If the refresh token has been revoked or has expired.
+        - FileNotFoundError: If a new authentication flow is needed and `credentials_path` does not exist.
+        """
+        creds = self._credentials.get(account)
+        if self.is_fresh(creds):
+            return creds
+        with self._lock(account):
+            creds = self._credentials.get(account)
+            if self.is_fresh(creds):
+                return creds
+            path = self.token_path(account)
+            with file_lock(f'{path}.lock'):
+                # Another thread or process may have refreshed the token while this one waited for the lock.
+                stored = self._read(path, scopes)
+                migrated = stored is None and legacy_path is not None
+                if migrated:
+                    stored = self._read_legacy(legacy_path)
+                if not self.is_fresh(stored):
+                    stored = self._renew(stored, scopes, credentials_path)
+                    self._write(path, stored)
+                elif migrated:
+                    count('token_migrations')
+                    self._write(path, stored)
+            # `stored` was built from the token file, so it carries a refresh token Google may have rotated.
+            self._credentials[account] = stored
+            return stored
+
+    @staticmethod
+    def _renew(creds, scopes: list, credentials_path: str):
+        if creds is not None and creds.refresh_token:
+            from google.auth.transport.requests import Request
+
+            count('token_refreshes')
+            with span('token_refresh'):
+                creds.refresh(Request())
+            return creds
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        flow = InstalledAppFlow.from_client_secrets_file(credentials_path, scopes)
+        return flow.run_local_server(port=0)
+
+    def forget(self, account: str = DEFAULT_ACCOUNT):
+        """Drops an account's credentials from memory, e.g. after they were revoked. The file is kept."""
+        with self._lock(account):
+            self._credentials.pop(account, None)
+
+
+CREDENTIAL_CACHE = CredentialCache()
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Calendar Batching.
+
+Groups Google Calendar writes into HTTP batch requests. Calling `.execute()` on every insert, patch and delete
+costs one HTTPS round trip per shift; a batch request carries up to `MAX_BATCH_SIZE` of them in a single round
+trip. Each queued write gets its own result, and writes rejected with a rate-limit or transient server error are
+retried in a later batch with exponential backoff.
+
+A server error can arrive after Google has already stored an insert, so an insert is only retried on one when its
+body carries an event `id`: the repeat is then rejected with 409, which counts as success. Inserts without an `id`
+are retried on rate-limit errors only, which Google sends before writing anything.
+
+Every write first takes a token from a `TokenBucket`. The module-level `LIMITER` is shared by every batcher in the
+process, so many accounts synced at once stay under the project's Calendar quota together. The bucket adapts: a
+rate-limit response halves its rate, and each successful write raises it again a little, so throughput settles just
+below the quota ceiling instead of repeatedly hitting it.
+
+The batcher only relies on `service.events()` and `service.new_batch_http_request()`, so it works with the
+service returned by `authenticate_google_calendar()` as well as with a mocked discovery service.
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import random
+import threading
+import time
+from typing import Any, NamedTuple
+
+from mic_roster_metrics import count, span
+
+MAX_BATCH_SIZE = 50
+RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded', b'quotaExceeded')
+RETRYABLE_STATUSES = (429, 500, 502, 503)
+DEFAULT_RATE = 50.0
+
+
+class BatchResult(NamedTuple):
+    """The outcome of one queued write."""
+    request_id: str
+    operation: str
+    ok: bool
+    response: Any = None
+    error: Exception = None
+
+
+def error_status(error: Exception):
+    """Returns the HTTP status carried by a googleapiclient `HttpError`, or None for any other exception."""
+    resp = getattr(error, 'resp', None)
+    return getattr(resp, 'status', None)
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Reports whether a failed write should be retried.
+
+    Parameters:
+    - error (Exception): The exception returned for a write, typically a `googleapiclient.errors.HttpError`.
+
+    Returns:
+    - True for 429 and transient 5xx responses, and for 403 responses whose reason is a rate or quota limit.
+    """
+    status = error_status(error)
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        content = getattr(error, 'content', b'') or b''
+        return any(reason in content for reason in RATE_LIMIT_REASONS)
+    return False
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket whose rate adapts to quota responses (additive increase, multiplicative decrease).
+
+    Example:
+    ```
+    limiter = TokenBucket(rate=10)
+    limiter.acquire()           # blocks until a token is available
+    try:
+        request.execute()
+        limiter.reward()
+    except HttpError as e:
+        if is_retryable(e):
+            limiter.throttle()
+    ```
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: float = 2 * MAX_BATCH_SIZE, min_rate: float = 1.0,
+                 max_rate: float = 10 * DEFAULT_RATE, increase: float = 1.0, decrease: float = 0.5,
+                 cooldown: float = 1.0, clock=time.monotonic, sleep=time.sleep):
+        """
+        Parameters:
+        - rate (float): Starting rate in requests per second.
+        - burst (float): Most tokens the bucket holds; a full bucket lets this many requests through at once.
+        - min_rate (float): The rate never drops below this.
+        - max_rate (float): The rate never rises above this.
+        - increase (float): How much the rate grows per second of writes that all succeed at the current rate.
+        - decrease (float): Factor applied to the rate on a rate-limit response.
+        - cooldown (float): Seconds after a decrease during which further rate-limit responses are ignored, so one
+          rejected batch only halves the rate once.
+        - clock (callable): Monotonic clock in seconds.
+        - sleep (callable): The function used to wait for tokens. Replace it to test without delays.
+        """
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._updated = clock()
+        self._throttled = None
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int = 1) -> float:
+        """
+        Takes tokens without blocking and returns how many seconds the caller must wait before using them.
+
+        Asynchronous callers wait with `await asyncio.sleep(limiter.reserve())`.
+        """
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens: int = 1) -> float:
+        """Blocks until `tokens` requests may be sent and returns the seconds waited."""
+        delay = self.reserve(tokens)
+        if delay:
+            count('rate_limit_waits')
+            self.sleep(delay)
+        return delay
+
+    def reward(self, successes: int = 1):
+        """Raises the rate after successful requests, up to `max_rate`."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase * successes / self.rate)
+
+    def throttle(self):
+        """Cuts the rate after a rate-limit response, down to `min_rate`."""
+        with self._lock:
+            now = self.clock()
+            if self._throttled is not None and now - self._throttled < self.cooldown:
+                return
+            self._throttled = now
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Drop the tokens saved up at the old rate, so the next requests are spaced at the new one.
+            self._tokens = min(self._tokens, 0.0)
+            count('rate_limit_throttles')
+
+
+LIMITER = TokenBucket()
+
+
+def execute_with_retry(request, limiter: TokenBucket = LIMITER, max_retries: int = 5, backoff: float = 1.0,
+                       sleep=time.sleep):
+    """
+    Executes a single Calendar API request under the rate limiter, retrying rate-limited and transient failures.
+
+    Parameters:
+    - request (googleapiclient.http.HttpRequest): The request, e.g. `service.events().insert(...)`.
+    - limiter (TokenBucket): The rate limiter to take a token from. Default is the shared `LIMITER`.
+    - max_retries (int): How many times a retryable failure is retried.
+    - backoff (float): Base delay in seconds; doubled on every retry and given random jitter.
+    - sleep (callable): The function used to wait between retries.
+
+    Returns:
+    - The response of the request.
+
+    Raises:
+    - googleapiclient.errors.HttpError: If the request fails with a non-retryable error, or still fails after
+      `max_retries` retries.
+    """
+    for attempt in range(max_retries + 1):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            response = request.execute()
+        except Exception as e:
+            if attempt == max_retries or not is_retryable(e):
+                raise
+            count('calendar_retries')
+            if limiter is not None:
+                limiter.throttle()
+            delay = backoff * 2 ** attempt
+            sleep(delay + random.uniform(0, delay))
+        else:
+            if limiter is not None:
+                limiter.reward()
+            return response
+
+
+class CalendarBatcher:
+    """
+    Queues Calendar inserts, patches and deletes and sends them as batch requests.
+
+    Example:
+    ```
+    batcher = CalendarBatcher(service)
+    batcher.insert(event)
+    batcher.delete(event_id)
+    for result in batcher.execute():
+        if not result.ok:
+            print(f"{result.operation} {result.request_id} failed: {result.error}")
+    ```
+    """
+
+    def __init__(self, service, calendar_id: str = 'primary', batch_size: int = MAX_BATCH_SIZE,
+                 max_retries: int = 5, backoff: float = 1.0, sleep=time.sleep, limiter: TokenBucket = LIMITER):
+        """
+        Parameters:
+        - service (googleapiclient.discovery.Resource): The authenticated Google Calendar service object.
+        - calendar_id (str): ID of the calendar to write to. Default is 'primary'.
+        - batch_size (int): Writes per batch request, capped at the API limit of `MAX_BATCH_SIZE`.
+        - max_retries (int): How many times a rate-limited write is retried before it is reported as failed.
+        - backoff (float): Base delay in seconds; the delay doubles on every retry round and gets random jitter.
+        - sleep (callable): The function used to wait between retry rounds. Replace it to test without delays.
+        - limiter (TokenBucket): The rate limiter every write takes a token from. Default is the shared `LIMITER`;
+          None disables rate limiting.
+        """
+        self.service = service
+        self.calendar_id = calendar_id
+        self.batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.limiter = limiter
+        self._queue = []
+
+    def __len__(self):
+        return len(self._queue)
+
+    def _add(self, operation: str, build, request_id: str = None, body: dict = None) -> str:
+        request_id = request_id or f"{operation}-{len(self._queue)}"
+        self._queue.append((request_id, operation, build, body))
+        return request_id
+
+    def insert(self, body: dict, request_id: str = None) -> str:
+        """
+        Queues an event insert and returns its request ID. Give the body an `id`, as `build_event()` does, so the
+        insert can be retried safely after a server error.
+        """
+        return self._add('insert', lambda: self.service.events().insert(
+            calendarId=self.calendar_id, body=body), request_id, body)
+
+    def patch(self, event_id: str, body: dict, request_id: str = None) -> str:
+        """Queues a patch of an existing event and returns its request ID."""
+        return self._add('patch', lambda: self.service.events().patch(
+            calendarId=self.calendar_id, eventId=event_id, body=body), request_id)
+
+    def delete(self, event_id: str, request_id: str = None) -> str:
+        """Queues an event delete and returns its request ID."""
+        return self._add('delete', lambda: self.service.events().delete(
+            calendarId=self.calendar_id, eventId=event_id), request_id)
+
+    def _send(self, chunk: list, results: dict, retry: list, final: bool):
+        operations = {item[0]: item for item in chunk}
+        succeeded, throttled = [], []
+
+        def callback(request_id, response, exception):
+            item = operations[request_id]
+            operation, body = item[1], item[3]
+            status = error_status(exception)
+            has_id = body is not None and 'id' in body
+            if operation == 'insert' and has_id and status == 409:
+                # An earlier attempt was stored even though its response was lost; the event is the body we sent.
+                exception, response = None, body
+            if exception is None or (operation == 'delete' and status in (404, 410)):
+                results[request_id] = BatchResult(request_id, operation, True, response)
+                succeeded.append(request_id)
+            elif not final and is_retryable(exception) and (operation != 'insert' or has_id or status < 500):
+                count('calendar_retries', operation=operation)
+                throttled.append(request_id)
+                retry.append(item)
+            else:
+                count('calendar_failures', operation=operation)
+                results[request_id] = BatchResult(request_id, operation, False, error=exception)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for request_id, operation, build, _ in chunk:
+            count('calendar_api_calls', operation=operation)
+            batch.add(build(), request_id=request_id)
+        if self.limiter is not None:
+            # The quota counts every request inside a batch, not the batch itself.
+            self.limiter.acquire(len(chunk))
+        try:
+            count('calendar_batches')
+            with span('calendar_batch'):
+                batch.execute()
+        except Exception as e:
+            # The whole batch failed to go through; every write in it shares the error.
+            for request_id in operations:
+                if request_id not in results and operations[request_id] not in retry:
+                    callback(request_id, None, e)
+        if self.limiter is not None:
+            if throttled:
+                self.limiter.throttle()
+            elif succeeded:
+                self.limiter.reward(len(succeeded))
+
+    def execute(self) -> list:
+        """
+        Sends every queued write and empties the queue.
+
+        Returns:
+        - A list of `BatchResult`, one per queued write, in the order the writes were queued.
+        """
+        queue, self._queue = self._queue, []
+        results = {}
+        pending = queue
+        for attempt in range(self.max_retries + 1):
+            retry = []
+            for start in range(0, len(pending), self.batch_size):
+                self._send(pending[start:start + self.batch_size], results, retry, attempt == self.max_retries)
+            if not retry:
+                break
+            delay = self.backoff * 2 ** attempt
+            self.sleep(delay + random.uniform(0, delay))
+            pending = retry
+        return [results[item[0]] for item in queue]
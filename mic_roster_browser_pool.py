@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Browser Pool.
+
+Keeps headless Chrome drivers warm for the Selenium fallback path. Starting Chrome costs seconds and hundreds of
+megabytes for every fetch; a pool starts each driver once and hands it to one job after another:
+
+- Between jobs the driver's cookies, local storage and session storage are cleared and it is parked on
+  `about:blank`, so no roster session leaks from one account into the next.
+- A driver is health-checked before it is handed out and replaced if it no longer answers.
+- A driver is recycled (quit and replaced) after `max_uses` jobs, or when the memory of its Chrome processes has
+  grown by more than `max_growth_mb` since it started. Memory is read from `/proc`, so the growth check only
+  applies on Linux.
+- Drivers are started with `setup_chrome_driver(block_resources=True)`: images, style sheets and fonts are never
+  downloaded.
+
+Drivers are started lazily, so a pool costs nothing while the browserless HTTP engine keeps working.
+
+Example:
+```
+pool = BrowserPool(size=2)
+with pool.driver() as driver:
+    html = login(driver, LOGIN_URL, username, password)
+pool.close()
+```
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import contextlib
+import os
+import threading
+
+from mic_roster_metrics import count, span
+from mic_roster_selenium import setup_chrome_driver
+
+
+def _children(pid: int) -> list:
+    children = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name may contain spaces; the parent PID is the second field after it.
+                if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                    children.append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+    return children
+
+
+def process_tree_rss(pid: int):
+    """
+    Returns the resident memory in bytes of a process and all of its descendants, or None where `/proc` is not
+    available.
+    """
+    if not os.path.isdir('/proc'):
+        return None
+    total, pending = 0, [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/statm') as f:
+                total += int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, IndexError, ValueError):
+            continue
+        pending.extend(_children(current))
+    return total
+
+
+def driver_rss(driver):
+    """Returns the memory used by a driver's chromedriver and Chrome processes, or None if it cannot be read."""
+    process = getattr(getattr(driver, 'service', None), 'process', None)
+    pid = getattr(process, 'pid', None)
+    return process_tree_rss(pid) if pid else None
+
+
+class _Slot:
+    def __init__(self, driver):
+        self.driver = driver
+        self.uses = 0
+        self.baseline = driver_rss(driver)
+
+
+class BrowserPool:
+    """A thread-safe pool of reusable headless Chrome drivers."""
+
+    def __init__(self, size: int = 2, max_uses: int = 50, max_growth_mb: float = 300, factory=None):
+        """
+        Parameters:
+        - size (int): The most drivers alive at once. `acquire()` blocks while all of them are in use.
+        - max_uses (int): Jobs a driver serves before it is replaced.
+        - max_growth_mb (float): Memory growth, in megabytes, after which a driver is replaced.
+        - factory (callable): Starts a new driver. Default is `setup_chrome_driver(block_resources=True)`.
+        """
+        self.size = max(1, size)
+        self.max_uses = max_uses
+        self.max_growth = max_growth_mb * 1024 * 1024
+        self.factory = factory or (lambda: setup_chrome_driver(block_resources=True))
+        self._idle = []
+        self._busy = {}
+        self._closed = False
+        self._available = threading.Condition()
+
+    def __len__(self):
+        return len(self._idle) + len(self._busy)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def _start(self) -> _Slot:
+        count('browser_starts')
+        return _Slot(self.factory())
+
+    def _quit(self, slot: _Slot, reason: str):
+        count('browser_recycles', reason=reason)
+        try:
+            slot.driver.quit()
+        except Exception as e:
+            print(f"Could not quit Chrome cleanly: {e}")
+
+    @staticmethod
+    def is_healthy(driver) -> bool:
+        """Reports whether a driver still answers commands."""
+        try:
+            return driver.execute_script('return 1') == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def reset(driver):
+        """Clears a driver's cookies and web storage and parks it on a blank page."""
+        with span('browser_reset'):
+            try:
+                driver.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+            except Exception:
+                # Pages without an origin, like about:blank, have no storage to clear.
+                pass
+            try:
+                # Clears the cookies of every domain, not just the current page's.
+                driver.execute_cdp_cmd('Network.clearBrowserCookies', {})
+            except Exception:
+                driver.delete_all_cookies()
+            driver.get('about:blank')
+
+    def _worn_out(self, slot: _Slot):
+        if slot.uses >= self.max_uses:
+            return 'uses'
+        if slot.baseline is not None:
+            rss = driver_rss(slot.driver)
+            if rss is not None and rss - slot.baseline > self.max_growth:
+                return 'memory'
+        return None
+
+    def acquire(self, timeout: float = None):
+        """
+        Returns a clean, healthy driver, starting one if the pool has room.
+
+        Raises:
+        - TimeoutError: If no driver becomes free within `timeout` seconds.
+        - RuntimeError: If the pool is closed.
+        """
+        with self._available:
+            while True:
+                if self._closed:
+                    raise RuntimeError("The browser pool is closed")
+                if self._idle:
+                    slot = self._idle.pop()
+                    break
+                if len(self._busy) < self.size:
+                    slot = None
+                    break
+                if not self._available.wait(timeout):
+                    raise TimeoutError(f"No browser became free within {timeout}s")
+            # Reserve the place before starting Chrome outside the lock.
+            placeholder = object()
+            self._busy[placeholder] = slot
+        try:
+            if slot is not None and not self.is_healthy(slot.driver):
+                self._quit(slot, 'unhealthy')
+                slot = None
+            if slot is None:
+                slot = self._start()
+        except BaseException:
+            with self._available:
+                del self._busy[placeholder]
+                self._available.notify()
+            raise
+        slot.uses += 1
+        with self._available:
+            del self._busy[placeholder]
+            self._busy[id(slot.driver)] = slot
+        return slot.driver
+
+    def release(self, driver, healthy: bool = True):
+        """
+        Returns a driver to the pool after a job.
+
+        Parameters:
+        - driver: A driver returned by `acquire()`.
+        - healthy (bool): False if the job failed in a way that may have left the browser unusable; the driver is
+          then replaced instead of reused.
+        """
+        # The driver keeps its place in `_busy` until it is back in `_idle`, so no extra driver is started meanwhile.
+        with self._available:
+            slot = self._busy[id(driver)]
+        reason = 'failed' if not healthy else self._worn_out(slot)
+        if reason is None and not self._closed:
+            try:
+                self.reset(driver)
+            except Exception:
+                reason = 'reset'
+        if reason is not None or self._closed:
+            self._quit(slot, reason or 'closed')
+        with self._available:
+            del self._busy[id(driver)]
+            if reason is None and not self._closed:
+                self._idle.append(slot)
+            self._available.notify()
+
+    @contextlib.contextmanager
+    def driver(self, timeout: float = None):
+        """Lends a driver for the duration of a `with` block. A driver whose job raised is replaced."""
+        driver = self.acquire(timeout)
+        try:
+            yield driver
+        except BaseException:
+            self.release(driver, healthy=False)
+            raise
+        self.release(driver)
+
+    def close(self):
+        """Quits every idle driver. Drivers still in use are quit when they are released."""
+        with self._available:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._available.notify_all()
+        for slot in idle:
+            self._quit(slot, 'closed')
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Page Cache.
+
+An on-disk cache of raw roster month pages. Each entry is keyed by month (`YYYY-MM`) and stores the page HTML
+together with a hash of its calendar region: the month heading and the `DateCell` cells. The rest of the page,
+notably `__VIEWSTATE`, changes on every request and is left out of the hash, so a matching hash means the roster
+for that month is unchanged and neither parsing nor calendar writes are needed for it.
+
+Entries expire after `max_age` seconds, and the oldest entries are evicted once the cache grows past `max_bytes`.
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Iterable
+
+from mic_roster_parser import MONTHS
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'pages')
+
+_HEADING_RE = re.compile(r'id="ctl00_ContentPlaceHolder1_calendar_lblCurrentMonth"[^>]*>\s*([A-Za-z]+)\s+(\d{4})\s*<')
+_CELL_RE = re.compile(r'<td[^>]*id="ctl00_ContentPlaceHolder1_calendar_DateCell\d+"[^>]*>.*?</td>', re.S)
+
+
+def month_key(html: str):
+    """
+    Reads the month a page shows from its calendar heading, without parsing the page.
+
+    Parameters:
+    - html (str): The page HTML.
+
+    Returns:
+    - The month as `YYYY-MM`, or None if the page has no calendar heading.
+    """
+    match = _HEADING_RE.search(html)
+    if match is None or match.group(1).lower() not in MONTHS:
+        return None
+    return f"{match.group(2)}-{MONTHS[match.group(1).lower()]:02d}"
+
+
+def region_hash(html: str) -> str:
+    """
+    Hashes the calendar region of a page.
+
+    Parameters:
+    - html (str): The page HTML.
+
+    Returns:
+    - A SHA-256 hex digest of the month heading and the `DateCell` cells.
+    """
+    digest = hashlib.sha256((month_key(html) or '').encode())
+    for cell in _CELL_RE.findall(html):
+        digest.update(cell.encode())
+    return digest.hexdigest()
+
+
+class PageCache:
+    """
+    Month-keyed store of raw roster pages with calendar-region hashes.
+
+    Example:
+    ```
+    cache = PageCache()
+    if not cache.is_unchanged(html):
+        month = parse_calendar(html)
+        ...  # sync the month
+        cache.put(html)
+    ```
+    """
+
+    def __init__(self, directory: str = CACHE_DIR, max_bytes: int = 50 * 1024 * 1024,
+                 max_age: float = 90 * 24 * 3600):
+        """
+        Parameters:
+        - directory (str): Where pages and the index are stored. Created if missing.
+        - max_bytes (int): Total size of stored pages above which the oldest entries are evicted. Default is 50 MB.
+        - max_age (float): Seconds after which an entry is treated as missing and evicted. Default is 90 days.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._index_path = os.path.join(directory, 'index.json')
+        try:
+            with open(self._index_path) as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            self._index = {}
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.html')
+
+    def _entry(self, key: str):
+        entry = self._index.get(key)
+        if entry is None or time.time() - entry['stored'] > self.max_age:
+            return None
+        return entry
+
+    def _save_index(self):
+        temporary = f'{self._index_path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(temporary, self._index_path)
+
+    def __contains__(self, key: str) -> bool:
+        return self._entry(key) is not None
+
+    def get(self, key: str):
+        """Returns the cached HTML for a `YYYY-MM` month, or None if it is missing or expired."""
+        if self._entry(key) is None:
+            return None
+        try:
+            with open(self._path(key), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def is_unchanged(self, html: str) -> bool:
+        """
+        Reports whether a freshly fetched page has the same calendar region as the cached copy of its month.
+
+        Parameters:
+        - html (str): The page HTML.
+
+        Returns:
+        - True if the month is cached, not expired, and its calendar region hash matches.
+        """
+        key = month_key(html)
+        entry = self._entry(key) if key else None
+        return entry is not None and entry['hash'] == region_hash(html)
+
+    def put(self, html: str):
+        """
+        Stores a page under the month it shows and evicts old entries.
+
+        Call this once the page's month has been synced, so a failed sync is retried on the next run.
+
+        Parameters:
+        - html (str): The page HTML.
+
+        Returns:
+        - The month key the page was stored under, or None if the page has no calendar heading.
+        """
+        key = month_key(html)
+        if key is None:
+            return None
+        with self._lock:
+            with open(self._path(key), 'w', encoding='utf-8') as f:
+                f.write(html)
+            self._index[key] = {'hash': region_hash(html), 'stored': time.time(), 'size': len(html.encode())}
+            self._evict()
+            self._save_index()
+        return key
+
+    def _evict(self):
+        now = time.time()
+        expired = [key for key, entry in self._index.items() if now - entry['stored'] > self.max_age]
+        by_age = sorted((key for key in self._index if key not in expired), key=lambda k: self._index[k]['stored'])
+        total = sum(self._index[key]['size'] for key in by_age)
+        while by_age and total > self.max_bytes:
+            key = by_age.pop(0)
+            total -= self._index[key]['size']
+            expired.append(key)
+        for key in expired:
+            del self._index[key]
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def evict(self):
+        """Removes expired entries, then the oldest entries until the cache fits in `max_bytes`."""
+        with self._lock:
+            self._evict()
+            self._save_index()
+
+    def uncached_offsets(self, offsets: Iterable[int], today: datetime.date = None) -> list:
+        """
+        Drops the oldest past months from a fetch range when they are already cached.
+
+        Months can only be reached by walking from the current month, so only the cached months at the far end of
+        the range save requests; a cached month in the middle still has to be walked through.
+
+        Parameters:
+        - offsets (Iterable[int]): Month offsets relative to the current month, e.g. `range(-24, 4)`.
+        - today (datetime.date): The reference date. Default is today.
+
+        Returns:
+        - The sorted offsets that still need fetching.
+        """
+        today = today or datetime.date.today()
+        offsets = sorted(set(offsets))
+        while offsets and offsets[0] < 0:
+            index = today.year * 12 + today.month - 1 + offsets[0]
+            if f"{index // 12}-{index % 12 + 1:02d}" not in self:
+                break
+            offsets.pop(0)
+        return offsets
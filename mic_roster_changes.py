@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Change Stream.
+
+Tells downstream consumers what changed in the roster between two runs, instead of leaving them to compare whole
+calendars. Each freshly scraped month is compared with the snapshot of that month in the `ShiftStore`, and every
+difference becomes a typed `Change`:
+
+- `added`: a shift that was not rostered before.
+- `removed`: a rostered shift that is gone.
+- `time_changed`: a shift kept its code and day but starts or ends at a different time.
+- `code_changed`: a shift kept its times but has a different shift code.
+
+Changes are handed to one or more sinks: `JsonLinesSink` appends them to a file, `WebhookSink` POSTs them as JSON,
+and `StdoutSink` prints them. Months whose page is unchanged in the page cache are neither parsed nor compared, so
+a run without roster changes costs nothing here. The first run for an account reports every shift as added.
+
+Example:
+```
+changes = ChangeStream([StdoutSink(), JsonLinesSink('changes.jsonl')])
+pending = changes.detect(store, month.shifts, time_min, time_max)
+sync_calendar(service, month.shifts, time_min, time_max, store=store)
+changes.flush(pending, store, month.shifts, time_min, time_max)
+```
+
+`run_sync()` does this for every changed month when given `changes=`:
+```
+run_sync(service, username, password, store=ShiftStore(), changes=changes)
+```
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import json
+import os
+import sys
+import threading
+from collections import defaultdict
+from typing import Iterable, NamedTuple
+
+import requests
+
+from mic_roster_metrics import count, span
+
+ADDED = 'added'
+REMOVED = 'removed'
+TIME_CHANGED = 'time_changed'
+CODE_CHANGED = 'code_changed'
+
+
+class Change(NamedTuple):
+    """
+    One difference between the stored roster and a new scrape. `shift` is the shift as now rostered and `previous`
+    as it was stored; an added shift has no `previous` and a removed one no `shift`.
+    """
+    kind: str
+    date: datetime.date
+    shift: tuple = None
+    previous: tuple = None
+    account: str = ''
+
+    def as_dict(self) -> dict:
+        """Returns the change as a JSON-serialisable dictionary."""
+
+        def describe(shift):
+            if shift is None:
+                return None
+            return {'start': shift.start.isoformat(), 'end': shift.end.isoformat(), 'code': shift.code,
+                    'detail': shift.detail}
+
+        return {'kind': self.kind, 'account': self.account, 'date': self.date.isoformat(),
+                'shift': describe(self.shift), 'previous': describe(self.previous)}
+
+    def __str__(self):
+        def times(shift):
+            return f"{shift.start:%H:%M}-{shift.end:%H:%M} {shift.code}"
+
+        prefix = f"{self.account + ' ' if self.account else ''}{self.date:%a %d %b}"
+        if self.kind == ADDED:
+            return f"{prefix}: added {times(self.shift)}"
+        if self.kind == REMOVED:
+            return f"{prefix}: removed {times(self.previous)}"
+        return f"{prefix}: {times(self.previous)} -> {times(self.shift)}"
+
+
+def _pair(previous: list, current: list, same) -> tuple:
+    """Pairs off shifts for which `same(old, new)` holds, returning the pairs and the unpaired leftovers."""
+    pairs, left = [], list(current)
+    unpaired = []
+    for old in previous:
+        match = next((new for new in left if same(old, new)), None)
+        if match is None:
+            unpaired.append(old)
+        else:
+            left.remove(match)
+            pairs.append((old, match))
+    return pairs, unpaired, left
+
+
+def diff_shifts(previous: Iterable, current: Iterable, account: str = '') -> list:
+    """
+    Compares the stored shifts of a window with a new scrape of the same window.
+
+    Shifts are compared day by day. A shift with the same start, end and code is unchanged. Of the rest, a shift
+    with the same code on the same day is reported as `time_changed`, then one with the same start and end as
+    `code_changed`; whatever is left over was `removed` or `added`.
+
+    Parameters:
+    - previous (Iterable[mic_roster_parser.Shift]): The shifts stored for the window.
+    - current (Iterable[mic_roster_parser.Shift]): The shifts scraped for the same window.
+    - account (str): The account the shifts belong to, copied into every change.
+
+    Returns:
+    - A list of `Change`, ordered by date.
+    """
+    by_date = defaultdict(lambda: ([], []))
+    for shift in previous:
+        by_date[shift.start.date()][0].append(shift)
+    for shift in current:
+        by_date[shift.start.date()][1].append(shift)
+
+    changes = []
+    for date in sorted(by_date):
+        old, new = by_date[date]
+        _, old, new = _pair(old, new, lambda a, b: (a.start, a.end, a.code) == (b.start, b.end, b.code))
+        moved, old, new = _pair(old, new, lambda a, b: a.code == b.code)
+        recoded, old, new = _pair(old, new, lambda a, b: (a.start, a.end) == (b.start, b.end))
+        changes.extend(Change(TIME_CHANGED, date, shift, was, account) for was, shift in moved)
+        changes.extend(Change(CODE_CHANGED, date, shift, was, account) for was, shift in recoded)
+        changes.extend(Change(REMOVED, date, None, was, account) for was in old)
+        changes.extend(Change(ADDED, date, shift, None, account) for shift in new)
+    return changes
+
+
+class StdoutSink:
+    """Prints one line per change."""
+
+    def __init__(self, stream=None):
+        """
+        Parameters:
+        - stream: The text stream to write to. Default is `sys.stdout` at the time of writing.
+        """
+        self.stream = stream
+
+    def emit(self, changes: list):
+        stream = self.stream or sys.stdout
+        for change in changes:
+            print(f"Roster change: {change}", file=stream)
+
+
+class JsonLinesSink:
+    """Appends each change as one JSON object per line, safe to share between threads."""
+
+    def __init__(self, path: str):
+        """
+        Parameters:
+        - path (str): The file to append to, created with its directory if missing.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, changes: list):
+        detected_at = datetime.datetime.now().isoformat(timespec='seconds')
+        lines = ''.join(json.dumps(dict(change.as_dict(), detected_at=detected_at)) + '\n' for change in changes)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock, open(self.path, 'a') as f:
+            f.write(lines)
+
+
+class WebhookSink:
+    """POSTs the changes of one month as a JSON object `{"changes": [...]}` to a URL."""
+
+    def __init__(self, url: str, timeout: float = 10, session: requests.Session = None):
+        """
+        Parameters:
+        - url (str): The webhook URL, e.g. a local service at `http://localhost:8080/roster`.
+        - timeout (float): Timeout in seconds for each request.
+        - session (requests.Session): An optional pre-configured session. A new one is created when omitted.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+
+    def emit(self, changes: list):
+        response = self.session.post(self.url, json={'changes': [change.as_dict() for change in changes]},
+                                     timeout=self.timeout)
+        response.raise_for_status()
+
+
+class ChangeStream:
+    """
+    Detects roster changes against the stored snapshot and hands them to every sink.
+
+    A sink is any object with an `emit(changes)` method. A sink that raises is reported and counted, and does not
+    keep the other sinks or the sync from running.
+    """
+
+    def __init__(self, sinks: Iterable = ()):
+        """
+        Parameters:
+        - sinks (Iterable): The sinks to send changes to.
+        """
+        self.sinks = list(sinks)
+
+    def __bool__(self):
+        return bool(self.sinks)
+
+    def emit(self, changes: list):
+        """Sends changes to every sink. Nothing is sent when there are none."""
+        if not changes:
+            return
+        for change in changes:
+            count('roster_changes', kind=change.kind)
+        for sink in self.sinks:
+            try:
+                sink.emit(changes)
+            except Exception as e:
+                count('change_sink_failures', sink=type(sink).__name__)
+                print(f"Could not send {len(changes)} roster changes to {type(sink).__name__}: {e}")
+
+    def detect(self, store, shifts: Iterable, time_min: datetime.datetime, time_max: datetime.datetime,
+               account: str = '') -> list:
+        """
+        Compares a fresh scrape of a window with the shifts stored for it. Nothing is sent yet; pass the result to
+        `flush()` once the store has been updated.
+
+        Call this before the store is updated with the new scrape.
+
+        Parameters:
+        - store (mic_roster_store.ShiftStore): The store holding the last snapshot.
+        - shifts (Iterable[mic_roster_parser.Shift]): The shifts scraped for the window.
+        - time_min (datetime.datetime), time_max (datetime.datetime): The window, as returned by `month_window()`.
+        - account (str): The account the shifts belong to.
+
+        Returns:
+        - The list of `Change` found.
+        """
+        with span('detect_changes'):
+            previous = store.shifts_between(time_min.date(), time_max.date(), account)
+            return diff_shifts(previous, shifts, account)
+
+    def flush(self, changes: list, store, shifts: Iterable, time_min: datetime.datetime,
+              time_max: datetime.datetime, account: str = '') -> int:
+        """
+        Sends changes found by `detect()`, but only if the store now holds the scrape they were found in.
+
+        A sync that failed before saving the scrape leaves the old snapshot in place, so the next run detects the
+        same changes again; sending them now as well would deliver them twice.
+
+        Returns:
+        - The number of changes sent.
+        """
+        if not changes:
+            return 0
+        if diff_shifts(store.shifts_between(time_min.date(), time_max.date(), account), shifts, account):
+            count('roster_changes_deferred', len(changes))
+            return 0
+        self.emit(changes)
+        return len(changes)
+
+
+def build_change_stream(path: str = None, webhook: str = None, stdout: bool = False) -> ChangeStream:
+    """
+    Builds a change stream from command-line style options.
+
+    Parameters:
+    - path (str): Append changes to this JSON lines file.
+    - webhook (str): POST changes to this URL.
+    - stdout (bool): Print changes.
+
+    Returns:
+    - A `ChangeStream`, which is falsy when no sink was chosen.
+    """
+    sinks = []
+    if stdout:
+        sinks.append(StdoutSink())
+    if path:
+        sinks.append(JsonLinesSink(path))
+    if webhook:
+        sinks.append(WebhookSink(webhook))
+    return ChangeStream(sinks)
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Daemon.
+
+A long-running alternative to starting `mic_roster_selenium.py` from cron. The daemon pays the cold-start costs
+once: the modules are imported, the Google Calendar service is built and the cached token is read when it starts.
+After that it keeps the roster login and the Calendar service warm and polls on a schedule, so each sync only
+costs the page fetches and whatever calendar writes the roster changes need. The roster site is only logged in to
+again when it expires the session.
+
+SIGTERM and SIGINT stop the daemon cleanly: a sync that is already running is allowed to finish first.
+
+Usage:
+    $ python mic_roster_daemon.py --interval 900 --jitter 60
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import datetime
+import random
+import signal
+import threading
+import time
+
+from mic_roster_browser_pool import BrowserPool
+from mic_roster_cache import PageCache
+from mic_roster_changes import ChangeStream, build_change_stream
+from mic_roster_deadletters import DeadLetterQueue
+from mic_roster_http import LOGIN_URL, RosterSession
+from mic_roster_metrics import METRICS, count, profile
+from mic_roster_selenium import PARSE_REPORT, build_calendar_service, load_google_credentials, run_sync
+from mic_roster_store import ShiftStore
+
+SCOPES = ['https://www.googleapis.com/auth/calendar']
+
+
+class RosterDaemon:
+    """
+    Polls the roster on a schedule and syncs changes to Google Calendar, keeping sessions warm between polls.
+
+    Example:
+    ```
+    daemon = RosterDaemon(username, password, interval=900, jitter=60)
+    daemon.install_signal_handlers()
+    daemon.run()
+    ```
+    """
+
+    def __init__(self, username: str, password: str, offsets=range(0, 3), interval: float = 900,
+                 jitter: float = 60, url: str = LOGIN_URL, calendar_id: str = 'primary', service=None,
+                 cache: PageCache = None, metrics_path: str = None, store: ShiftStore = None,
+                 dead_letters: DeadLetterQueue = None, changes: ChangeStream = None):
+        """
+        Parameters:
+        - username (str): The personnel ID used to log in.
+        - password (str): The account password.
+        - offsets (Iterable[int]): Month offsets to sync on every poll. Default is the current month and the two
+          after it.
+        - interval (float): Seconds between the start of one poll and the next.
+        - jitter (float): Up to this many seconds are randomly added to or removed from each interval, so several
+          daemons do not hit the roster site in lockstep.
+        - url (str): The URL of the roster login page.
+        - calendar_id (str): ID of the calendar to sync. Default is 'primary'.
+        - service (googleapiclient.discovery.Resource): An authenticated Calendar service. When omitted, one is
+          built from the cached credentials, and built again whenever a refresh replaces them.
+        - cache (PageCache): The page cache. A `PageCache` in the default location is used when omitted.
+        - metrics_path (str): Where to export stage timings after every poll; see `Metrics.export()`. A `.prom`
+          textfile holds running totals, while a JSON lines file gets one line per poll.
+        - store (ShiftStore): The shift store the syncs are planned from. A `ShiftStore` in the default location is
+          used when omitted.
+        - dead_letters (DeadLetterQueue): Failed Calendar writes, replayed at the start of the next poll. A
+          `DeadLetterQueue` in the default location is used when omitted.
+        - changes (ChangeStream): Optional stream told after every poll which shifts changed since the last one.
+        """
+        self.username = username
+        self.password = password
+        self.offsets = list(offsets)
+        self.interval = interval
+        self.jitter = jitter
+        self.url = url
+        self.calendar_id = calendar_id
+        self.service = service
+        self._credentials = None
+        self._own_service = service is None
+        self.cache = cache or PageCache()
+        self.metrics_path = metrics_path
+        self.store = store or ShiftStore()
+        self.dead_letters = dead_letters or DeadLetterQueue()
+        self.changes = changes
+        # One session walks forward from the current month and one walks back; see fetch_months().
+        self.sessions = [RosterSession(url), RosterSession(url)]
+        # Chrome is only started if the HTTP engine fails, and then stays warm for later polls.
+        self.browser_pool = BrowserPool(size=1)
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        """Asks the daemon to stop after the current sync. Usable directly as a signal handler."""
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        """Stops the daemon cleanly on SIGTERM and SIGINT."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def next_delay(self, elapsed: float = 0.0) -> float:
+        """
+        Returns the seconds to wait before the next poll: the interval plus or minus random jitter, less the
+        `elapsed` seconds the last poll took, so polls start on schedule rather than drifting by each sync's length.
+        A poll that overran its interval is followed by the next one straight away.
+        """
+        return max(0.0, self.interval + random.uniform(-self.jitter, self.jitter) - elapsed)
+
+    def sync_once(self) -> dict:
+        """
+        Runs a single sync with the warm sessions and Calendar service.
+
+        Returns:
+        - The totals returned by `run_sync()`, plus the sync's duration in `seconds` and the number of roster cells
+          that could not be parsed in `parse_failures`.
+        """
+        if self._own_service:
+            # Refresh the token before it can expire mid-sync; a refresh hands out new credentials to build on.
+            credentials = load_google_credentials(SCOPES)
+            if credentials is not self._credentials:
+                self.service, self._credentials = build_calendar_service(credentials), credentials
+        started = time.perf_counter()
+        PARSE_REPORT.clear()
+        totals = run_sync(self.service, self.username, self.password, self.offsets, self.cache, self.url,
+                          self.calendar_id, self.sessions, self.store, dead_letters=self.dead_letters,
+                          browser_pool=self.browser_pool, changes=self.changes)
+        totals['seconds'] = round(time.perf_counter() - started, 3)
+        totals['parse_failures'] = PARSE_REPORT.totals()['failed']
+        print(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} sync finished in {totals['seconds']}s: {totals}")
+        return totals
+
+    def export_metrics(self):
+        """Writes the collected metrics to `metrics_path`, if set."""
+        if not self.metrics_path:
+            return
+        METRICS.export(self.metrics_path)
+        if not self.metrics_path.endswith('.prom'):
+            METRICS.reset()
+
+    def run(self):
+        """Polls until `stop()` is called. A failed sync is reported and retried at the next poll."""
+        try:
+            while not self._stop.is_set():
+                started = time.monotonic()
+                try:
+                    self.sync_once()
+                except Exception as e:
+                    count('sync_failures')
+                    print(f"Sync failed: {e}")
+                self.export_metrics()
+                self._stop.wait(self.next_delay(time.monotonic() - started))
+        finally:
+            for session in self.sessions:
+                session.close()
+            self.browser_pool.close()
+            print("Roster daemon stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keep Google Calendar in sync with the Mic Roster.")
+    parser.add_argument('--interval', type=float, default=900, help="seconds between polls (default 900)")
+    parser.add_argument('--jitter', type=float, default=60, help="random +/- seconds added to each interval")
+    parser.add_argument('--past', type=int, default=0, help="number of past months to sync")
+    parser.add_argument('--future', type=int, default=2, help="number of months after the current one to sync")
+    parser.add_argument('--metrics', help="export stage timings to this file (.prom for Prometheus, else JSON lines)")
+    parser.add_argument('--profile', help="write cProfile stats for the daemon's main thread to this file on exit")
+    parser.add_argument('--changes', help="append roster changes to this JSON lines file")
+    parser.add_argument('--webhook', help="POST roster changes to this URL")
+    parser.add_argument('--print-changes', action='store_true', help="print roster changes")
+    args = parser.parse_args()
+
+    import credentials as cr
+    daemon = RosterDaemon(cr.credentials.username, cr.credentials.password, range(-args.past, args.future + 1),
+                          args.interval, args.jitter, metrics_path=args.metrics,
+                          changes=build_change_stream(args.changes, args.webhook, args.print_changes) or None)
+    daemon.install_signal_handlers()
+    with profile(args.profile):
+        daemon.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Dead Letters.
+
+Keeps the Calendar writes that still failed after every retry, so they are not lost. `apply_sync()` records each
+failed insert, patch or delete in a JSON file, and the next `run_sync()` for the same account replays them before
+it plans new writes. A write that keeps failing is dropped after `max_attempts` runs, with a message, rather than
+being replayed forever; the roster sync itself still corrects the calendar on the next clean run.
+
+Usage:
+    $ python mic_roster_deadletters.py            # list the queued writes
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import json
+import os
+import threading
+from typing import NamedTuple
+
+from mic_roster_batch import CalendarBatcher
+from mic_roster_metrics import count
+
+DEAD_LETTER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'dead_letters.json')
+
+
+class DeadLetter(NamedTuple):
+    """A Calendar write that failed after all retries."""
+    operation: str
+    account: str = ''
+    calendar_id: str = 'primary'
+    event_id: str = None
+    body: dict = None
+    error: str = ''
+    attempts: int = 1
+    failed_at: str = ''
+
+
+class DeadLetterQueue:
+    """
+    A JSON-backed queue of failed Calendar writes, safe to share between threads.
+
+    Example:
+    ```
+    dead_letters = DeadLetterQueue()
+    print(dead_letters.replay(service, account='jsmith'))
+    ```
+    """
+
+    def __init__(self, path: str = DEAD_LETTER_PATH, max_attempts: int = 5):
+        """
+        Parameters:
+        - path (str): The JSON file holding the queue, created on the first failed write.
+        - max_attempts (int): How many times a write may fail before it is dropped.
+        """
+        self.path = path
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._letters = []
+        if os.path.exists(path):
+            with open(path) as f:
+                self._letters = [DeadLetter(**entry) for entry in json.load(f)]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._letters)
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump([letter._asdict() for letter in self._letters], f, indent=2)
+        os.replace(temporary, self.path)
+
+    def add(self, letter: DeadLetter):
+        """Queues a failed write, or drops it with a message once it has failed `max_attempts` times."""
+        if letter.attempts > self.max_attempts:
+            count('dead_letters_dropped', operation=letter.operation)
+            print(f"Dropping {letter.operation} for {letter.account or 'default account'} after {self.max_attempts} "
+                  f"failed attempts: {letter.error}")
+            return
+        if not letter.failed_at:
+            letter = letter._replace(failed_at=datetime.datetime.now().isoformat(timespec='seconds'))
+        count('dead_letters', operation=letter.operation)
+        with self._lock:
+            self._letters.append(letter)
+            self._save()
+
+    def record(self, operation: str, error: Exception, body: dict = None, event_id: str = None, account: str = '',
+               calendar_id: str = 'primary'):
+        """Queues a write that failed for the first time."""
+        self.add(DeadLetter(operation, account, calendar_id, event_id, body, f"{type(error).__name__}: {error}"))
+
+    def pending(self, account: str = None, calendar_id: str = None) -> list:
+        """Returns the queued writes, optionally only those of one account and calendar."""
+        with self._lock:
+            return [letter for letter in self._letters
+                    if (account is None or letter.account == account)
+                    and (calendar_id is None or letter.calendar_id == calendar_id)]
+
+    def take(self, account: str = '', calendar_id: str = 'primary') -> list:
+        """Removes and returns the queued writes of one account and calendar, for replaying."""
+        with self._lock:
+            taken = [letter for letter in self._letters
+                     if letter.account == account and letter.calendar_id == calendar_id]
+            if taken:
+                self._letters = [letter for letter in self._letters if letter not in taken]
+                self._save()
+        return taken
+
+    def retry_later(self, letter: DeadLetter, error: Exception):
+        """Puts back a replayed write that failed again."""
+        self.add(letter._replace(attempts=letter.attempts + 1, error=f"{type(error).__name__}: {error}",
+                                 failed_at=''))
+
+    def replay(self, service, account: str = '', calendar_id: str = 'primary') -> dict:
+        """
+        Sends the queued writes of one account and calendar again, as batch requests.
+
+        Parameters:
+        - service (googleapiclient.discovery.Resource): The authenticated Google Calendar service object.
+        - account (str): The account whose writes to replay.
+        - calendar_id (str): The calendar the writes were meant for.
+
+        Returns:
+        - A dictionary with the number of writes `replayed` successfully and those that `failed` again.
+        """
+        letters = self.take(account, calendar_id)
+        counts = {'replayed': 0, 'failed': 0}
+        if not letters:
+            return counts
+        batcher = CalendarBatcher(service, calendar_id)
+        for letter in letters:
+            if letter.operation == 'insert':
+                batcher.insert(letter.body)
+            elif letter.operation == 'patch':
+                batcher.patch(letter.event_id, letter.body)
+            else:
+                batcher.delete(letter.event_id)
+        for letter, result in zip(letters, batcher.execute()):
+            if result.ok:
+                counts['replayed'] += 1
+            else:
+                counts['failed'] += 1
+                self.retry_later(letter, result.error)
+        print(f"Replayed {counts['replayed']} of {len(letters)} failed calendar writes")
+        return counts
+
+
+def main():
+    dead_letters = DeadLetterQueue()
+    for letter in dead_letters.pending():
+        target = letter.event_id or (letter.body or {}).get('summary', '')
+        print(f"{letter.failed_at}  {letter.account or '-':<12} {letter.operation:<6} {target}  "
+              f"attempt {letter.attempts}: {letter.error}")
+    print(f"{len(dead_letters)} queued writes in {dead_letters.path}")
+
+
+if __name__ == '__main__':
+    main()
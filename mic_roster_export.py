@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Bulk Export.
+
+Writes parsed shifts to local files instead of Google Calendar, with no network calls. Every export is a directory
+with one partition per account and month, `account=jsmith/year=2024/month=05` (see `partition_dir()`), holding:
+
+- iCalendar (`.ics`): `shifts.ics`, a calendar with one VEVENT per shift.
+- CSV (`.csv`): `shifts.csv`, one row per shift under a header row.
+- Parquet (`.parquet`): part files with typed columns. The directory is a Hive-partitioned Parquet dataset that
+  `pyarrow.dataset` or `pandas.read_parquet(directory)` read back with `account`, `year` and `month` columns.
+  Requires the optional `pyarrow` package.
+
+Exports are incremental by month: every month in the exported shifts replaces that account's partition for the
+month, and no other partition is read or written. Exporting the same pages again therefore leaves the export as it
+was, and a month whose roster changed is brought up to date, including shifts whose times changed. Writers consume
+the shifts as an iterable and hold one month in memory at a time, so years of history for hundreds of users cost
+no more memory than a single month. Pages are parsed leniently; a malformed cell is skipped and reported instead of
+aborting the export.
+
+Usage:
+    $ python mic_roster_export.py roster.ics roster.csv roster.parquet --account jsmith --pages .cache/pages/jsmith
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import csv
+import datetime
+import glob
+import io
+import os
+import re
+from typing import Iterable
+from urllib.parse import quote
+
+import pytz
+
+from mic_roster_parser import LENIENT, ParseReport, parse_calendar
+from mic_roster_sync import ROSTER_LOCATION, TIMEZONE
+
+CSV_COLUMNS = ('account', 'date', 'start', 'end', 'code', 'detail', 'hours')
+ICS_HEADER = ('BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//mic_roster_scraper//Roster Export//EN', 'CALSCALE:GREGORIAN',
+              f'X-WR-TIMEZONE:{TIMEZONE}')
+ICS_FOOTER = b'END:VCALENDAR\r\n'
+_UID_UNSAFE_RE = re.compile(r'[^A-Za-z0-9._-]+')
+
+
+def _hours(shift) -> float:
+    return round((shift.end - shift.start).total_seconds() / 3600, 2)
+
+
+def _ics_text(value: str) -> str:
+    return value.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def _ics_fold(line: str) -> str:
+    # RFC 5545 limits content lines to 75 octets; longer lines continue on lines starting with a space.
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, start = [], 0
+    while start < len(encoded):
+        end = min(start + (75 if not parts else 74), len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode())
+        start = end
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def _uid(account: str, start: datetime.datetime, code: str) -> str:
+    key = f"{account}-{start:%Y%m%dT%H%M%S}-{code}".strip('-')
+    return f"{_UID_UNSAFE_RE.sub('_', key)}@mic-roster"
+
+
+def shift_uid(shift, account: str = '') -> str:
+    """
+    Builds the iCalendar UID of a shift. It is stable across exports, so calendar apps importing a later export
+    update the shift instead of duplicating it. It is also the key that keeps a shift from being written twice.
+    """
+    return _uid(account, shift.start, shift.code)
+
+
+def partition_dir(directory: str, account: str, year: int, month: int) -> str:
+    """
+    Returns the directory holding one account's shifts for one month in an export, e.g.
+    `roster.parquet/account=jsmith/year=2024/month=05`. The `key=value` names are the Hive partitioning that
+    `pyarrow.dataset` and `pandas.read_parquet()` read back as `account`, `year` and `month` columns.
+    """
+    return os.path.join(directory, f"account={quote(account, safe='')}", f'year={year}', f'month={month:02d}')
+
+
+def _export_months(months: Iterable, directory: str, write) -> int:
+    written, seen = 0, set()
+    for month in months:
+        key = (month.year, month.month)
+        unique = {}
+        for shift in month.shifts:
+            unique.setdefault((shift.start, shift.code), shift)
+        # A month met again in the same export, e.g. on a second page, is added to instead of replaced.
+        written += write(month.year, month.month, list(unique.values()), key in seen)
+        seen.add(key)
+    return written
+
+
+def _replace(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+def ics_uids(path: str) -> set:
+    """Returns the UIDs of the events in an iCalendar file, or an empty set if it does not exist."""
+    uids = set()
+    if not os.path.exists(path):
+        return uids
+    with open(path, encoding='utf-8', newline='') as f:
+        line = ''
+        for raw in f:
+            raw = raw.rstrip('\r\n')
+            if raw.startswith(' '):
+                # A folded continuation of the previous content line.
+                line += raw[1:]
+                continue
+            if line.startswith('UID:'):
+                uids.add(line[4:])
+            line = raw
+        if line.startswith('UID:'):
+            uids.add(line[4:])
+    return uids
+
+
+def csv_uids(path: str) -> set:
+    """Returns the keys of the shifts in a CSV file, or an empty set if it does not exist."""
+    if not os.path.exists(path):
+        return set()
+    with open(path, newline='', encoding='utf-8') as f:
+        return {_uid(row['account'], datetime.datetime.fromisoformat(row['start']), row['code'])
+                for row in csv.DictReader(f)}
+
+
+def parquet_uids(directory: str, account: str = '') -> set:
+    """Returns the keys of the shifts in the part files of one Parquet partition directory."""
+    paths = sorted(glob.glob(os.path.join(directory, '*.parquet')))
+    if not paths:
+        return set()
+    _, pq = _import_pyarrow()
+    uids = set()
+    for path in paths:
+        table = pq.read_table(path, columns=['start', 'code'])
+        uids.update(_uid(account, start, code) for start, code in
+                    zip(table.column('start').to_pylist(), table.column('code').to_pylist()))
+    return uids
+
+
+def ics_event(shift, account: str = '', timezone: str = TIMEZONE, stamp: datetime.datetime = None) -> str:
+    """
+    Renders one shift as a VEVENT block with CRLF line endings. Times are written in UTC.
+
+    Parameters:
+    - shift (mic_roster_parser.Shift): The shift to render.
+    - account (str): The account the shift belongs to, used in the UID.
+    - timezone (str): The time zone the roster's local times are in.
+    - stamp (datetime.datetime): The DTSTAMP, in UTC. Defaults to now.
+    """
+    tz = pytz.timezone(timezone)
+    stamp = stamp or datetime.datetime.utcnow()
+
+    def utc(value):
+        return tz.localize(value).astimezone(pytz.UTC).strftime('%Y%m%dT%H%M%SZ')
+
+    lines = ['BEGIN:VEVENT', f'UID:{shift_uid(shift, account)}', f'DTSTAMP:{stamp:%Y%m%dT%H%M%SZ}',
+             f'DTSTART:{utc(shift.start)}', f'DTEND:{utc(shift.end)}', f'SUMMARY:{_ics_text(shift.code)}',
+             f'LOCATION:{_ics_text(ROSTER_LOCATION)}']
+    if shift.detail:
+        lines.append(f'DESCRIPTION:{_ics_text(shift.detail)}')
+    lines.append('END:VEVENT')
+    return ''.join(_ics_fold(line) for line in lines)
+
+
+def export_ics(months: Iterable, directory: str, account: str = '', timezone: str = TIMEZONE) -> int:
+    """
+    Writes shifts to an iCalendar export: one `shifts.ics` calendar per account and month under `directory`, see
+    `partition_dir()`. Every month in `months` replaces that month's calendar; other months are not touched.
+
+    Parameters:
+    - months (Iterable[RosterMonth]): The parsed months to write, consumed one at a time.
+    - directory (str): The export directory, created if needed.
+    - account (str): The account the shifts belong to.
+    - timezone (str): The time zone of the shifts' local times.
+
+    Returns:
+    - The number of events written.
+
+    Raises:
+    - ValueError: If a calendar being added to does not end with `END:VCALENDAR`.
+    """
+    stamp = datetime.datetime.utcnow()
+
+    def write(year, month, group, add):
+        path = os.path.join(partition_dir(directory, account, year, month), 'shifts.ics')
+        if not add:
+            events = ''.join(ics_event(shift, account, timezone, stamp) for shift in group)
+            _replace(path, ''.join(_ics_fold(line) for line in ICS_HEADER).encode() + events.encode() + ICS_FOOTER)
+            return len(group)
+        exported = ics_uids(path)
+        group = [shift for shift in group if shift_uid(shift, account) not in exported]
+        with open(path, 'r+b') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - 64))
+            tail = f.read()
+            end = tail.rfind(b'END:VCALENDAR')
+            if end < 0:
+                raise ValueError(f"{path} is not a complete iCalendar file")
+            f.truncate(size - len(tail) + end)
+            f.seek(0, os.SEEK_END)
+            for shift in group:
+                f.write(ics_event(shift, account, timezone, stamp).encode())
+            f.write(ICS_FOOTER)
+        return len(group)
+
+    return _export_months(months, directory, write)
+
+
+def export_csv(months: Iterable, directory: str, account: str = '') -> int:
+    """
+    Writes shifts to a CSV export: one `shifts.csv` file with the columns in `CSV_COLUMNS` per account and month
+    under `directory`, see `partition_dir()`. Every month in `months` replaces that month's file; other months are
+    not touched.
+
+    Parameters:
+    - months (Iterable[RosterMonth]): The parsed months to write, consumed one at a time.
+    - directory (str): The export directory, created if needed.
+    - account (str): The account the shifts belong to.
+
+    Returns:
+    - The number of rows written.
+    """
+    def write(year, month, group, add):
+        path = os.path.join(partition_dir(directory, account, year, month), 'shifts.csv')
+        if add:
+            exported = csv_uids(path)
+            group = [shift for shift in group if shift_uid(shift, account) not in exported]
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        if not add:
+            writer.writerow(CSV_COLUMNS)
+        for shift in group:
+            writer.writerow((account, shift.start.date().isoformat(), shift.start.isoformat(timespec='minutes'),
+                             shift.end.isoformat(timespec='minutes'), shift.code, shift.detail, _hours(shift)))
+        if add:
+            with open(path, 'a', newline='', encoding='utf-8') as f:
+                f.write(rows.getvalue())
+        else:
+            _replace(path, rows.getvalue().encode())
+        return len(group)
+
+    return _export_months(months, directory, write)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet export needs the optional pyarrow package: pip install pyarrow") from e
+    return pyarrow, pyarrow.parquet
+
+
+def parquet_schema():
+    """
+    Returns the Arrow schema of the Parquet part files. Times are local roster times, stored without a zone. The
+    account, year and month are not stored in the files; they are read back from the partition directories.
+    """
+    pa, _ = _import_pyarrow()
+    return pa.schema([
+        ('start', pa.timestamp('s')),
+        ('end', pa.timestamp('s')),
+        ('code', pa.dictionary(pa.int32(), pa.string())),
+        ('detail', pa.string()),
+        ('hours', pa.float32()),
+    ])
+
+
+def export_parquet(months: Iterable, directory: str, account: str = '') -> int:
+    """
+    Writes shifts to a Parquet dataset partitioned by account, year and month, see `partition_dir()`. Every month
+    in `months` replaces that month's part files; other months are not touched.
+
+    Parameters:
+    - months (Iterable[RosterMonth]): The parsed months to write, consumed one at a time.
+    - directory (str): The dataset directory, created if needed.
+    - account (str): The account the shifts belong to.
+
+    Returns:
+    - The number of rows written.
+
+    Raises:
+    - ImportError: If pyarrow is not installed.
+    """
+    pa, pq = _import_pyarrow()
+    schema = parquet_schema()
+
+    def write(year, month, group, add):
+        partition = partition_dir(directory, account, year, month)
+        parts = sorted(glob.glob(os.path.join(partition, 'part-*.parquet')))
+        if add:
+            exported = parquet_uids(partition, account)
+            group = [shift for shift in group if shift_uid(shift, account) not in exported]
+            if not group:
+                return 0
+        table = pa.Table.from_pydict({
+            'start': [shift.start for shift in group],
+            'end': [shift.end for shift in group],
+            'code': [shift.code for shift in group],
+            'detail': [shift.detail for shift in group],
+            'hours': [_hours(shift) for shift in group],
+        }, schema=schema)
+        os.makedirs(partition, exist_ok=True)
+        path = os.path.join(partition, f'part-{len(parts) if add else 0}.parquet')
+        # Readers skip files starting with a dot, so the new part is invisible until it replaces the old one.
+        temporary = os.path.join(partition, f'.{os.path.basename(path)}.tmp')
+        pq.write_table(table, temporary)
+        os.replace(temporary, path)
+        if not add:
+            for stale in parts:
+                if stale != path:
+                    os.remove(stale)
+        return len(group)
+
+    return _export_months(months, directory, write)
+
+
+EXPORTERS = {'.ics': export_ics, '.csv': export_csv, '.parquet': export_parquet}
+
+
+def export(months: Iterable, path: str, account: str = '') -> int:
+    """
+    Exports parsed months to the export directory `path`, in the format given by its extension: `.ics`, `.csv` or
+    `.parquet`.
+
+    Returns:
+    - The number of shifts written.
+
+    Raises:
+    - ValueError: If the extension is not one of `EXPORTERS`.
+    """
+    exporter = EXPORTERS.get(os.path.splitext(path)[1].lower())
+    if exporter is None:
+        raise ValueError(f"Unsupported export format for {path}; use one of {', '.join(EXPORTERS)}")
+    return exporter(months, path, account)
+
+
+def months_from_pages(paths: Iterable[str], report: ParseReport = None):
+    """
+    Parses saved month pages one at a time and yields them as `RosterMonth`s, so only one page is in memory at once.
+
+    Malformed cells are skipped and, with a `report`, recorded in it; a page without a month heading is skipped with
+    a message.
+    """
+    for path in paths:
+        with open(path, encoding='utf-8') as f:
+            html = f.read()
+        try:
+            month = parse_calendar(html, mode=LENIENT, report=report)
+        except ValueError as e:
+            print(f"Skipping {path}: {e}")
+            continue
+        yield month
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export saved roster pages to iCalendar, CSV or Parquet.")
+    parser.add_argument('outputs', nargs='+', help="export directories to update: .ics, .csv or .parquet")
+    parser.add_argument('--pages', required=True, help="directory of saved month pages, e.g. a page cache")
+    parser.add_argument('--account', default='', help="account name recorded with every shift")
+    parser.add_argument('--parse-report', help="write parse stats and malformed cells to this JSON file")
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.pages, '*.html')))
+    report = ParseReport()
+    for index, output in enumerate(args.outputs):
+        # Every output reads the pages again; their parse failures are only counted once.
+        written = export(months_from_pages(paths, report if index == 0 else None), output, args.account)
+        print(f"Wrote {written} shifts from {len(paths)} pages to {output}")
+    totals = report.totals()
+    print(f"Parsed {totals['pages']} pages: {totals['cells']} cells, {totals['parsed']} shifts, "
+          f"{totals['skipped']} skipped, {totals['failed']} failed")
+    for error in report.errors:
+        print(f"  {error}")
+    if args.parse_report:
+        report.write(args.parse_report)
+
+
+if __name__ == '__main__':
+    main()
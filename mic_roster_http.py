@@ -0,0 +1,417 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster HTTP Engine.
+
+A browserless alternative to the Selenium flow in `mic_roster_selenium`. The Mic Roster self-service site is a
+classic ASP.NET WebForms application: logging in and moving between calendar months are plain form postbacks that
+carry the page's hidden state fields (`__VIEWSTATE`, `__EVENTVALIDATION`, ...) back to the server. This module
+replays those postbacks with a `requests.Session`, so no Chrome process is needed for a normal run.
+
+The engine only talks to the URL it is given, which means it can be pointed at a local stand-in server serving
+recorded Default.aspx pages.
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import re
+from typing import NamedTuple
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+
+from mic_roster_metrics import count, span
+from mic_roster_parser import MONTH_LABEL_ID
+
+LOGIN_URL = 'https://ess.tmc.tambla.net/Microster.SelfService/Default.aspx'
+NEXT_MONTH = 'ctl00_ContentPlaceHolder1_calendar_lnkNextMonth'
+PREVIOUS_MONTH = 'ctl00_ContentPlaceHolder1_calendar_lnkPreviousMonth'
+
+USERNAME_FIELD = 'ctl00$ContentPlaceHolder1$txtPersonnelId'
+PASSWORD_FIELD = 'ctl00$ContentPlaceHolder1$txtPassword'
+LOGIN_BUTTON = 'ctl00$ContentPlaceHolder1$btnLogin'
+
+# Sent with an UpdatePanel partial postback, as by the browser's MicrosoftAjax PageRequestManager.
+PARTIAL_HEADERS = {'X-MicrosoftAjax': 'Delta=true', 'X-Requested-With': 'XMLHttpRequest', 'Cache-Control': 'no-cache'}
+
+_POSTBACK_RE = re.compile(r"__doPostBack\(\s*['\"]([^'\"]+)['\"]")
+_PAGE_REQUEST_MANAGER_RE = re.compile(
+    r"PageRequestManager\._initialize\(\s*'([^']+)'\s*,\s*'[^']*'\s*,\s*\[([^\]]*)\]")
+_QUOTED_RE = re.compile(r"'([^']*)'")
+
+
+class LoginError(Exception):
+    """Raised when the roster site does not show the calendar after a login postback."""
+
+
+class SessionExpired(LoginError):
+    """Raised when a logged-in session is sent back to the login page."""
+
+
+class PartialPostbackError(Exception):
+    """Raised when a partial postback response cannot be used; the session falls back to full postbacks."""
+
+
+class PartialPostback(NamedTuple):
+    """How to refresh the calendar with an UpdatePanel partial postback instead of a full page."""
+    script_manager: str
+    panel: str
+    panel_id: str
+
+
+def get_form_fields(soup: BeautifulSoup) -> dict:
+    """
+    Collects the hidden input fields of an ASP.NET page.
+
+    This is the general form of `get_view_event()`: besides `__VIEWSTATE` and `__EVENTVALIDATION` it keeps every
+    other hidden field (`__VIEWSTATEGENERATOR`, `__EVENTTARGET`, ...) so a postback can be replayed exactly as the
+    browser would send it.
+
+    Parameters:
+    - soup (BeautifulSoup): A BeautifulSoup object containing the parsed HTML of an ASP.NET page.
+
+    Returns:
+    - A dictionary mapping each hidden field name to its value.
+    """
+    fields = {}
+    for field in soup.find_all('input', {'type': 'hidden'}):
+        name = field.get('name')
+        if name:
+            fields[name] = field.get('value', '')
+    return fields
+
+
+def postback_target(soup: BeautifulSoup, control_id: str) -> str:
+    """
+    Resolves the `__EVENTTARGET` value for a LinkButton from its client-side ID.
+
+    LinkButtons render as `<a href="javascript:__doPostBack('ctl00$...','')">`, so the target is read from the
+    link when it is present. Otherwise the unique ID is derived from the client ID, which ASP.NET builds by
+    replacing `$` separators with `_`.
+
+    Parameters:
+    - soup (BeautifulSoup): The parsed page containing the control.
+    - control_id (str): The client-side ID of the control, e.g. `ctl00_ContentPlaceHolder1_calendar_lnkNextMonth`.
+
+    Returns:
+    - The control's unique ID to post as `__EVENTTARGET`.
+    """
+    control = soup.find(id=control_id)
+    if control is not None:
+        match = _POSTBACK_RE.search(control.get('href', '') or '')
+        if match:
+            return match.group(1)
+    return control_id.replace('_', '$')
+
+
+def login_fields(soup: BeautifulSoup, username: str, password: str) -> dict:
+    """
+    Builds the form fields of a login postback from the login page.
+
+    Parameters:
+    - soup (BeautifulSoup): The parsed login page.
+    - username (str): The personnel ID used to log in.
+    - password (str): The account password.
+
+    Returns:
+    - The fields to post, as the browser would send them when the Login button is clicked.
+    """
+    fields = get_form_fields(soup)
+    button = soup.find('input', {'name': LOGIN_BUTTON})
+    fields[USERNAME_FIELD] = username
+    fields[PASSWORD_FIELD] = password
+    fields[LOGIN_BUTTON] = button.get('value', 'Login') if button is not None else 'Login'
+    return fields
+
+
+def navigation_fields(soup: BeautifulSoup, button_name: str) -> dict:
+    """
+    Builds the form fields of a LinkButton postback, such as a calendar month navigation.
+
+    Parameters:
+    - soup (BeautifulSoup): The parsed page holding the button.
+    - button_name (str): The client-side ID of the LinkButton, e.g. `NEXT_MONTH`.
+
+    Returns:
+    - The fields to post.
+    """
+    fields = get_form_fields(soup)
+    fields['__EVENTTARGET'] = postback_target(soup, button_name)
+    fields['__EVENTARGUMENT'] = ''
+    return fields
+
+
+def form_action(soup: BeautifulSoup, page_url: str) -> str:
+    """Returns the URL a page's form posts to, resolved against the page's own URL."""
+    form = soup.find('form')
+    action = form.get('action') if form is not None else None
+    return urljoin(page_url, action) if action else page_url
+
+
+def shows_calendar(soup: BeautifulSoup) -> bool:
+    """Reports whether a page is the logged-in roster calendar rather than the login form."""
+    return soup.find(id=NEXT_MONTH) is not None
+
+
+def find_partial_postback(html: str, soup: BeautifulSoup):
+    """
+    Finds out whether a page can refresh its calendar with an ASP.NET AJAX partial postback.
+
+    That is the case when the page registers a ScriptManager with `Sys.WebForms.PageRequestManager._initialize()`
+    and one of the UpdatePanels it lists holds both the month heading and the navigation links.
+
+    Parameters:
+    - html (str): The page HTML, searched for the PageRequestManager script.
+    - soup (BeautifulSoup): The parsed page.
+
+    Returns:
+    - A `PartialPostback`, or None if the site does not offer one for the calendar.
+    """
+    match = _PAGE_REQUEST_MANAGER_RE.search(html)
+    if match is None:
+        return None
+    for entry in _QUOTED_RE.findall(match.group(2)):
+        # Panel unique IDs are prefixed with 't' or 'f' (whether child controls trigger it); ASP.NET 4 also lists
+        # the client IDs, which carry no prefix and no '$'.
+        if len(entry) < 2 or entry[0] not in 'tf' or '$' not in entry:
+            continue
+        panel = entry[1:]
+        element = soup.find(id=panel.replace('$', '_'))
+        if element is not None and element.find(id=NEXT_MONTH) is not None and \
+                element.find(id=MONTH_LABEL_ID) is not None:
+            return PartialPostback(match.group(1), panel, element['id'])
+    return None
+
+
+def parse_delta(text: str) -> list:
+    """
+    Splits an UpdatePanel delta response into its updates.
+
+    The response is a sequence of `length|type|id|content|` records, where `length` counts the characters of
+    `content`, which may itself contain `|`.
+
+    Parameters:
+    - text (str): The response body.
+
+    Returns:
+    - A list of `(type, id, content)` tuples, e.g. `('updatePanel', 'ctl00_..._upCalendar', '<table ...')` or
+      `('hiddenField', '__VIEWSTATE', '...')`.
+
+    Raises:
+    - PartialPostbackError: If the body is not in the delta format.
+    """
+    updates, position = [], 0
+    try:
+        while position < len(text):
+            length_end = text.index('|', position)
+            length = int(text[position:length_end])
+            type_end = text.index('|', length_end + 1)
+            id_end = text.index('|', type_end + 1)
+            content_end = id_end + 1 + length
+            if text[content_end:content_end + 1] != '|':
+                raise ValueError(f"record at {position} overruns its length")
+            updates.append((text[length_end + 1:type_end], text[type_end + 1:id_end], text[id_end + 1:content_end]))
+            position = content_end + 1
+    except ValueError as e:
+        raise PartialPostbackError(f"Malformed delta response: {e}") from e
+    return updates
+
+
+class RosterSession:
+    """
+    A logged-in roster session that navigates the calendar by replaying ASP.NET postbacks.
+
+    The session keeps the hidden fields of the last page it received; every postback is built from them, exactly
+    as a browser would submit the form. The public methods mirror `login()` and `fetch_next_page_html()` in
+    `mic_roster_selenium`, so the rest of the pipeline does not care which engine produced a page.
+
+    When the calendar sits in an UpdatePanel, month navigation uses the partial postback the browser itself would
+    send: the response carries only the calendar panel and the updated hidden fields, and
+    `fetch_next_page_html()` returns just that calendar fragment, which the parser and page cache read like a
+    full page. If the site answers a partial postback with anything else, the session switches to full page
+    postbacks. The `requests` session reuses its connection between postbacks and accepts gzip-compressed
+    responses.
+
+    Example:
+    ```
+    roster = RosterSession()
+    html = roster.login(username, password)
+    next_month = roster.fetch_next_page_html(NEXT_MONTH)
+    ```
+    """
+
+    def __init__(self, url: str = LOGIN_URL, timeout: float = 30, session: requests.Session = None,
+                 partial: bool = True):
+        """
+        Parameters:
+        - url (str): The Default.aspx URL of the roster site. Point this at a local server to replay recorded pages.
+        - timeout (float): Timeout in seconds for each HTTP request.
+        - session (requests.Session): An optional pre-configured session. A new one is created when omitted.
+        - partial (bool): Navigate with UpdatePanel partial postbacks when the site offers them. Turned off for the
+          rest of the session after the first partial postback that fails.
+        """
+        self.url = url
+        self.timeout = timeout
+        self.session = session or requests.Session()
+        self.partial = partial
+        self.page_url = url
+        self.page_html = None
+        self.logged_in = False
+        self._soup = None
+        self._fields = {}
+        self._action = url
+        self._partial = None
+
+    def _keep(self, response: requests.Response) -> str:
+        count('roster_requests', engine='http')
+        count('roster_bytes', len(response.content), engine='http')
+        response.raise_for_status()
+        self.page_url = response.url or self.page_url
+        self.page_html = response.text
+        self._soup = BeautifulSoup(self.page_html, 'html.parser')
+        self._fields = get_form_fields(self._soup)
+        self._action = form_action(self._soup, self.page_url)
+        self._partial = find_partial_postback(self.page_html, self._soup) if self.partial else None
+        return self.page_html
+
+    def _post(self, fields: dict) -> str:
+        return self._keep(self.session.post(self._action, data=fields, timeout=self.timeout))
+
+    def _fall_back(self):
+        # Full pages still carry the UpdatePanel, so remember the failure instead of trying again on every month.
+        count('partial_fallbacks')
+        self.partial = False
+        self._partial = None
+
+    def _post_partial(self, fields: dict) -> str:
+        partial = self._partial
+        fields = dict(fields, __ASYNCPOST='true')
+        fields[partial.script_manager] = f"{partial.panel}|{fields['__EVENTTARGET']}"
+        response = self.session.post(self._action, data=fields, headers=PARTIAL_HEADERS, timeout=self.timeout)
+        if not response.text[:1].isdigit():
+            # The site answered with a whole page after all; use it and stop asking for deltas.
+            self._fall_back()
+            return self._keep(response)
+        count('roster_requests', engine='http')
+        count('roster_bytes', len(response.content), engine='http')
+        response.raise_for_status()
+        hidden, action, fragment = dict(self._fields), self._action, None
+        for kind, key, content in parse_delta(response.text):
+            if kind == 'updatePanel' and key == partial.panel_id:
+                fragment = content
+            elif kind == 'hiddenField':
+                hidden[key] = content
+            elif kind == 'formAction':
+                action = urljoin(self.page_url, content)
+            elif kind == 'pageRedirect':
+                self.logged_in = False
+                raise SessionExpired(f"Roster session for {self.url} has expired")
+            elif kind == 'error':
+                raise PartialPostbackError(f"Partial postback failed: {content}")
+        if fragment is None:
+            raise PartialPostbackError(f"Partial postback did not update {partial.panel_id}")
+        count('partial_postbacks')
+        self._fields, self._action, self.page_html = hidden, action, fragment
+        self._soup = BeautifulSoup(fragment, 'html.parser')
+        return fragment
+
+    def login(self, username: str, password: str) -> str:
+        """
+        Logs in to the roster site and returns the page HTML showing the current month.
+
+        Parameters:
+        - username (str): The personnel ID used to log in.
+        - password (str): The account password.
+
+        Returns:
+        - The page source after the login postback, as a string.
+
+        Raises:
+        - LoginError: If the calendar is not present after the login postback.
+        - requests.RequestException: If the site cannot be reached or returns an error status.
+        """
+        with span('login', engine='http'):
+            return self._login(username, password)
+
+    def _login(self, username: str, password: str) -> str:
+        html = self._keep(self.session.get(self.url, timeout=self.timeout))
+        if shows_calendar(self._soup):
+            # The session cookie is still valid and the site went straight to the calendar.
+            self.logged_in = True
+            return html
+        self.logged_in = False
+        html = self._post(login_fields(self._soup, username, password))
+        if not shows_calendar(self._soup):
+            raise LoginError(f"Login to {self.url} did not reach the roster calendar")
+        self.logged_in = True
+        return html
+
+    def _check_session(self, html: str) -> str:
+        if not shows_calendar(self._soup):
+            self.logged_in = False
+            raise SessionExpired(f"Roster session for {self.url} has expired")
+        return html
+
+    def current_month(self) -> str:
+        """
+        Reloads the calendar at the current month using the existing login.
+
+        Returns:
+        - The page source showing the current month.
+
+        Raises:
+        - SessionExpired: If the site asks to log in again.
+        - requests.RequestException: If the site cannot be reached.
+        """
+        return self._check_session(self._keep(self.session.get(self.url, timeout=self.timeout)))
+
+    def fetch_next_page_html(self, button_name: str) -> str:
+        """
+        Triggers a calendar navigation postback and returns the HTML of the resulting page.
+
+        Parameters:
+        - button_name (str): The client-side ID of the LinkButton to "click", e.g. `NEXT_MONTH` or `PREVIOUS_MONTH`.
+
+        Returns:
+        - A string containing the HTML source of the page after navigation, or only the calendar fragment when the
+          month was fetched with a partial postback.
+
+        Raises:
+        - RuntimeError: If called before `login()`.
+        - SessionExpired: If the postback lands on the login page.
+        - requests.RequestException: If the postback fails.
+        """
+        if self._soup is None:
+            raise RuntimeError("login() must be called before navigating the calendar")
+        fields = dict(self._fields, __EVENTTARGET=postback_target(self._soup, button_name), __EVENTARGUMENT='')
+        with span('navigate', engine='http'):
+            if self._partial is not None:
+                try:
+                    return self._check_session(self._post_partial(fields))
+                except PartialPostbackError as e:
+                    print(f"{e}; using full page postbacks")
+                    self._fall_back()
+            return self._check_session(self._post(fields))
+
+    def close(self):
+        """Closes the underlying HTTP session."""
+        self.session.close()
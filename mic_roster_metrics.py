@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Metrics.
+
+Per-stage timing and counters for the scraper's hot paths. Code wraps a stage in `span()` to record its duration
+(Chrome startup, login, page waits and postbacks, parsing, Calendar batches) and calls `count()` for things worth
+totalling, such as API calls, retries and bytes fetched. Spans are aggregated per stage and label set (count, total
+and maximum seconds), so memory stays flat in a long-running daemon.
+
+A snapshot can be appended to a JSON lines file, one line per run, or written as a Prometheus textfile for the
+node_exporter textfile collector. `profile()` optionally runs a block under cProfile and dumps the stats.
+
+Example:
+```
+with span('login', engine='http'):
+    roster.login(username, password)
+count('roster_bytes', len(html))
+METRICS.export('metrics.prom')
+```
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import contextlib
+import cProfile
+import datetime
+import json
+import os
+import threading
+import time
+
+PROMETHEUS_PREFIX = 'mic_roster'
+
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _prometheus_labels(labels: tuple) -> str:
+    if not labels:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+class Metrics:
+    """
+    A thread-safe collection of stage timings and counters.
+
+    Example:
+    ```
+    metrics = Metrics()
+    with metrics.span('parse'):
+        parse_calendar(html)
+    metrics.count('pages_parsed')
+    print(metrics.snapshot())
+    ```
+    """
+
+    def __init__(self):
+        self._spans = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def span(self, stage: str, **labels):
+        """
+        Times the enclosed block as one occurrence of `stage`.
+
+        Parameters:
+        - stage (str): The stage name, e.g. 'login' or 'calendar_batch'.
+        - labels: Extra dimensions, e.g. `engine='chrome'`. A block that raises is recorded with `ok='false'`.
+        """
+        started = time.perf_counter()
+        ok = True
+        try:
+            yield
+        except BaseException:
+            ok = False
+            raise
+        finally:
+            self.observe(stage, time.perf_counter() - started, **labels, **({} if ok else {'ok': 'false'}))
+
+    def observe(self, stage: str, seconds: float, **labels):
+        """Records one occurrence of `stage` that took `seconds`."""
+        key = (stage, _labels(labels))
+        with self._lock:
+            total = self._spans.get(key)
+            if total is None:
+                self._spans[key] = [1, seconds, seconds]
+            else:
+                total[0] += 1
+                total[1] += seconds
+                total[2] = max(total[2], seconds)
+
+    def count(self, name: str, value: float = 1, **labels):
+        """Adds `value` to the counter `name`."""
+        key = (name, _labels(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def reset(self):
+        """Clears every span and counter, e.g. between daemon polls."""
+        with self._lock:
+            self._spans.clear()
+            self._counters.clear()
+            self.started = time.time()
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current totals.
+
+        Returns:
+        - A dictionary with `spans` (a list of `{stage, labels, count, seconds, max_seconds}`) and `counters` (a list
+          of `{name, labels, value}`), plus the `started` and `timestamp` times of the collection period.
+        """
+        with self._lock:
+            spans = [{'stage': stage, 'labels': dict(labels), 'count': n, 'seconds': round(total, 6),
+                      'max_seconds': round(longest, 6)}
+                     for (stage, labels), (n, total, longest) in sorted(self._spans.items())]
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                'spans': spans, 'counters': counters}
+
+    def write_jsonl(self, path: str, **extra):
+        """Appends the snapshot, with any `extra` fields such as an account name, as one line of `path`."""
+        record = self.snapshot()
+        record.update(extra)
+        with open(path, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def prometheus(self) -> str:
+        """Renders the totals in the Prometheus text exposition format."""
+        with self._lock:
+            spans = sorted(self._spans.items())
+            counters = sorted(self._counters.items())
+        name = f'{PROMETHEUS_PREFIX}_stage_seconds'
+        lines = [f'# HELP {name} Time spent in each scraper stage.', f'# TYPE {name} summary']
+        for (stage, labels), (n, total, _) in spans:
+            rendered = _prometheus_labels((('stage', stage),) + labels)
+            lines.append(f'{name}_sum{rendered} {total:.6f}')
+            lines.append(f'{name}_count{rendered} {n}')
+        lines.append(f'# TYPE {name}_max gauge')
+        for (stage, labels), (_, _, longest) in spans:
+            lines.append(f'{name}_max{_prometheus_labels((("stage", stage),) + labels)} {longest:.6f}')
+        for counter in sorted({counter for (counter, _), _ in counters}):
+            lines.append(f'# TYPE {PROMETHEUS_PREFIX}_{counter}_total counter')
+            lines.extend(f'{PROMETHEUS_PREFIX}_{counter}_total{_prometheus_labels(labels)} {value}'
+                         for (other, labels), value in counters if other == counter)
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path: str):
+        """Writes the Prometheus textfile atomically, so the collector never reads a half-written file."""
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temporary, path)
+
+    def export(self, path: str, **extra):
+        """Writes a Prometheus textfile when `path` ends in `.prom`, and appends a JSON line otherwise."""
+        if path.endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path, **extra)
+
+
+METRICS = Metrics()
+
+
+def span(stage: str, **labels):
+    """Times a block as a stage of the process-wide `METRICS`, see `Metrics.span()`."""
+    return METRICS.span(stage, **labels)
+
+
+def count(name: str, value: float = 1, **labels):
+    """Adds to a counter of the process-wide `METRICS`."""
+    METRICS.count(name, value, **labels)
+
+
+@contextlib.contextmanager
+def profile(path: str = None):
+    """
+    Runs the enclosed block under cProfile and dumps the stats to `path`. Does nothing when `path` is empty.
+
+    The dump can be read with `python -m pstats path` or a viewer such as snakeviz.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path}")
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Calendar Parser.
+
+Turns a roster month page into typed shifts in a single pass. Only the calendar region of the page is parsed: a
+`SoupStrainer` keeps the month heading and the `DateCell` table cells and drops everything else while the page is
+being tokenised, and the lxml backend is used when it is installed. Cell text is matched against precompiled
+regular expressions for the `HHMM-HHMM (hours) CODE` shift grammar instead of being split repeatedly.
+
+A malformed cell either stops the parse (`STRICT`) or is skipped and recorded (`LENIENT`). Either way, every page's
+counts of cells seen, shifts parsed, cells skipped and cells failed are added to the process-wide metrics. Passing a
+`ParseReport` also collects those counts and each failed cell, so they can be reviewed after an unattended run.
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import importlib.util
+import json
+import os
+import re
+import sys
+import threading
+from typing import NamedTuple
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+from mic_roster_metrics import count, span
+
+PARSER = 'lxml' if importlib.util.find_spec('lxml') else 'html.parser'
+
+MONTH_LABEL_ID = 'ctl00_ContentPlaceHolder1_calendar_lblCurrentMonth'
+NON_SHIFT_MARKERS = frozenset(('OFF', 'PH', 'OT', 'NA', 'SICK', 'Not'))
+MONTHS = {name: number for number, name in enumerate(
+    ('january', 'february', 'march', 'april', 'may', 'june', 'july', 'august', 'september', 'october',
+     'november', 'december'), start=1)}
+
+CALENDAR_ID_RE = re.compile(r'^ctl00_ContentPlaceHolder1_calendar_(?:DateCell(\d+)|lblCurrentMonth)$')
+MONTH_RE = re.compile(r'^\s*([A-Za-z]+)\s+(\d{4})\s*$')
+SHIFT_RE = re.compile(r'^(\d{2})(\d{2})-(\d{2})(\d{2})\s*(\([^)]*\))?\s*(\S+)')
+MARKER_RE = re.compile(r'^[A-Za-z]+')
+TIMES_RE = re.compile(r'^\d')
+
+STRICT = 'strict'
+LENIENT = 'lenient'
+
+CALENDAR_STRAINER = SoupStrainer(id=CALENDAR_ID_RE)
+
+
+class ShiftParseError(ValueError):
+    """
+    Raised when a calendar cell is neither a shift nor a known non-working marker.
+
+    `reason` says what was wrong: 'bad times' for a cell that starts like a shift but whose times do not parse,
+    'unknown code' for any other unrecognised text, and 'bad date' for a cell past the end of the month.
+    """
+
+    def __init__(self, cell_text: str, date: datetime.date = None, reason: str = 'unknown code'):
+        super().__init__(f"Unrecognised roster cell {cell_text!r}" + (f" on {date}" if date else "")
+                         + f" ({reason})")
+        self.cell_text = cell_text
+        self.date = date
+        self.reason = reason
+
+    def as_dict(self) -> dict:
+        """Returns the error as a JSON-serialisable dictionary."""
+        return {'date': self.date.isoformat() if self.date else None, 'cell': self.cell_text, 'reason': self.reason}
+
+
+class Shift(NamedTuple):
+    """
+    A rostered shift. `end` is on the following day for shifts that finish after midnight.
+
+    Shifts are immutable tuples without a per-instance `__dict__`, and their `code` and `detail` strings are
+    interned, so a long roster history shares one copy of each distinct code.
+    """
+    start: datetime.datetime
+    end: datetime.datetime
+    code: str
+    detail: str = ''
+
+
+class RosterMonth(NamedTuple):
+    """The shifts parsed from one calendar month page."""
+    year: int
+    month: int
+    shifts: tuple
+
+
+class ParseStats(NamedTuple):
+    """
+    What happened to the cells of one page. `skipped` counts non-working markers such as OFF; empty cells are
+    counted in `cells` only.
+    """
+    year: int
+    month: int
+    cells: int
+    parsed: int
+    skipped: int
+    failed: int
+
+
+class ParseReport:
+    """
+    Collects the per-page stats and the malformed cells of many parses. Safe to share between threads.
+
+    Example:
+    ```
+    report = ParseReport()
+    month = parse_calendar(html, mode=LENIENT, report=report)
+    if report.errors:
+        report.write('parse_errors.json')
+    ```
+    """
+
+    def __init__(self):
+        self.pages = []
+        self.errors = []
+        self._lock = threading.Lock()
+
+    def add(self, stats: ParseStats, errors: list):
+        """Records the stats of one page and its `ShiftParseError`s."""
+        with self._lock:
+            self.pages.append(stats)
+            self.errors.extend(errors)
+
+    def clear(self):
+        """Forgets everything collected so far, e.g. between daemon polls."""
+        with self._lock:
+            self.pages.clear()
+            self.errors.clear()
+
+    def totals(self) -> dict:
+        """Returns the number of `pages` and the summed cell counts over every page."""
+        with self._lock:
+            totals = {'pages': len(self.pages), 'cells': 0, 'parsed': 0, 'skipped': 0, 'failed': 0}
+            for stats in self.pages:
+                for name in ('cells', 'parsed', 'skipped', 'failed'):
+                    totals[name] += getattr(stats, name)
+        return totals
+
+    def write(self, path: str):
+        """Writes the totals, per-page stats and failed cells to a JSON file, atomically."""
+        totals = self.totals()
+        with self._lock:
+            report = {'totals': totals, 'pages': [stats._asdict() for stats in self.pages],
+                      'errors': [error.as_dict() for error in self.errors]}
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(report, f, indent=2)
+        os.replace(temporary, path)
+
+
+def parse_shift(cell_text: str, date: datetime.date):
+    """
+    Parses the text of one calendar cell.
+
+    Parameters:
+    - cell_text (str): The stripped text of the cell's `div`, e.g. `0600-1430 (8:30)SURFACE`.
+    - date (datetime.date): The calendar date of the cell.
+
+    Returns:
+    - A `Shift`, or None when the cell holds a non-working marker such as OFF, PH or SICK.
+
+    Raises:
+    - ShiftParseError: If the cell is neither a shift nor a known marker.
+    """
+    match = SHIFT_RE.match(cell_text)
+    if match is None:
+        marker = MARKER_RE.match(cell_text)
+        if marker and marker.group(0) in NON_SHIFT_MARKERS:
+            return None
+        raise ShiftParseError(cell_text, date, 'bad times' if TIMES_RE.match(cell_text) else 'unknown code')
+    start_h, start_m, end_h, end_m, detail, code = match.groups()
+    day = datetime.datetime(date.year, date.month, date.day)
+    start = day + datetime.timedelta(hours=int(start_h), minutes=int(start_m))
+    end = day + datetime.timedelta(hours=int(end_h), minutes=int(end_m))
+    if end <= start:
+        end += datetime.timedelta(days=1)
+    return Shift(start, end, sys.intern(code), sys.intern(detail or ''))
+
+
+def _day_number(cell, div):
+    # The day number is the cell's own text outside its shift `div`, e.g. `<span class="dayNumber">28</span>`.
+    for child in cell.children:
+        if child is div:
+            continue
+        text = child.get_text(strip=True) if hasattr(child, 'get_text') else str(child).strip()
+        if text.isdigit() and 1 <= int(text) <= 31:
+            return int(text)
+    return None
+
+
+def _record(stats: ParseStats, errors: list, report: ParseReport):
+    count('parse_pages')
+    count('parse_cells', stats.cells)
+    count('parse_shifts', stats.parsed)
+    count('parse_skipped', stats.skipped)
+    count('parse_failures', stats.failed)
+    if report is not None:
+        report.add(stats, errors)
+
+
+def parse_calendar(response, on_error=None, mode: str = STRICT, report: ParseReport = None) -> RosterMonth:
+    """
+    Parses a roster month page in a single pass over its calendar region.
+
+    Cells are dated by the day number they show. A page whose cells carry no day number is dated as the original
+    scraper did: the first cell with text is the 1st, and the date advances on each further cell with text, not on
+    empty ones.
+
+    Parameters:
+    - response (requests.Response or str): The page, as a response object or as HTML text.
+    - on_error (callable): Called with the `ShiftParseError` of a malformed cell, after which parsing continues
+      whatever the `mode`.
+    - mode (str): `STRICT` raises on the first malformed cell; `LENIENT` skips it and carries on.
+    - report (ParseReport): Optional report that receives the page's `ParseStats` and malformed cells.
+
+    Returns:
+    - A `RosterMonth` with the page's shifts in date order.
+
+    Raises:
+    - ValueError: If the page has no recognisable month heading.
+    - ShiftParseError: If a cell cannot be parsed in `STRICT` mode and no `on_error` callback is given.
+    """
+    html = getattr(response, 'text', response)
+    with span('parse'):
+        soup = BeautifulSoup(html, PARSER, parse_only=CALENDAR_STRAINER)
+
+        heading = None
+        cells = []
+        for tag in soup.find_all(id=CALENDAR_ID_RE):
+            number = CALENDAR_ID_RE.match(tag['id']).group(1)
+            if number is None:
+                heading = tag.get_text(strip=True)
+            elif tag.name == 'td' and int(number) < 40:
+                cells.append((int(number), tag))
+
+        match = MONTH_RE.match(heading or '')
+        if match is None or match.group(1).lower() not in MONTHS:
+            raise ValueError(f"Calendar month heading not found (got {heading!r})")
+        year, month = int(match.group(2)), MONTHS[match.group(1).lower()]
+
+        shifts, errors = [], []
+        seen = skipped = day = 0
+        cells.sort(key=lambda cell: cell[0])
+        for _, cell in cells:
+            div = cell.find('div')
+            cell_text = div.get_text(strip=True) if div else ''
+            seen += 1
+            # A cell that shows its day number is dated by it. Otherwise the original rule applies: the date
+            # advances on every cell with text and not on empty ones.
+            number = _day_number(cell, div)
+            if number is not None:
+                day = number
+            elif cell_text:
+                day += 1
+            if not cell_text:
+                continue
+            try:
+                shift = parse_shift(cell_text, datetime.date(year, month, day))
+            except (ShiftParseError, ValueError) as e:
+                if not isinstance(e, ShiftParseError):
+                    e = ShiftParseError(cell_text, reason='bad date')
+                errors.append(e)
+                if on_error is not None:
+                    on_error(e)
+                elif mode == STRICT:
+                    _record(ParseStats(year, month, seen, len(shifts), skipped, len(errors)), errors, report)
+                    raise e
+                continue
+            if shift is None:
+                skipped += 1
+            else:
+                shifts.append(shift)
+        _record(ParseStats(year, month, seen, len(shifts), skipped, len(errors)), errors, report)
+        return RosterMonth(year, month, tuple(shifts))
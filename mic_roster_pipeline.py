@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Fetch Pipeline.
+
+Fetches a range of roster months relative to the current one (e.g. -24..+3) and parses them while the fetch is
+still running. The roster calendar only moves one month per postback, so months are reached by walking from the
+current month: future months are walked by one `RosterSession` and past months by a second one, in parallel. Each
+page is handed to a parser pool as soon as it arrives, and the parsed months are merged back in calendar order.
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable
+
+from mic_roster_http import LOGIN_URL, NEXT_MONTH, PREVIOUS_MONTH, RosterSession, SessionExpired
+from mic_roster_parser import parse_calendar
+
+
+def walk_steps(offsets: Iterable[int]):
+    """
+    Plans a walk of the calendar from the current month that visits the requested offsets.
+
+    Future months are visited first, then the walk turns around and continues into the past, so a single
+    navigator can cover offsets on both sides of the current month.
+
+    Parameters:
+    - offsets (Iterable[int]): Month offsets relative to the current month.
+
+    Yields:
+    - `(button, position, wanted)` for every navigation: the button to click, the offset it lands on, and whether
+      that page is one of the requested offsets (each is reported wanted exactly once).
+    """
+    wanted = set(offsets)
+    position, seen = 0, {0}
+    for target, button in ((max(wanted | {0}), NEXT_MONTH), (min(wanted | {0}), PREVIOUS_MONTH)):
+        while position != target:
+            position += 1 if button == NEXT_MONTH else -1
+            keep = position in wanted and position not in seen
+            seen.add(position)
+            yield button, position, keep
+
+
+def walk_months(navigate, first_page: str, offsets: Iterable[int]):
+    """
+    Walks the calendar from the current month and yields the pages for the requested offsets.
+
+    The route is planned by `walk_steps()`: future months first, then back into the past.
+
+    Parameters:
+    - navigate (callable): Called with `NEXT_MONTH` or `PREVIOUS_MONTH`; returns the HTML of the page it lands on,
+      e.g. `RosterSession.fetch_next_page_html`.
+    - first_page (str): The HTML of the current month, as returned by the login.
+    - offsets (Iterable[int]): Month offsets relative to the current month to yield.
+
+    Yields:
+    - `(offset, html)` pairs, each requested offset exactly once.
+    """
+    offsets = set(offsets)
+    if 0 in offsets:
+        yield 0, first_page
+    for button, position, wanted in walk_steps(offsets):
+        html = navigate(button)
+        if wanted:
+            yield position, html
+
+
+def open_calendar(roster: RosterSession, username: str, password: str) -> str:
+    """
+    Returns the current month page, reusing the session's login when it is still valid.
+
+    Parameters:
+    - roster (RosterSession): The session to use.
+    - username (str): The personnel ID, used if the session has to log in.
+    - password (str): The account password.
+
+    Returns:
+    - The page source showing the current month.
+    """
+    if roster.logged_in:
+        try:
+            return roster.current_month()
+        except SessionExpired:
+            print("Roster session expired, logging in again")
+    return roster.login(username, password)
+
+
+def merge_shifts(months: Iterable) -> tuple:
+    """
+    Merges the shifts of several parsed months into one roster.
+
+    Parameters:
+    - months (Iterable[RosterMonth]): Parsed months, in any order.
+
+    Returns:
+    - A tuple of shifts ordered by start time, with duplicates removed.
+    """
+    return tuple(sorted({(shift.start, shift.code): shift for month in months for shift in month.shifts}.values()))
+
+
+def fetch_months(username: str, password: str, offsets: Iterable[int] = range(0, 3), url: str = LOGIN_URL,
+                 parse_workers: int = 2, parse=parse_calendar, session_factory=RosterSession,
+                 sessions: list = None) -> list:
+    """
+    Fetches and parses a range of roster months concurrently.
+
+    Offsets at or after the current month are walked by one session and offsets before it by another, each in
+    its own thread; every page is parsed in a separate pool while the walks continue.
+
+    Only these two walks run at once. The site can only move one month at a time from the current month, so a walk
+    to offset -24 makes 24 postbacks in a row whichever session makes them; more sessions would not shorten it.
+    The time of a long history fetch therefore grows with the furthest offset.
+
+    Parameters:
+    - username (str): The personnel ID used to log in.
+    - password (str): The account password.
+    - offsets (Iterable[int]): Month offsets relative to the current month, e.g. `range(-24, 4)`. Default is the
+      current month and the two after it.
+    - url (str): The URL of the roster login page.
+    - parse_workers (int): The number of threads parsing pages.
+    - parse (callable): The page parser. Default is `parse_calendar()`.
+    - session_factory (callable): Builds a session from `url`. Default is `RosterSession`.
+    - sessions (list): Long-lived sessions to walk with instead of fresh ones. They keep their login between calls
+      and are not closed, so a long-running caller only logs in again when the site expires them. If the list
+      holds fewer sessions than there are walks, the missing ones are created and added to it.
+
+    Returns:
+    - A list of the parse results, ordered by offset.
+
+    Raises:
+    - LoginError, requests.RequestException: If a session cannot log in or a postback fails. `SessionExpired` is
+      raised when a session is logged out mid-walk; calling again logs it back in.
+    """
+    offsets = sorted(set(offsets))
+    chains = [chain for chain in ([o for o in offsets if o >= 0], [o for o in offsets if o < 0]) if chain]
+    if sessions is not None:
+        sessions.extend(session_factory(url) for _ in range(len(chains) - len(sessions)))
+
+    with ThreadPoolExecutor(max_workers=max(1, parse_workers)) as parsers:
+        def run_chain(chain, roster):
+            owned = roster is None
+            roster = roster or session_factory(url)
+            try:
+                first_page = open_calendar(roster, username, password)
+                return [(offset, parsers.submit(parse, html))
+                        for offset, html in walk_months(roster.fetch_next_page_html, first_page, chain)]
+            finally:
+                if owned:
+                    roster.close()
+
+        with ThreadPoolExecutor(max_workers=max(1, len(chains))) as walkers:
+            walks = [walkers.submit(run_chain, chain, sessions[i] if sessions is not None else None)
+                     for i, chain in enumerate(chains)]
+            parsed = sorted(item for walk in walks for item in walk.result())
+        return [future.result() for _, future in parsed]
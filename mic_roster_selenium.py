@@ -12,7 +12,8 @@ from the user's calendar. Additionally, it demonstrates integration with Google
 Author: matthewpicone
 Date: 1/12/2023
 """
-import sys
+from __future__ import annotations
+
 # MIT License
 #
 # Copyright (c) 2024 Matthew Picone
@@ -35,29 +36,77 @@ import sys
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import argparse
+import functools
+import json
 import time
 
-import googleapiclient
 import requests
 from bs4 import BeautifulSoup
 import datetime
 import pytz
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-import pickle
 import os.path
-from selenium import webdriver
-from selenium.common.exceptions import WebDriverException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as ec
-from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
+from typing import TYPE_CHECKING
+# Selenium, webdriver_manager and the Google client libraries are slow to import, so they are imported inside the
+# functions that use them. A dry run or a sync that never needs the browser does not load the Selenium stack.
+
+from mic_roster_auth import CREDENTIAL_CACHE, DEFAULT_ACCOUNT
+from mic_roster_batch import error_status, execute_with_retry
+from mic_roster_cache import PageCache
+from mic_roster_deadletters import DeadLetterQueue
+from mic_roster_http import LOGIN_URL, LoginError, NEXT_MONTH, PREVIOUS_MONTH, SessionExpired
+from mic_roster_metrics import METRICS, count, span
+from mic_roster_parser import LENIENT, MONTH_LABEL_ID, MONTH_RE, MONTHS, STRICT, ParseReport, parse_calendar
+from mic_roster_pipeline import fetch_months, walk_months
+from mic_roster_sync import month_window, sync_calendar
+
+if TYPE_CHECKING:
+    import googleapiclient.discovery
+
+TOKEN_PATH = '/Users/matthewpicone/Developer/mic_roster_scraper/token.pickle'
+CREDENTIALS_PATH = '/Users/matthewpicone/Developer/mic_roster_scraper/credentials.json'
+# Stats and malformed cells of every page parsed by `parse_page()` in this process.
+PARSE_REPORT = ParseReport()
+DRIVER_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'chromedriver.json')
+# Resources the scraper never needs; only the page HTML and the ASP.NET scripts (.axd) are read.
+BLOCKED_RESOURCES = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.svg', '*.ico', '*.css', '*.woff', '*.woff2', '*.ttf',
+                     '*.otf', '*.eot']
+
+
+def chromedriver_path(refresh: bool = False, cache_path: str = DRIVER_CACHE_PATH) -> str:
+    """
+    Returns the path of a chromedriver binary, resolving it with webdriver_manager only when needed.
+
+    `ChromeDriverManager().install()` checks the installed Chrome version and the driver release feed on every call.
+    The path it returns is remembered in `cache_path` and reused for as long as the binary exists.
 
-event_dict = {}
+    Parameters:
+    - refresh (bool): Resolve the driver again even if a cached path exists, e.g. after Chrome has updated.
+    - cache_path (str): The JSON file remembering the resolved path.
 
-def setup_chrome_driver():
+    Returns:
+    - The chromedriver path.
+    """
+    if not refresh:
+        try:
+            with open(cache_path) as f:
+                path = json.load(f)['path']
+            if os.path.exists(path):
+                return path
+        except (OSError, ValueError, KeyError):
+            pass
+    from webdriver_manager.chrome import ChromeDriverManager
+
+    path = ChromeDriverManager().install()
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    temporary = f'{cache_path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'path': path, 'resolved': time.time()}, f)
+    os.replace(temporary, cache_path)
+    return path
+
+
+def setup_chrome_driver(block_resources: bool = False):
     """
     Initializes and returns a headless Chrome WebDriver with optimized settings.
 
@@ -78,12 +127,22 @@ def setup_chrome_driver():
     - `disable-infobars`: Prevents Chrome from displaying information bars at the top of the window.
     - `--disable-extensions`: Disables all Chrome extensions to prevent them from affecting automated tests.
 
+    Parameters:
+    - block_resources (bool): Turn off images and block the URLs in `BLOCKED_RESOURCES` (style sheets and fonts),
+      so page loads only download what the scraper reads.
+
     Returns:
         WebDriver: An instance of Chrome WebDriver configured with the specified options.
 
     Note:
         This function requires the `selenium` package and `webdriver_manager` to be installed in the Python environment.
+        The chromedriver path is cached by `chromedriver_path()` and resolved again only if the cached driver fails to
+        start.
     """
+    from selenium import webdriver
+    from selenium.common.exceptions import WebDriverException
+    from selenium.webdriver.chrome.options import Options
+
     chrome_options = Options()
     chrome_options.add_argument("--headless")
     chrome_options.add_argument("--no-sandbox")
@@ -92,10 +151,22 @@ def setup_chrome_driver():
     chrome_options.add_argument('start-maximized')
     chrome_options.add_argument('disable-infobars')
     chrome_options.add_argument('--disable-extensions')
-    try:
-        driver = webdriver.Chrome(ChromeDriverManager().install(), options=chrome_options)
-    except WebDriverException as e:
-        driver  = webdriver.Chrome("/Users/matthewpicone/Developer/mic_roster_scraper/chromedriver", options=chrome_options)
+    if block_resources:
+        chrome_options.add_argument('--blink-settings=imagesEnabled=false')
+        chrome_options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    with span('chrome_start'):
+        try:
+            driver = webdriver.Chrome(chromedriver_path(), options=chrome_options)
+        except WebDriverException:
+            # A cached driver stops working when Chrome updates; resolve it again before the local fallback.
+            try:
+                driver = webdriver.Chrome(chromedriver_path(refresh=True), options=chrome_options)
+            except WebDriverException as e:
+                print(f"Could not start Chrome with the downloaded chromedriver ({e.msg}); using the local one")
+                driver  = webdriver.Chrome("/Users/matthewpicone/Developer/mic_roster_scraper/chromedriver", options=chrome_options)
+    if block_resources:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_RESOURCES})
     return driver
 
 
@@ -164,33 +235,76 @@ def login(driver, url: str, username: str, password: str) -> str:
     Returns:
     - The page source of the webpage after the login attempt, as a string.
     """
-    driver.get(url)
-    # Wait for the login elements to load
-    WebDriverWait(driver, 10).until(
-        ec.presence_of_element_located((By.NAME, 'ctl00$ContentPlaceHolder1$txtPersonnelId'))
-    )
-    # Fill in login form and submit
-    driver.find_element_by_name('ctl00$ContentPlaceHolder1$txtPersonnelId').send_keys(username)
-    driver.find_element_by_name('ctl00$ContentPlaceHolder1$txtPassword').send_keys(password)
-    driver.find_element_by_name('ctl00$ContentPlaceHolder1$btnLogin').click()
-    WebDriverWait(driver, 10).until(
-        ec.presence_of_element_located((By.ID, "ctl00_ContentPlaceHolder1_calendar_lnkNextMonth"))
-    )
-    return driver.page_source
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as ec
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    with span('login', engine='chrome'):
+        driver.get(url)
+        # Wait for the login elements to load
+        WebDriverWait(driver, 10).until(
+            ec.presence_of_element_located((By.NAME, 'ctl00$ContentPlaceHolder1$txtPersonnelId'))
+        )
+        # Fill in login form and submit
+        driver.find_element_by_name('ctl00$ContentPlaceHolder1$txtPersonnelId').send_keys(username)
+        driver.find_element_by_name('ctl00$ContentPlaceHolder1$txtPassword').send_keys(password)
+        driver.find_element_by_name('ctl00$ContentPlaceHolder1$btnLogin').click()
+        WebDriverWait(driver, 10).until(
+            ec.presence_of_element_located((By.ID, "ctl00_ContentPlaceHolder1_calendar_lnkNextMonth"))
+        )
+        html = driver.page_source
+    count('roster_bytes', len(html), engine='chrome')
+    return html
+
+
+def month_label_after(label: str, step: int):
+    """
+    Returns the calendar heading expected after moving `step` months from `label`.
+
+    Parameters:
+    - label (str): A calendar heading such as `May 2024`.
+    - step (int): The number of months to move; negative values move back.
+
+    Returns:
+    - The expected heading, e.g. `June 2024` for `month_label_after('May 2024', 1)`, or None if `label` is not a
+      recognisable month heading.
+    """
+    match = MONTH_RE.match(label or '')
+    if match is None or match.group(1).lower() not in MONTHS:
+        return None
+    index = int(match.group(2)) * 12 + MONTHS[match.group(1).lower()] - 1 + step
+    return datetime.date(index // 12, index % 12 + 1, 1).strftime('%B %Y')
+
+
+def _calendar_ready(old_label, expected: str):
+    """Wait condition: the month heading shows `expected`, or, if unknown, the old heading has been replaced."""
+    from selenium.common.exceptions import NoSuchElementException, StaleElementReferenceException
+    from selenium.webdriver.support import expected_conditions as ec
+
+    def condition(driver):
+        try:
+            if expected is None:
+                return ec.staleness_of(old_label)(driver) and driver.find_element_by_id(MONTH_LABEL_ID)
+            return driver.find_element_by_id(MONTH_LABEL_ID).text.strip() == expected
+        except (NoSuchElementException, StaleElementReferenceException):
+            return False
+    return condition
 
 
-def fetch_next_page_html(driver, button_name: str):
+def fetch_next_page_html(driver, button_name: str, timeout: float = 10):
     """
     Navigates to the next page in a web application and returns the HTML content of the page.
 
-    This function locates a button by its ID, simulates a click to navigate to the next page, waits
-    briefly for the page to load, and then returns the HTML source of the resulting page. It is designed
-    to work within a Selenium WebDriver context, assuming that a `driver` instance is available in the
-    scope from which this function is called.
+    This function locates a button by its ID, simulates a click to navigate to the next page, and waits until the
+    postback has finished before returning the HTML source of the resulting page. For the calendar month buttons
+    the page counts as ready once the month heading (`ctl00_ContentPlaceHolder1_calendar_lblCurrentMonth`) shows
+    the month the button leads to; for any other button, once the old heading has gone stale and a new one is
+    present. The time spent waiting is printed for every navigation.
 
     Parameters:
     - driver: Selenium. An instance of selenium.webdriver
     - button_name (str): The ID of the button that triggers navigation to the next page.
+    - timeout (float): Maximum number of seconds to wait for the new page. Default is 10.
 
     Returns:
     - A string containing the HTML source of the page after navigation.
@@ -198,13 +312,22 @@ def fetch_next_page_html(driver, button_name: str):
     Raises:
     - selenium.common.exceptions.NoSuchElementException: If the button with the specified ID is not found
       on the current page.
+    - selenium.common.exceptions.TimeoutException: If the new page is not ready within `timeout` seconds.
     """
-    # Navigate to the next page
-    next_page_button = driver.find_element_by_id(button_name)
-    next_page_button.click()
-    time.sleep(1)  # Wait briefly for the page to load
-    # Return the HTML of the page
-    return driver.page_source
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    old_label = driver.find_element_by_id(MONTH_LABEL_ID)
+    steps = {NEXT_MONTH: 1, PREVIOUS_MONTH: -1}
+    expected = month_label_after(old_label.text.strip(), steps[button_name]) if button_name in steps else None
+    started = time.perf_counter()
+    driver.find_element_by_id(button_name).click()
+    WebDriverWait(driver, timeout, poll_frequency=0.1).until(_calendar_ready(old_label, expected))
+    waited = time.perf_counter() - started
+    METRICS.observe('navigate', waited, engine='chrome')
+    print(f"Page ready after {button_name} in {waited:.2f}s")
+    html = driver.page_source
+    count('roster_bytes', len(html), engine='chrome')
+    return html
 
 
 def convert_month_to_num(month_string: str):
@@ -228,83 +351,40 @@ def convert_month_to_num(month_string: str):
     return month.get(month_string.lower(), 'Invalid')
 
 
-def process_response_cal(response):
-    global event_dict
-    soup = make_soup(response)
-    month_heading = soup.find('span', id='ctl00_ContentPlaceHolder1_calendar_lblCurrentMonth')
-    if month_heading:
-        month = month_heading.get_text(strip=True)
-    else:
-        month = None
-
-    cell_data = {}
-    date = 1
-    for cell in range(1, 40):
-        cell_id = f"ctl00_ContentPlaceHolder1_calendar_DateCell{cell}"
-        cell_content = soup.find('td', id=cell_id)
-        if cell_content:
-            div_content = cell_content.find('div')
-            cell_text = div_content.get_text(strip=True) if div_content else ""
-            cell_text = cell_text.replace(")", ") ") if ")" in cell_text else cell_text
-            cell_data[date] = cell_text
-            if cell_text:
-                if date < 10:
-                    d = f"0{date}"
-                else:
-                    d = date
-                if cell_text.split(" ")[0] != "OFF" and cell_text.split(" ")[0] != "PH" and cell_text.split(" ")[
-                    0] != "OT" and cell_text.split(" ")[0] != "NA" and cell_text.split(" ")[0] != "SICK" and \
-                        cell_text.split(" ")[0] != "Not":
-                    date_text = month.split(" ")
-                    shift_text = cell_text.split(" ")
-                    time_text = cell_text.split(" ")[0].split("-")
-                    try:
-                        event = {
-                            'summary': f'{shift_text[2]}',
-                            'location': '25 Garden Street Eveleigh NSW 2015',
-                            'description': f'Date shift last updated: {datetime.datetime.now().strftime("%d/%m/%Y %H:%M")}',
-                            'start': {
-                                'dateTime': f'{date_text[1]}-{convert_month_to_num(date_text[0])}-{d}T'
-                                            f'{time_text[0][:2]}:{time_text[0][2:]}:00',
-                                'timeZone': 'Australia/Sydney',
-                            },
-                            'end': {
-                                'dateTime': f'{date_text[1]}-{convert_month_to_num(date_text[0])}-{d}T'
-                                            f'{time_text[1][:2]}:{time_text[1][2:]}:00',
-                                'timeZone': 'Australia/Sydney',
-                            },
-                            'reminders': {
-                                'useDefault': False,
-                                'overrides': [
-                                    {'method': 'email', 'minutes': 24 * 60},
-                                    {'method': 'email', 'minutes': 12 * 60},
-                                    {'method': 'popup', 'minutes': 12 * 60},
-                                    {'method': 'popup', 'minutes': 60},
-                                    {'method': 'popup', 'minutes': 10},
-                                ]
-                            }
-                        }
-                        event_dict[
-                            (f'{date_text[1]}-{convert_month_to_num(date_text[0])}-{d}T'
-                             f'{time_text[0][:2]}:{time_text[0][2:]}:00')] = event
-                    except:
-                        input(f"Error with {shift_text}, press enter to continue")
-                date += 1
-    return event_dict
-
-
-def authenticate_google_calendar(scopes: list) -> dict:
+def process_response_cal(response) -> tuple:
+    """
+    Parses a roster month page into its shifts.
+
+    Parsing is done by `mic_roster_parser.parse_calendar()`, which reads the calendar region of the page in a single
+    pass. Nothing is kept in module state, so pages can be parsed concurrently and for several users in the same
+    process; Calendar event bodies are built from the shifts only when they are written.
+
+    Parameters:
+    - response (requests.Response or str): The roster page, as a response object or as HTML text.
+
+    Returns:
+    - A tuple of `mic_roster_parser.Shift`, in date order.
+    """
+    return parse_page(response).shifts
+
+
+def authenticate_google_calendar(scopes: list, token_path: str = None,
+                                 credentials_path: str = CREDENTIALS_PATH, account: str = DEFAULT_ACCOUNT) -> dict:
     """
     Authenticates the user with the Google Calendar API and returns a service object.
 
-    This function attempts to load previously saved credentials from a 'token.pickle' file. If the file
-    does not exist, the credentials are invalid, or the credentials have expired, the function initiates
-    a new authentication flow. Once the user successfully authenticates, the credentials are saved for
-    future use in the 'token.pickle' file.
+    Credentials come from the shared credential cache (`mic_roster_auth.CREDENTIAL_CACHE`), which keeps one JSON
+    token file per account and refreshes the token before it expires. If there is no usable token, the function
+    initiates a new authentication flow. Once the user successfully authenticates, the credentials are saved for
+    future use.
 
     Parameters:
     - scopes (list): A list of strings representing the OAuth scopes for which permission is being requested.
                      These scopes define the level of access the application needs.
+    - token_path (str): A legacy 'token.pickle' file, migrated to the credential cache on first use. Default is
+                        `TOKEN_PATH` for the default account and no migration for any other account.
+    - credentials_path (str): The OAuth client secrets file used to start a new authentication flow.
+    - account (str): The account whose credentials to use. Give each account its own name when syncing several.
 
     Returns:
     - A Google Calendar service object that can be used to make API calls. This object provides a
@@ -325,25 +405,38 @@ def authenticate_google_calendar(scopes: list) -> dict:
 
     Note:
     The 'credentials.json' file must be obtained from the Google Developer Console by creating
-    OAuth 2.0 credentials for your application. The 'token.pickle' file is automatically created
-    and updated by this function; it should not be modified manually.
-    """
-    creds = None
-    if os.path.exists('/Users/matthewpicone/Developer/mic_roster_scraper/token.pickle'):
-        with open('/Users/matthewpicone/Developer/mic_roster_scraper/token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                '/Users/matthewpicone/Developer/mic_roster_scraper/credentials.json', scopes)
-            creds = flow.run_local_server(port=0)
-        with open('/Users/matthewpicone/Developer/mic_roster_scraper/token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+    OAuth 2.0 credentials for your application. The token files in '.cache/tokens' are automatically
+    created and updated; they should not be modified manually.
+    """
+    return build_calendar_service(load_google_credentials(scopes, token_path, credentials_path, account))
+
+
+def build_calendar_service(creds) -> googleapiclient.discovery.Resource:
+    """Builds a Google Calendar service object on OAuth credentials, e.g. from `load_google_credentials()`."""
+    from googleapiclient.discovery import build
+
+    return build('calendar', 'v3', credentials=creds)
+
+
+def load_google_credentials(scopes: list, token_path: str = None, credentials_path: str = CREDENTIALS_PATH,
+                            account: str = DEFAULT_ACCOUNT):
+    """
+    Returns valid OAuth credentials for an account from the shared `mic_roster_auth.CREDENTIAL_CACHE`.
+
+    Parameters:
+    - scopes (list): The OAuth scopes to request.
+    - token_path (str): A legacy `token.pickle`, migrated to the cache's JSON token file on first use. Only the
+      default account falls back to `TOKEN_PATH`; any other account migrates only a token it was given explicitly,
+      so it never takes over the owner's Google account.
+    - credentials_path (str): The OAuth client secrets file used to start a new authentication flow.
+    - account (str): The account the credentials belong to.
 
-    service = build('calendar', 'v3', credentials=creds)
-    return service
+    Returns:
+    - A valid `google.oauth2.credentials.Credentials` object.
+    """
+    if token_path is None and account == DEFAULT_ACCOUNT:
+        token_path = TOKEN_PATH
+    return CREDENTIAL_CACHE.get(account, scopes, credentials_path, legacy_path=token_path)
 
 
 def create_calendar_event(service: googleapiclient.discovery.Resource, event: dict):
@@ -385,8 +478,8 @@ def create_calendar_event(service: googleapiclient.discovery.Resource, event: di
     create_calendar_event(service, event)
     ```
     """
-    # Call the Calendar API to create an event
-    service.events().insert(calendarId='primary', body=event).execute()
+    # Call the Calendar API to create an event, waiting out rate limits instead of dropping the shift
+    execute_with_retry(service.events().insert(calendarId='primary', body=event))
     print(f"Event created: {event.get('summary')}")
 
 def list_calendar_events(service: googleapiclient.discovery.Resource, calendar_id='primary', max_results=10,
@@ -428,14 +521,19 @@ def delete_calendar_event(service: googleapiclient.discovery.Resource, calendar_
     - event_id (str): The ID of the event to delete.
 
     Note:
-    - Prints a success message upon deletion or an error message if the operation fails.
+    - Prints a success message upon deletion. An event that is already gone counts as deleted.
+
+    Raises:
+    - googleapiclient.errors.HttpError: If the delete fails with any other error, or is still rate limited after
+      every retry.
     """
 
     try:
-        service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
-        print(f"Event with ID {event_id} deleted successfully.")
+        execute_with_retry(service.events().delete(calendarId=calendar_id, eventId=event_id))
     except Exception as e:
-        print(f"An error occurred: {e}")
+        if error_status(e) not in (404, 410):
+            raise
+    print(f"Event with ID {event_id} deleted successfully.")
 
 
 def search_events_on_specific_day(service: googleapiclient.discovery.Resource, date: str, calendar_id: str = 'primary',
@@ -460,6 +558,7 @@ def search_events_on_specific_day(service: googleapiclient.discovery.Resource, d
     Note:
     - This function uses the specified timezone to accurately determine the beginning and end of the specified day.
       Events are then searched within this time frame.
+    - To look up scraped shifts without an API call, use `mic_roster_store.ShiftStore.shifts_on()` instead.
     """
     date_obj = datetime.datetime.strptime(date, '%Y-%m-%d')
 
@@ -482,40 +581,199 @@ def search_events_on_specific_day(service: googleapiclient.discovery.Resource, d
     return events
 
 
+def parse_page(html, mode: str = LENIENT, report: ParseReport = None):
+    """
+    Parses a roster month page. In the default `LENIENT` mode a cell that cannot be parsed is reported and skipped,
+    so an unattended run never waits on the console.
+
+    Parameters:
+    - html (requests.Response or str): The page, as a response object or as HTML text.
+    - mode (str): `LENIENT` or `STRICT`; see `mic_roster_parser.parse_calendar()`.
+    - report (ParseReport): Where the page's stats and malformed cells are collected. Default is `PARSE_REPORT`.
+
+    Returns:
+    - The `RosterMonth` parsed from the page.
+    """
+    def warn(error):
+        print(f"Skipped roster cell: {error}")
+
+    return parse_calendar(html, on_error=warn if mode == LENIENT else None, mode=mode,
+                          report=PARSE_REPORT if report is None else report)
+
+
+def fetch_roster_months(url: str, username: str, password: str, offsets=range(0, 3), parse=parse_page,
+                        sessions: list = None, browser: bool = True, browser_pool=None) -> list:
+    """
+    Fetches and parses a range of roster months relative to the current month.
+
+    The browserless `mic_roster_pipeline.fetch_months()` pipeline is tried first. If the site cannot be reached that
+    way or the login postback does not land on the calendar, the pages are fetched with headless Chrome instead,
+    unless `browser` is False.
+
+    Parameters:
+    - url (str): The URL of the roster login page.
+    - username (str): The personnel ID used to log in.
+    - password (str): The account password.
+    - offsets (Iterable[int]): Month offsets to fetch, e.g. `range(-24, 4)`. Default is the current month and the
+      two after it.
+    - parse (callable): Called with the HTML of each page. Default is `parse_page()`.
+    - sessions (list): Long-lived `RosterSession` objects to reuse, see `mic_roster_pipeline.fetch_months()`.
+    - browser (bool): Fall back to headless Chrome when the HTTP engine fails. When False the error is raised and
+      Selenium is never imported.
+    - browser_pool (mic_roster_browser_pool.BrowserPool): Optional pool of warm drivers for the fallback. Without one,
+      a new Chrome is started and quit for this call.
+
+    Returns:
+    - A list of the parse results, one per offset, in calendar order.
+    """
+    try:
+        try:
+            return fetch_months(username, password, offsets, url=url, parse=parse, sessions=sessions)
+        except SessionExpired:
+            print("Roster session expired during the fetch, logging in again")
+            return fetch_months(username, password, offsets, url=url, parse=parse, sessions=sessions)
+    except (requests.RequestException, LoginError) as e:
+        if not browser:
+            raise
+        print(f"HTTP engine failed ({e}), falling back to Chrome")
+        count('chrome_fallbacks')
+
+    def walk(driver):
+        first_page = login(driver, url, username, password)
+        return sorted(walk_months(lambda button_name: fetch_next_page_html(driver, button_name), first_page, offsets))
+
+    if browser_pool is not None:
+        with browser_pool.driver() as driver:
+            pages = walk(driver)
+    else:
+        driver = setup_chrome_driver()
+        try:
+            pages = walk(driver)
+        finally:
+            driver.quit()
+    return [parse(html) for _, html in pages]
+
+
+def run_sync(service, username: str, password: str, offsets=range(0, 3), cache: PageCache = None,
+             url: str = LOGIN_URL, calendar_id: str = 'primary', sessions: list = None, store=None,
+             account: str = '', dead_letters=None, browser_pool=None, parse=parse_page, changes=None) -> dict:
+    """
+    Scrapes a range of roster months and syncs the months that changed to Google Calendar.
+
+    Months whose calendar region matches the page cache need neither parsing nor calendar writes. Changed months
+    are synced one month window at a time, and a page is only cached once its month synced without failures.
+
+    Parameters:
+    - service (googleapiclient.discovery.Resource): The authenticated Google Calendar service object.
+    - username (str): The personnel ID used to log in.
+    - password (str): The account password.
+    - offsets (Iterable[int]): Month offsets to sync. Default is the current month and the two after it.
+    - cache (PageCache): The page cache. A `PageCache` in the default location is used when omitted.
+    - url (str): The URL of the roster login page.
+    - calendar_id (str): ID of the calendar to sync. Default is 'primary'.
+    - sessions (list): Long-lived `RosterSession` objects to reuse, see `mic_roster_pipeline.fetch_months()`.
+    - store (mic_roster_store.ShiftStore): Optional local store that keeps the shifts and plans the writes from
+      recorded event IDs, see `mic_roster_sync.sync_calendar()`.
+    - account (str): The account the shifts belong to in the store and in `dead_letters`.
+    - dead_letters (mic_roster_deadletters.DeadLetterQueue): Optional queue of writes that failed on earlier runs.
+      They are replayed before the roster is fetched, and writes that fail in this run are added to it.
+    - browser_pool (mic_roster_browser_pool.BrowserPool): Optional pool of warm drivers for the Chrome fallback.
+    - parse (callable): The page parser. Default is `parse_page()`, which skips and reports malformed cells.
+    - changes (mic_roster_changes.ChangeStream): Optional stream that is told which shifts were added, removed or
+      changed since the snapshot in `store`. Requires `store`.
+
+    Returns:
+    - A dictionary with the number of months `fetched` and `changed`, the summed write counts and, with
+      `changes`, the number of roster `changes` found.
+
+    Raises:
+    - ValueError: If `changes` is given without a `store` to compare with.
+    """
+    if changes is not None and store is None:
+        raise ValueError("Detecting roster changes needs a store holding the previous snapshot")
+    if dead_letters is not None:
+        # Replay before planning, so the plan sees the replayed events and does not write them a second time.
+        dead_letters.replay(service, account, calendar_id)
+    cache = cache or PageCache()
+    offsets = cache.uncached_offsets(offsets)
+
+    def parse_changed(html):
+        # Months whose calendar region matches the cached copy need neither parsing nor calendar writes.
+        return None if cache.is_unchanged(html) else (html, parse(html))
+
+    with span('fetch'):
+        pages = fetch_roster_months(url, username, password, offsets, parse=parse_changed, sessions=sessions,
+                                    browser_pool=browser_pool)
+    changed = [page for page in pages if page]
+    print(f"{len(changed)} of {len(offsets)} months changed")
+
+    totals = {'fetched': len(offsets), 'changed': len(changed), 'inserted': 0, 'patched': 0, 'deleted': 0,
+              'failed': 0}
+    if changes is not None:
+        totals['changes'] = 0
+    for html, month in changed:
+        time_min, time_max = month_window([0], today=datetime.date(month.year, month.month, 1))
+        # Compare before sync_calendar() replaces the stored snapshot with this scrape, but only send the changes
+        # once the store holds it; a sync that fails first finds and sends them on the next run instead.
+        pending = changes.detect(store, month.shifts, time_min, time_max, account) if changes is not None else []
+        try:
+            with span('calendar_sync'):
+                counts = sync_calendar(service, month.shifts, time_min, time_max, calendar_id, store, account,
+                                       dead_letters)
+        finally:
+            if pending:
+                totals['changes'] += changes.flush(pending, store, month.shifts, time_min, time_max, account)
+        print(f"Synced {month.year}-{month.month:02d}: {counts}")
+        for name, value in counts.items():
+            totals[name] += value
+        if not counts['failed']:
+            cache.put(html)
+    return totals
+
+
 def main():
-    login_url = 'https://ess.tmc.tambla.net/Microster.SelfService/Default.aspx'
-    global event_dict
-    driver = setup_chrome_driver()
-    service = authenticate_google_calendar(['https://www.googleapis.com/auth/calendar'])
-    start_date = datetime.datetime.now().day
-    events_tbd = list_calendar_events(service, max_results=1000, days_past=start_date)
-    event_length = len(events_tbd)
-    for event in events_tbd:
-        print(event_length, end=" ")
-        event_id = event['id']
-        delete_calendar_event(service, event_id=event_id)
-        event_length -= 1
+    parser = argparse.ArgumentParser(description="Sync the Mic Roster to Google Calendar.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="scrape and parse the roster and print the shifts; no browser, no Google Calendar")
+    parser.add_argument('--past', type=int, default=0, help="number of past months to sync")
+    parser.add_argument('--future', type=int, default=2, help="number of months after the current one to sync")
+    parser.add_argument('--strict', action='store_true', help="stop at the first roster cell that cannot be parsed")
+    parser.add_argument('--parse-report', help="write parse stats and malformed cells to this JSON file")
+    parser.add_argument('--changes', help="append roster changes since the last run to this JSON lines file")
+    parser.add_argument('--webhook', help="POST roster changes since the last run to this URL")
+    parser.add_argument('--print-changes', action='store_true', help="print roster changes since the last run")
+    parser.add_argument('--no-store', action='store_true',
+                        help="plan the sync by listing the calendar every run instead of from the local shift store")
+    args = parser.parse_args()
+    if args.no_store and (args.changes or args.webhook or args.print_changes):
+        parser.error("roster changes are found from the shift store and cannot be used with --no-store")
+    offsets = range(-args.past, args.future + 1)
+    parse = functools.partial(parse_page, mode=STRICT if args.strict else LENIENT)
+
     import credentials as cr
-    process_response_cal(login(driver, login_url, cr.credentials.username, cr.credentials.password))
-    time.sleep(2)
-
-    process_response_cal(fetch_next_page_html(driver, "ctl00_ContentPlaceHolder1_calendar_lnkNextMonth"))
-    time.sleep(2)
-    process_response_cal(fetch_next_page_html(driver, "ctl00_ContentPlaceHolder1_calendar_lnkNextMonth"))
-    time.sleep(2)
-    # for i in range(24):
-    #     try:
-    #         process_response_cal(fetch_next_page_html(driver, "ctl00_ContentPlaceHolder1_calendar_lnkPreviousMonth"))
-    #         time.sleep(2)
-    #     except:
-    #         pass
-    driver.quit()
-
-    for _, event in event_dict.items():
-        try:
-            create_calendar_event(service, event)
-        except:
-            print(f"Skipped event {event}")
+    try:
+        if args.dry_run:
+            months = fetch_roster_months(LOGIN_URL, cr.credentials.username, cr.credentials.password, offsets,
+                                         parse=parse, browser=False)
+            for month in months:
+                print(f"{month.year}-{month.month:02d}: {len(month.shifts)} shifts")
+                for shift in month.shifts:
+                    print(f"  {shift.start:%a %d %b %H:%M}-{shift.end:%H:%M}  {shift.code}")
+        else:
+            from mic_roster_changes import build_change_stream
+            from mic_roster_store import ShiftStore
+
+            service = authenticate_google_calendar(['https://www.googleapis.com/auth/calendar'])
+            changes = build_change_stream(args.changes, args.webhook, args.print_changes)
+            store = None if args.no_store else ShiftStore()
+            run_sync(service, cr.credentials.username, cr.credentials.password, offsets, store=store,
+                     dead_letters=DeadLetterQueue(), parse=parse, changes=changes or None)
+    finally:
+        totals = PARSE_REPORT.totals()
+        print(f"Parsed {totals['pages']} pages: {totals['cells']} cells, {totals['parsed']} shifts, "
+              f"{totals['skipped']} skipped, {totals['failed']} failed")
+        if args.parse_report:
+            PARSE_REPORT.write(args.parse_report)
 
 
 if __name__ == '__main__':
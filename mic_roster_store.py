@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Shift Store.
+
+A local SQLite database of scraped shifts and of the Google Calendar events written for them. Shifts are indexed
+by account, date and shift code, so questions such as "what am I working on the 28th" or "which calendar event
+belongs to this shift" are answered offline without a Calendar API round trip.
+
+The store is also the sync's record of what is in the calendar. Once a month has been synced without failures,
+later syncs plan their writes from the stored event IDs instead of listing the calendar. Months are listed from the
+API again after `reconcile_after` seconds, which picks up events that were edited or deleted by hand.
+
+Example:
+```
+store = ShiftStore()
+for shift in store.shifts_on(datetime.date(2024, 5, 28), account='jsmith'):
+    print(shift.code, shift.start, shift.end, store.event_id(shift, account='jsmith'))
+```
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable
+
+from mic_roster_parser import Shift
+from mic_roster_sync import REMINDERS, ROSTER_LOCATION, TIMEZONE, _local_time, event_key, shift_key
+
+STORE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'roster.db')
+
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shifts (
+    account TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    date TEXT NOT NULL,
+    code TEXT NOT NULL,
+    detail TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (account, start, code)
+);
+CREATE INDEX IF NOT EXISTS shifts_by_date ON shifts (date, account);
+CREATE INDEX IF NOT EXISTS shifts_by_code ON shifts (code, date);
+
+CREATE TABLE IF NOT EXISTS events (
+    account TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    event_id TEXT NOT NULL,
+    shift_key TEXT NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    PRIMARY KEY (account, calendar_id, event_id)
+);
+CREATE INDEX IF NOT EXISTS events_by_start ON events (account, calendar_id, start);
+CREATE INDEX IF NOT EXISTS events_by_key ON events (account, calendar_id, shift_key);
+
+CREATE TABLE IF NOT EXISTS synced_months (
+    account TEXT NOT NULL,
+    calendar_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    synced_at REAL NOT NULL,
+    PRIMARY KEY (account, calendar_id, month)
+);
+'''
+
+
+def _text(value: datetime.datetime) -> str:
+    return value.strftime(_DATETIME_FORMAT)
+
+
+def _shift(row) -> Shift:
+    start, end, code, detail = row
+    return Shift(datetime.datetime.strptime(start, _DATETIME_FORMAT), datetime.datetime.strptime(end, _DATETIME_FORMAT),
+                 code, detail)
+
+
+def window_months(time_min: datetime.datetime, time_max: datetime.datetime) -> list:
+    """Lists the months, as `YYYY-MM`, that start inside a sync window."""
+    months = []
+    index = time_min.year * 12 + time_min.month - 1
+    while datetime.datetime(index // 12, index % 12 + 1, 1) < time_max.replace(tzinfo=None):
+        months.append(f"{index // 12}-{index % 12 + 1:02d}")
+        index += 1
+    return months
+
+
+class ShiftStore:
+    """
+    SQLite store of shifts and their calendar event IDs, safe to share between threads.
+
+    Times are stored as local roster times in ISO format, which sorts correctly as text.
+    """
+
+    def __init__(self, path: str = STORE_PATH, reconcile_after: float = 24 * 3600):
+        """
+        Parameters:
+        - path (str): The database file, created if missing. Use ':memory:' for a throwaway store.
+        - reconcile_after (float): Seconds after which a synced month is listed from the Calendar API again
+          instead of being trusted from the store. Default is one day.
+        """
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.reconcile_after = reconcile_after
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self._db.close()
+
+    def _query(self, sql: str, parameters=()) -> list:
+        with self._lock:
+            return self._db.execute(sql, parameters).fetchall()
+
+    # Shifts
+
+    def replace_shifts(self, shifts: Iterable[Shift], time_min: datetime.datetime, time_max: datetime.datetime,
+                       account: str = ''):
+        """
+        Replaces the stored shifts starting in a window with a fresh scrape of that window.
+
+        Parameters:
+        - shifts (Iterable[Shift]): Every shift scraped for the window.
+        - time_min (datetime.datetime), time_max (datetime.datetime): The window, as returned by `month_window()`.
+        - account (str): The account the shifts belong to.
+        """
+        rows = [(account, _text(s.start), _text(s.end), s.start.date().isoformat(), s.code, s.detail) for s in shifts]
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM shifts WHERE account = ? AND start >= ? AND start < ?',
+                             (account, _text(time_min), _text(time_max)))
+            self._db.executemany('INSERT OR REPLACE INTO shifts VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def shifts_on(self, date: datetime.date, account: str = '') -> list:
+        """Returns the shifts starting on a date, in start order."""
+        return [_shift(row) for row in self._query(
+            'SELECT start, end, code, detail FROM shifts WHERE date = ? AND account = ? ORDER BY start',
+            (date.isoformat(), account))]
+
+    def shifts_between(self, start: datetime.date, end: datetime.date, account: str = '') -> list:
+        """Returns the shifts starting on or after `start` and before `end`, in start order."""
+        return [_shift(row) for row in self._query(
+            'SELECT start, end, code, detail FROM shifts WHERE date >= ? AND date < ? AND account = ? ORDER BY start',
+            (start.isoformat(), end.isoformat(), account))]
+
+    def shifts_with_code(self, code: str, account: str = None) -> list:
+        """Returns every stored shift with a shift code, for one account or, when `account` is None, for all."""
+        if account is None:
+            rows = self._query('SELECT start, end, code, detail FROM shifts WHERE code = ? ORDER BY date', (code,))
+        else:
+            rows = self._query('SELECT start, end, code, detail FROM shifts WHERE code = ? AND account = ? '
+                               'ORDER BY date', (code, account))
+        return [_shift(row) for row in rows]
+
+    def shift_rows(self, account: str = None) -> list:
+        """
+        Returns the raw stored shifts as `(account, start, end, code)` tuples of strings, ordered by account and
+        start, for one account or, when `account` is None, for all. Used for bulk loads such as analytics.
+        """
+        if account is None:
+            return self._query('SELECT account, start, end, code FROM shifts ORDER BY account, start')
+        return self._query('SELECT account, start, end, code FROM shifts WHERE account = ? ORDER BY start', (account,))
+
+    # Calendar events
+
+    def event_id(self, shift: Shift, account: str = '', calendar_id: str = 'primary'):
+        """Returns the ID of the calendar event written for a shift, or None."""
+        rows = self._query('SELECT event_id FROM events WHERE account = ? AND calendar_id = ? AND shift_key = ?',
+                           (account, calendar_id, shift_key(shift)))
+        return rows[0][0] if rows else None
+
+    def shift_for_event(self, event_id: str, account: str = '', calendar_id: str = 'primary'):
+        """Returns the stored shift a calendar event was written for, or None."""
+        rows = self._query(
+            'SELECT s.start, s.end, s.code, s.detail FROM events e JOIN shifts s '
+            'ON s.account = e.account AND s.start = e.start AND e.shift_key = s.start || \'|\' || s.code '
+            'WHERE e.account = ? AND e.calendar_id = ? AND e.event_id = ?', (account, calendar_id, event_id))
+        return _shift(rows[0]) if rows else None
+
+    def record_event(self, event_id: str, shift: Shift, account: str = '', calendar_id: str = 'primary'):
+        """Records that a calendar event holds a shift, replacing whatever the event held before."""
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)',
+                             (account, calendar_id, event_id, shift_key(shift), _text(shift.start), _text(shift.end)))
+
+    def forget_event(self, event_id: str, account: str = '', calendar_id: str = 'primary'):
+        """Removes a deleted calendar event."""
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM events WHERE account = ? AND calendar_id = ? AND event_id = ?',
+                             (account, calendar_id, event_id))
+
+    def replace_events(self, events: Iterable[dict], time_min: datetime.datetime, time_max: datetime.datetime,
+                       account: str = '', calendar_id: str = 'primary'):
+        """
+        Replaces the stored events of a window with roster events listed from the Calendar API.
+
+        Parameters:
+        - events (Iterable[dict]): Roster events as returned by `list_roster_events()`.
+        - time_min (datetime.datetime), time_max (datetime.datetime): The window the events were listed for.
+        - account (str), calendar_id (str): Whose calendar the events are in.
+        """
+        rows = [(account, calendar_id, event['id'], event_key(event), _local_time(event.get('start')),
+                 _local_time(event.get('end'))) for event in events if _local_time(event.get('start'))]
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM events WHERE account = ? AND calendar_id = ? AND start >= ? AND start < ?',
+                             (account, calendar_id, _text(time_min), _text(time_max)))
+            self._db.executemany('INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def calendar_events(self, time_min: datetime.datetime, time_max: datetime.datetime, account: str = '',
+                        calendar_id: str = 'primary') -> list:
+        """
+        Returns the stored events of a window in the shape of Calendar API events, for `plan_sync()`.
+
+        The store only records events as the scraper wrote them, so the location and reminders are the ones every
+        roster event is created with.
+        """
+        rows = self._query('SELECT event_id, shift_key, start, end FROM events '
+                           'WHERE account = ? AND calendar_id = ? AND start >= ? AND start < ? ORDER BY start',
+                           (account, calendar_id, _text(time_min), _text(time_max)))
+        return [{'id': event_id, 'summary': key.split('|', 1)[1], 'location': ROSTER_LOCATION,
+                 'start': {'dateTime': start, 'timeZone': TIMEZONE}, 'end': {'dateTime': end, 'timeZone': TIMEZONE},
+                 'reminders': REMINDERS}
+                for event_id, key, start, end in rows]
+
+    # Sync bookkeeping
+
+    def is_synced(self, time_min: datetime.datetime, time_max: datetime.datetime, account: str = '',
+                  calendar_id: str = 'primary') -> bool:
+        """Reports whether every month of a window was synced cleanly within the last `reconcile_after` seconds."""
+        months = window_months(time_min, time_max)
+        rows = self._query('SELECT month, synced_at FROM synced_months WHERE account = ? AND calendar_id = ?',
+                           (account, calendar_id))
+        synced = {month for month, synced_at in rows if time.time() - synced_at < self.reconcile_after}
+        return bool(months) and all(month in synced for month in months)
+
+    def mark_synced(self, time_min: datetime.datetime, time_max: datetime.datetime, account: str = '',
+                    calendar_id: str = 'primary', synced: bool = True):
+        """
+        Records the outcome of syncing a window. Marking it unsynced makes the next sync list it from the API.
+
+        Parameters:
+        - synced (bool): True when the window was listed or last reconciled cleanly.
+        """
+        with self._lock, self._db:
+            for month in window_months(time_min, time_max):
+                if synced:
+                    self._db.execute('INSERT OR REPLACE INTO synced_months VALUES (?, ?, ?, ?)',
+                                     (account, calendar_id, month, time.time()))
+                else:
+                    self._db.execute('DELETE FROM synced_months WHERE account = ? AND calendar_id = ? AND month = ?',
+                                     (account, calendar_id, month))
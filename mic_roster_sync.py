@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+"""
+Mic Roster Calendar Sync.
+
+Diff-based synchronisation between the scraped roster and Google Calendar. Instead of deleting every event in the
+window and inserting the roster again, each shift is given a stable key (local start datetime plus shift code) and
+the scraped events are compared with the roster events already in the calendar. Only the inserts, patches and
+deletes needed to make the calendar match the roster are issued, so an unchanged roster costs no write calls.
+"""
+# MIT License
+#
+# Copyright (c) 2024 Matthew Picone
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import datetime
+import hashlib
+from typing import Iterable, NamedTuple
+
+import pytz
+
+from mic_roster_batch import CalendarBatcher
+from mic_roster_metrics import count, span
+
+TIMEZONE = 'Australia/Sydney'
+ROSTER_LOCATION = '25 Garden Street Eveleigh NSW 2015'
+KEY_PROPERTY = 'micRosterKey'
+
+# Fields sent when a calendar event has drifted from its shift. The description only carries the time of the last
+# scrape, so it is refreshed with a patch but never triggers one.
+_PATCHED_FIELDS = ('end', 'location', 'reminders', 'description', 'extendedProperties')
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+REMINDERS = {
+    'useDefault': False,
+    'overrides': [
+        {'method': 'email', 'minutes': 24 * 60},
+        {'method': 'email', 'minutes': 12 * 60},
+        {'method': 'popup', 'minutes': 12 * 60},
+        {'method': 'popup', 'minutes': 60},
+        {'method': 'popup', 'minutes': 10},
+    ]
+}
+
+
+class SyncPlan(NamedTuple):
+    """
+    The calendar writes needed to bring the calendar in line with the roster: shifts to insert, `(event_id, shift)`
+    pairs to patch and the IDs of events to delete.
+    """
+    inserts: list
+    patches: list
+    deletes: list
+
+    def __len__(self):
+        return len(self.inserts) + len(self.patches) + len(self.deletes)
+
+
+def _local_time(value: dict, timezone: str = TIMEZONE):
+    """Normalises a Calendar `start`/`end` value to a naive local ISO string, or None for all-day events."""
+    date_time = value.get('dateTime') if value else None
+    if not date_time:
+        return None
+    parsed = datetime.datetime.fromisoformat(date_time.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(pytz.timezone(timezone)).replace(tzinfo=None)
+    return parsed.strftime(_DATETIME_FORMAT)
+
+
+def shift_key(shift) -> str:
+    """
+    Builds the stable key identifying a roster shift.
+
+    Parameters:
+    - shift (mic_roster_parser.Shift): A parsed shift.
+
+    Returns:
+    - A string combining the local start datetime and the shift code, e.g. `2024-05-28T09:00:00|SURFACE`.
+    """
+    return f"{shift.start.strftime(_DATETIME_FORMAT)}|{shift.code}"
+
+
+def event_id(shift, built_at: datetime.datetime) -> str:
+    """
+    Builds the ID a new calendar event for a shift is inserted with.
+
+    The ID is derived from `shift_key()` and the time the event body was built, so every retry and dead-letter
+    replay of one insert sends the same ID, and Google rejects a repeat with 409 instead of storing a duplicate.
+    A shift that is removed and rostered again gets a new ID, as Google never reuses the ID of a deleted event.
+
+    Returns:
+    - 40 lowercase hex digits, which are valid in Calendar event IDs.
+    """
+    return hashlib.sha1(f"{shift_key(shift)}|{built_at.isoformat()}".encode()).hexdigest()
+
+
+def build_event(shift) -> dict:
+    """
+    Builds the Google Calendar event body for a parsed shift.
+
+    Bodies are only built when a write is sent; the roster itself is held as `Shift` tuples.
+
+    Parameters:
+    - shift (mic_roster_parser.Shift): The shift to describe.
+
+    Returns:
+    - A dictionary in the format expected by `events().insert()`, tagged with the shift's key and carrying the
+      `event_id()` to insert it with.
+    """
+    now = datetime.datetime.now()
+    return {
+        'id': event_id(shift, now),
+        'summary': shift.code,
+        'location': ROSTER_LOCATION,
+        'description': f'Date shift last updated: {now.strftime("%d/%m/%Y %H:%M")}',
+        'start': {
+            'dateTime': shift.start.strftime(_DATETIME_FORMAT),
+            'timeZone': TIMEZONE,
+        },
+        'end': {
+            'dateTime': shift.end.strftime(_DATETIME_FORMAT),
+            'timeZone': TIMEZONE,
+        },
+        'reminders': REMINDERS,
+        'extendedProperties': {'private': {KEY_PROPERTY: shift_key(shift)}},
+    }
+
+
+def patch_body(shift) -> dict:
+    """Builds the body of a patch that brings a drifted calendar event back in line with its shift."""
+    body = build_event(shift)
+    return {field: body[field] for field in _PATCHED_FIELDS}
+
+
+def event_key(event: dict) -> str:
+    """
+    Builds the key of a calendar event, comparable with `shift_key()`.
+
+    Parameters:
+    - event (dict): A Calendar event returned by the API.
+
+    Returns:
+    - A string combining the local start datetime and the summary, e.g. `2024-05-28T09:00:00|SURFACE`.
+    """
+    return f"{_local_time(event.get('start'))}|{event.get('summary', '')}"
+
+
+def is_roster_event(event: dict) -> bool:
+    """
+    Reports whether a calendar event was created by the roster scraper.
+
+    Events written by `apply_sync()` carry the shift key as a private extended property. Events written by older
+    versions of the scraper are recognised by the depot location they were created with.
+
+    Parameters:
+    - event (dict): A Calendar event returned by the API.
+
+    Returns:
+    - True if the event belongs to the roster, False for any other event in the calendar.
+    """
+    private = event.get('extendedProperties', {}).get('private', {})
+    return KEY_PROPERTY in private or event.get('location') == ROSTER_LOCATION
+
+
+def _reminder_signature(reminders: dict) -> tuple:
+    reminders = reminders or {}
+    overrides = sorted((r.get('method'), r.get('minutes')) for r in reminders.get('overrides', []))
+    return bool(reminders.get('useDefault')), tuple(overrides)
+
+
+_REMINDER_SIGNATURE = _reminder_signature(REMINDERS)
+
+
+def _has_drifted(shift, event: dict) -> bool:
+    """Reports whether a calendar event no longer matches its shift's end time, location or reminders."""
+    return (_local_time(event.get('end')) != shift.end.strftime(_DATETIME_FORMAT)
+            or event.get('location') != ROSTER_LOCATION
+            or _reminder_signature(event.get('reminders')) != _REMINDER_SIGNATURE)
+
+
+def plan_sync(shifts: Iterable, existing_events: Iterable[dict]) -> SyncPlan:
+    """
+    Compares the scraped shifts with the roster events already in the calendar.
+
+    Parameters:
+    - shifts (Iterable[mic_roster_parser.Shift]): The shifts parsed from the roster.
+    - existing_events (Iterable[dict]): Roster events currently in the calendar for the same time window.
+
+    Returns:
+    - A `SyncPlan` holding the shifts to insert, `(event_id, shift)` pairs to patch, and the IDs of calendar events
+      to delete. Duplicate calendar events for the same shift are scheduled for deletion.
+    """
+    existing = {}
+    deletes = []
+    for event in existing_events:
+        key = event_key(event)
+        if key in existing:
+            deletes.append(event['id'])
+        else:
+            existing[key] = event
+
+    inserts, patches = [], []
+    for shift in shifts:
+        current = existing.pop(shift_key(shift), None)
+        if current is None:
+            inserts.append(shift)
+        elif _has_drifted(shift, current):
+            patches.append((current['id'], shift))
+
+    deletes.extend(event['id'] for event in existing.values())
+    return SyncPlan(inserts, patches, deletes)
+
+
+def roster_events_in_window(items: Iterable[dict], time_min: datetime.datetime) -> list:
+    """
+    Keeps the roster events from a page of listed events that start inside a sync window.
+
+    The API returns every event overlapping the window; only those starting inside it belong to this sync, so an
+    overnight shift from the previous month is not mistaken for a stale one.
+    """
+    start_min = time_min.strftime(_DATETIME_FORMAT)
+    return [e for e in items if is_roster_event(e) and (_local_time(e.get('start')) or '') >= start_min]
+
+
+def list_roster_events(service, time_min: datetime.datetime, time_max: datetime.datetime,
+                       calendar_id: str = 'primary') -> list:
+    """
+    Lists every roster event in a time window, following result pages instead of capping at `maxResults`.
+
+    Parameters:
+    - service (googleapiclient.discovery.Resource): The authenticated Google Calendar service object.
+    - time_min (datetime.datetime): Timezone-aware start of the window.
+    - time_max (datetime.datetime): Timezone-aware end of the window.
+    - calendar_id (str): ID of the calendar to list events from. Default is 'primary'.
+
+    Returns:
+    - A list of the roster events starting in the window, as returned by the API.
+    """
+    events, page_token = [], None
+    while True:
+        count('calendar_api_calls', operation='list')
+        with span('calendar_list'):
+            result = service.events().list(calendarId=calendar_id, timeMin=time_min.isoformat(),
+                                           timeMax=time_max.isoformat(), singleEvents=True, maxResults=2500,
+                                           pageToken=page_token).execute()
+        events.extend(roster_events_in_window(result.get('items', []), time_min))
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            return events
+
+
+def apply_sync(service, plan: SyncPlan, calendar_id: str = 'primary', on_written=None, dead_letters=None,
+               account: str = '') -> dict:
+    """
+    Issues the writes in a `SyncPlan` as Calendar batch requests.
+
+    Parameters:
+    - service (googleapiclient.discovery.Resource): The authenticated Google Calendar service object.
+    - plan (SyncPlan): The plan returned by `plan_sync()`.
+    - calendar_id (str): ID of the calendar to write to. Default is 'primary'.
+    - on_written (callable): Called as `on_written(operation, item, response)` for every successful write, where
+      `item` is the plan entry: a shift for an insert, an `(event_id, shift)` pair for a patch or an event ID for a
+      delete.
+    - dead_letters (mic_roster_deadletters.DeadLetterQueue): Optional queue that keeps writes still failing after
+      every retry, to be replayed on the next run.
+    - account (str): The account the writes belong to in `dead_letters`.
+
+    Returns:
+    - A dictionary with the number of `inserted`, `patched`, `deleted` and `failed` writes.
+    """
+    counts = {'inserted': 0, 'patched': 0, 'deleted': 0, 'failed': 0}
+    if not plan:
+        return counts
+    batcher = CalendarBatcher(service, calendar_id)
+    writes = [(shift, None, build_event(shift)) for shift in plan.inserts]
+    writes += [((event_id, shift), event_id, patch_body(shift)) for event_id, shift in plan.patches]
+    writes += [(event_id, event_id, None) for event_id in plan.deletes]
+    for _, event_id, body in writes:
+        if event_id is None:
+            batcher.insert(body)
+        elif body is not None:
+            batcher.patch(event_id, body)
+        else:
+            batcher.delete(event_id)
+    outcomes = {'insert': 'inserted', 'patch': 'patched', 'delete': 'deleted'}
+    # Results come back in the order the writes were queued.
+    for (item, event_id, body), result in zip(writes, batcher.execute()):
+        if result.ok:
+            counts[outcomes[result.operation]] += 1
+            if on_written is not None:
+                on_written(result.operation, item, result.response)
+        else:
+            print(f"Calendar {result.operation} failed: {result.error}")
+            counts['failed'] += 1
+            if dead_letters is not None:
+                dead_letters.record(result.operation, result.error, body, event_id, account, calendar_id)
+    return counts
+
+
+def month_window(offsets: Iterable[int] = range(0, 3), timezone: str = TIMEZONE,
+                 today: datetime.date = None) -> tuple:
+    """
+    Returns the time window covered by a scrape of a range of months relative to the current month.
+
+    Parameters:
+    - offsets (Iterable[int]): The month offsets scraped, e.g. `range(-24, 4)`. Default is the current month and
+      the two after it.
+    - timezone (str): The roster's timezone. Default is 'Australia/Sydney'.
+    - today (datetime.date): The reference date. Defaults to the current date in `timezone`.
+
+    Returns:
+    - A tuple `(time_min, time_max)` of timezone-aware datetimes: midnight on the first day of the earliest month
+      scraped and midnight on the first day of the month after the last one.
+    """
+    tz = pytz.timezone(timezone)
+    today = today or datetime.datetime.now(tz).date()
+    offsets = list(offsets)
+    first = today.year * 12 + today.month - 1 + min(offsets)
+    after = today.year * 12 + today.month + max(offsets)
+    time_min = tz.localize(datetime.datetime(first // 12, first % 12 + 1, 1))
+    time_max = tz.localize(datetime.datetime(after // 12, after % 12 + 1, 1))
+    return time_min, time_max
+
+
+def sync_calendar(service, shifts: Iterable, time_min: datetime.datetime,
+                  time_max: datetime.datetime, calendar_id: str = 'primary', store=None, account: str = '',
+                  dead_letters=None) -> dict:
+    """
+    Brings the roster events of a calendar window in line with the scraped roster.
+
+    With a `mic_roster_store.ShiftStore`, the scraped shifts are saved and the writes are planned from the event
+    IDs the store recorded, so the calendar is only listed when the window has not been synced cleanly within the
+    store's `reconcile_after` period.
+
+    Parameters:
+    - service (googleapiclient.discovery.Resource): The authenticated Google Calendar service object.
+    - shifts (Iterable[mic_roster_parser.Shift]): The shifts parsed from the roster for the same window.
+    - time_min (datetime.datetime): Timezone-aware start of the scraped window.
+    - time_max (datetime.datetime): Timezone-aware end of the scraped window.
+    - calendar_id (str): ID of the calendar to sync. Default is 'primary'.
+    - store (mic_roster_store.ShiftStore): Optional local store of shifts and event IDs.
+    - account (str): The account the shifts belong to in the store and in `dead_letters`.
+    - dead_letters (mic_roster_deadletters.DeadLetterQueue): Optional queue for writes that fail after every retry.
+
+    Returns:
+    - The write counts from `apply_sync()`.
+    """
+    shifts = list(shifts)
+    if store is None:
+        existing = list_roster_events(service, time_min, time_max, calendar_id)
+    elif store.is_synced(time_min, time_max, account, calendar_id):
+        existing = store.calendar_events(time_min, time_max, account, calendar_id)
+    else:
+        existing = list_roster_events(service, time_min, time_max, calendar_id)
+        store.replace_events(existing, time_min, time_max, account, calendar_id)
+        store.mark_synced(time_min, time_max, account, calendar_id)
+    plan = plan_sync(shifts, existing)
+    print(f"Sync plan: {len(plan.inserts)} inserts, {len(plan.patches)} patches, {len(plan.deletes)} deletes")
+    if store is None:
+        return apply_sync(service, plan, calendar_id, dead_letters=dead_letters, account=account)
+
+    def record(operation, item, response):
+        if operation == 'insert':
+            store.record_event(response['id'], item, account, calendar_id)
+        elif operation == 'patch':
+            store.record_event(item[0], item[1], account, calendar_id)
+        else:
+            store.forget_event(item, account, calendar_id)
+
+    store.replace_shifts(shifts, time_min, time_max, account)
+    counts = apply_sync(service, plan, calendar_id, record, dead_letters, account)
+    if counts['failed']:
+        # A failed write leaves the calendar out of step with the store; list the window again next time.
+        store.mark_synced(time_min, time_max, account, calendar_id, synced=False)
+    return counts
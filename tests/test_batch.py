@@ -0,0 +1,113 @@
+import pytest
+
+from benchmarks.fake_calendar import FakeCalendarService
+from mic_roster_batch import CalendarBatcher, TokenBucket
+
+
+def event(number):
+    return {'id': f'shift{number:04d}', 'summary': f'Shift {number}', 'start': {'dateTime': f'2024-05-{number % 28 + 1:02d}T07:00:00'},
+            'end': {'dateTime': f'2024-05-{number % 28 + 1:02d}T15:30:00'}}
+
+
+def batcher(service, sleeps, **options):
+    options.setdefault('limiter', None)
+    return CalendarBatcher(service, backoff=0.01, sleep=sleeps.append, **options)
+
+
+def test_writes_are_sent_in_chunks_of_batch_size():
+    service, sleeps = FakeCalendarService(), []
+    calendar = batcher(service, sleeps, batch_size=50)
+    ids = [calendar.insert(event(number)) for number in range(120)]
+    results = calendar.execute()
+    assert [result.request_id for result in results] == ids
+    assert all(result.ok for result in results)
+    assert service.calls == {'batch': 3, 'insert': 120}
+    assert len(service.events_by_id) == 120
+    assert len(calendar) == 0 and sleeps == []
+
+
+def test_batch_size_is_capped_at_the_api_limit():
+    service = FakeCalendarService()
+    calendar = batcher(service, [], batch_size=500)
+    for number in range(60):
+        calendar.insert(event(number))
+    calendar.execute()
+    assert service.calls['batch'] == 2
+
+
+def test_rate_limit_and_server_errors_are_retried():
+    service, sleeps = FakeCalendarService(errors=[(429, 'rateLimitExceeded'), (503, 'backendError'),
+                                                   (403, 'userRateLimitExceeded')]), []
+    calendar = batcher(service, sleeps)
+    for number in range(5):
+        calendar.insert(event(number))
+    results = calendar.execute()
+    assert all(result.ok for result in results)
+    assert len(service.events_by_id) == 5
+    assert service.calls == {'batch': 2, 'insert': 8}
+    assert len(sleeps) == 1
+
+
+def test_insert_stored_before_a_server_error_is_not_duplicated():
+    service, sleeps = FakeCalendarService(lost=[(503, 'backendError')]), []
+    calendar = batcher(service, sleeps)
+    calendar.insert(event(1))
+    result, = calendar.execute()
+    assert result.ok and result.response['id'] == 'shift0001'
+    assert list(service.events_by_id) == ['shift0001']
+    assert service.calls['insert'] == 2 and len(sleeps) == 1
+
+
+def test_insert_without_an_id_is_only_retried_on_rate_limits():
+    body = {key: value for key, value in event(1).items() if key != 'id'}
+    service, sleeps = FakeCalendarService(errors=[(429, 'rateLimitExceeded'), (503, 'backendError')]), []
+    calendar = batcher(service, sleeps)
+    calendar.insert(body)
+    result, = calendar.execute()
+    assert not result.ok and result.error.resp.status == 503
+    assert service.events_by_id == {}
+    assert len(sleeps) == 1
+
+
+def test_other_errors_fail_without_retry():
+    service, sleeps = FakeCalendarService(errors=[(400, 'badRequest')]), []
+    calendar = batcher(service, sleeps)
+    calendar.insert(event(1))
+    calendar.insert(event(2))
+    first, second = calendar.execute()
+    assert not first.ok and first.error.resp.status == 400
+    assert second.ok
+    assert sleeps == []
+
+
+def test_writes_fail_once_retries_are_exhausted():
+    service, sleeps = FakeCalendarService(rate_limited=100), []
+    calendar = batcher(service, sleeps, max_retries=2)
+    calendar.insert(event(1))
+    result, = calendar.execute()
+    assert not result.ok
+    assert service.calls == {'batch': 3, 'insert': 3}
+    assert len(sleeps) == 2
+    assert sleeps[1] >= 2 * 0.01
+
+
+def test_deleting_a_missing_event_counts_as_done():
+    service = FakeCalendarService()
+    calendar = batcher(service, [])
+    calendar.delete('missing')
+    result, = calendar.execute()
+    assert result.ok and result.operation == 'delete'
+
+
+def test_limiter_is_throttled_on_rate_limits_and_charged_per_write():
+    now = [0.0]
+    waits = []
+    limiter = TokenBucket(rate=10, burst=10, clock=lambda: now[0], sleep=waits.append)
+    service = FakeCalendarService(errors=[(429, 'rateLimitExceeded')])
+    calendar = batcher(service, [], limiter=limiter)
+    for number in range(4):
+        calendar.insert(event(number))
+    assert all(result.ok for result in calendar.execute())
+    assert limiter.rate < 10
+    # The four writes fit in the bucket; the throttle empties it, so the retried write waits for a token.
+    assert waits == [pytest.approx(1 / 5)]
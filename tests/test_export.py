@@ -0,0 +1,87 @@
+import csv
+import datetime
+import os
+
+import pytest
+import pytz
+
+from benchmarks import make_pages
+from mic_roster_export import export, months_from_pages, partition_dir
+from mic_roster_sync import TIMEZONE
+
+FORMATS = ['roster.ics', 'roster.csv', 'roster.parquet']
+
+
+def corpus_months(*names):
+    return list(months_from_pages(os.path.join(make_pages.PAGES_DIR, f'{name}.html') for name in names))
+
+
+def snapshot(directory):
+    files = {}
+    for parent, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(parent, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, directory)] = (os.stat(path).st_mtime_ns, f.read())
+    return files
+
+
+def read_back(output):
+    # Returns (start, end, code) of every exported shift, whatever the format.
+    if output.endswith('.parquet'):
+        pq = pytest.importorskip('pyarrow.parquet')
+        table = pq.read_table(output)
+        assert set(table.column('account').to_pylist()) == {'jsmith'}
+        return sorted(zip(table.column('start').to_pylist(), table.column('end').to_pylist(),
+                          table.column('code').to_pylist()))
+    shifts = []
+    for parent, _, names in os.walk(output):
+        for name in names:
+            with open(os.path.join(parent, name), newline='', encoding='utf-8') as f:
+                if name.endswith('.csv'):
+                    shifts += [(datetime.datetime.fromisoformat(row['start']),
+                                datetime.datetime.fromisoformat(row['end']), row['code']) for row in csv.DictReader(f)]
+                else:
+                    shifts += [line for line in f.read().split('\r\n') if line.startswith('UID:')]
+    return sorted(shifts)
+
+
+@pytest.mark.parametrize('name', FORMATS)
+def test_reexporting_a_month_only_touches_that_month(tmp_path, name):
+    if name.endswith('.parquet'):
+        pytest.importorskip('pyarrow')
+    output = str(tmp_path / name)
+    april, may, june = corpus_months('2024-04', '2024-05', '2024-06')
+    assert export([april, may, june], output, 'jsmith') == len(april.shifts + may.shifts + june.shifts)
+    before = snapshot(output)
+    exported = read_back(output)
+
+    # May's first shift now finishes an hour later.
+    first = may.shifts[0]
+    changed = may._replace(shifts=(first._replace(end=first.end + datetime.timedelta(hours=1)),) + may.shifts[1:])
+    assert export([changed], output, 'jsmith') == len(may.shifts)
+    after = snapshot(output)
+
+    may_dir = os.path.relpath(partition_dir(output, 'jsmith', 2024, 5), output)
+    assert set(after) == set(before)
+    touched = {path for path in after if after[path] != before[path]}
+    assert touched and all(path.startswith(may_dir + os.sep) for path in touched)
+    if name.endswith('.ics'):
+        # Events are compared by UID; the new end time is in May's calendar.
+        assert read_back(output) == exported
+        end = pytz.timezone(TIMEZONE).localize(first.end + datetime.timedelta(hours=1)).astimezone(pytz.UTC)
+        assert f"DTEND:{end:%Y%m%dT%H%M%SZ}" in after[os.path.join(may_dir, 'shifts.ics')][1].decode()
+    else:
+        later = (first.start, first.end + datetime.timedelta(hours=1), first.code)
+        assert read_back(output) == sorted([shift for shift in exported if shift[0] != first.start] + [later])
+
+
+@pytest.mark.parametrize('name', FORMATS)
+def test_same_month_twice_in_one_export_is_written_once(tmp_path, name):
+    if name.endswith('.parquet'):
+        pytest.importorskip('pyarrow')
+    output = str(tmp_path / name)
+    may, = corpus_months('2024-05')
+    assert export([may, may], output, 'jsmith') == len(may.shifts)
+    assert export([may], output, 'jsmith') == len(may.shifts)
+    assert len(read_back(output)) == len(may.shifts)
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from benchmarks.fake_roster import FakeRosterServer
+from mic_roster_http import NEXT_MONTH, PREVIOUS_MONTH, LoginError, PartialPostbackError, RosterSession, \
+    SessionExpired, parse_delta
+from mic_roster_parser import parse_calendar
+from mic_roster_pipeline import open_calendar
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+@pytest.fixture(params=[True, False], ids=['update_panel', 'full_page'])
+def server(request):
+    # May 2024 is served from the hand-written page in tests/pages; other months come from the generated corpus.
+    with FakeRosterServer(today=(2024, 5), update_panel=request.param, pages_dir=PAGES_DIR) as server:
+        yield server
+
+
+@pytest.fixture
+def roster(server):
+    roster = RosterSession(server.url)
+    roster.login(server.username, server.password)
+    yield roster
+    roster.close()
+
+
+def month_of(html):
+    month = parse_calendar(html)
+    return month.year, month.month, len(month.shifts)
+
+
+def test_login_reaches_the_calendar(server):
+    roster = RosterSession(server.url)
+    assert month_of(roster.login(server.username, server.password)) == (2024, 5, 3)
+    assert roster.logged_in
+
+
+def test_login_with_wrong_password_raises(server):
+    with pytest.raises(LoginError):
+        RosterSession(server.url).login(server.username, 'wrong')
+
+
+def test_next_and_previous_months(server, roster):
+    assert month_of(roster.fetch_next_page_html(NEXT_MONTH))[:2] == (2024, 6)
+    assert month_of(roster.fetch_next_page_html(NEXT_MONTH))[:2] == (2024, 7)
+    assert month_of(roster.fetch_next_page_html(PREVIOUS_MONTH))[:2] == (2024, 6)
+    assert month_of(roster.fetch_next_page_html(PREVIOUS_MONTH)) == (2024, 5, 3)
+    assert month_of(roster.fetch_next_page_html(PREVIOUS_MONTH))[:2] == (2024, 4)
+    assert server.partial_posts == (5 if server.update_panel else 0)
+
+
+def test_expired_session_raises_and_logs_in_again(server, roster):
+    server.expire_sessions()
+    with pytest.raises(SessionExpired):
+        roster.fetch_next_page_html(NEXT_MONTH)
+    assert not roster.logged_in
+    assert month_of(open_calendar(roster, server.username, server.password)) == (2024, 5, 3)
+    assert month_of(roster.fetch_next_page_html(NEXT_MONTH))[:2] == (2024, 6)
+
+
+@pytest.mark.parametrize('answer', [
+    lambda server, year, month: server.page(year, month),
+    lambda server, year, month: '99|updatePanel|ctl00_ContentPlaceHolder1_upCalendar|truncated|',
+    lambda server, year, month: '5|error|500|boom!|',
+], ids=['full_page', 'malformed_delta', 'error_delta'])
+def test_partial_postback_falls_back_to_full_page(answer):
+    with FakeRosterServer(today=(2024, 5), pages_dir=PAGES_DIR) as server:
+        server.delta = lambda year, month: answer(server, year, month)
+        roster = RosterSession(server.url)
+        roster.login(server.username, server.password)
+        assert month_of(roster.fetch_next_page_html(NEXT_MONTH))[:2] == (2024, 6)
+        assert month_of(roster.fetch_next_page_html(PREVIOUS_MONTH)) == (2024, 5, 3)
+        assert server.partial_posts == 1
+
+
+def test_partial_postbacks_can_be_turned_off():
+    with FakeRosterServer(today=(2024, 5), pages_dir=PAGES_DIR) as server:
+        roster = RosterSession(server.url, partial=False)
+        roster.login(server.username, server.password)
+        assert month_of(roster.fetch_next_page_html(NEXT_MONTH))[:2] == (2024, 6)
+        assert server.partial_posts == 0
+
+
+def test_parse_delta_reads_records_containing_separators():
+    assert parse_delta('3|updatePanel|p|a|b|2|hiddenField|__VIEWSTATE|xy|') == [
+        ('updatePanel', 'p', 'a|b'), ('hiddenField', '__VIEWSTATE', 'xy')]
+    with pytest.raises(PartialPostbackError):
+        parse_delta('<html>')
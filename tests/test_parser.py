@@ -0,0 +1,53 @@
+import datetime
+import glob
+import json
+import os
+
+import pytest
+
+from benchmarks import make_pages
+from mic_roster_parser import LENIENT, ParseReport, ShiftParseError, parse_calendar
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(make_pages.PAGES_DIR, '*.html'))))
+def test_corpus_pages_parse_to_expected_shifts(path):
+    month = parse_calendar(read(path))
+    expected = json.loads(read(path[:-len('.html')] + '.json'))
+    assert [{'start': s.start.isoformat(), 'end': s.end.isoformat(), 'code': s.code} for s in month.shifts] == \
+        expected['shifts']
+
+
+def test_cells_with_day_numbers_are_dated_by_them():
+    html = read(os.path.join(make_pages.PAGES_DIR, '2024-05.html'))
+    # Empty the first day's shift; the later cells keep their own dates.
+    first = parse_calendar(html).shifts
+    emptied = html.replace('<span class="dayNumber">1</span><div class="shift">', '<span class="dayNumber">1</span>'
+                           '<div class="shift"><!--', 1).replace('</div></td>', '--></div></td>', 1)
+    assert parse_calendar(emptied).shifts == tuple(s for s in first if s.start.day != 1)
+
+
+def test_cells_without_day_numbers_only_advance_on_text():
+    month = parse_calendar(read(os.path.join(PAGES_DIR, '2024-05.html')))
+    assert (month.year, month.month) == (2024, 5)
+    assert [(s.start, s.end, s.code) for s in month.shifts] == [
+        (datetime.datetime(2024, 5, 1, 6), datetime.datetime(2024, 5, 1, 14, 30), 'SURFACE'),
+        (datetime.datetime(2024, 5, 3, 22), datetime.datetime(2024, 5, 4, 6, 30), 'NIGHTS'),
+        (datetime.datetime(2024, 5, 5, 13), datetime.datetime(2024, 5, 5, 21, 30), 'PT-B/F'),
+    ]
+
+
+def test_strict_mode_raises_and_lenient_mode_reports():
+    html = read(os.path.join(PAGES_DIR, '2024-05.html')).replace('OFF', 'BOGUS')
+    with pytest.raises(ShiftParseError):
+        parse_calendar(html)
+    report = ParseReport()
+    month = parse_calendar(html, mode=LENIENT, report=report)
+    assert len(month.shifts) == 3
+    assert report.totals()['failed'] == 1